@@ -0,0 +1,110 @@
+"""
+Cold-start benchmark for the Cloud Function entry point.
+
+Imports `main` in fresh interpreters with `-X importtime`, from an empty
+working directory, and exits non-zero if:
+    - the median cumulative import time of `main` exceeds the budget,
+    - a heavy dependency that only some stages need is imported eagerly, or
+    - importing leaves files behind in the working directory.
+
+Usage:
+    python benchmarks/import_time.py [--budget-ms 400] [--runs 5] [--json results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported by the stages that use them.
+LAZY_MODULES = ["pandas", "numpy", "flask", "google.cloud.storage", "pyarrow", "zstandard"]
+
+
+def parse_importtime(stderr: str) -> dict:
+    """
+    Parse `-X importtime` output.
+
+    Returns:
+        dict: module name -> cumulative import time in microseconds.
+    """
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = int(cumulative_us)
+    return timings
+
+
+def measure_once(module: str = "main") -> tuple:
+    """
+    Import `module` in a fresh interpreter from an empty directory.
+
+    Returns:
+        tuple: (timings dict, list of files created in the working directory).
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, PYTHONPATH=REPO_ROOT, PYTHONDONTWRITEBYTECODE="1")
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=workdir, env=env, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{proc.stderr}")
+        return parse_importtime(proc.stderr), sorted(os.listdir(workdir))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Import-time / cold-start benchmark.")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", 400)),
+                        help="Max median cumulative import time of main (ms).")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to measure.")
+    parser.add_argument("--json", help="Optional path to write the results as JSON.")
+    args = parser.parse_args()
+
+    totals = []
+    timings = {}
+    side_effects = []
+    for _ in range(args.runs):
+        timings, created = measure_once()
+        totals.append(timings.get("main", 0) / 1000)
+        side_effects = side_effects or created
+
+    median_ms = statistics.median(totals)
+    eager = [m for m in LAZY_MODULES if m in timings]
+    slowest = sorted(timings.items(), key=lambda item: item[1], reverse=True)[:10]
+
+    print(f"import main: median {median_ms:.1f} ms over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    for name, cumulative_us in slowest:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failures = []
+    if median_ms > args.budget_ms:
+        failures.append(f"median import time {median_ms:.1f} ms exceeds budget {args.budget_ms:.0f} ms")
+    if eager:
+        failures.append(f"heavy modules imported eagerly: {', '.join(eager)}")
+    if side_effects:
+        failures.append(f"import created files: {', '.join(side_effects)}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "median_ms": median_ms,
+                "runs_ms": totals,
+                "budget_ms": args.budget_ms,
+                "eager_modules": eager,
+                "side_effects": side_effects,
+                "slowest": slowest,
+            }, f, indent=2)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
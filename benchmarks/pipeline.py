@@ -0,0 +1,593 @@
+"""
+Offline end-to-end benchmark for run_pipeline.
+
+Runs the real pipeline against local stand-ins, so no network or cloud
+credentials are needed:
+    - a local HTTP server generating Census-shaped payloads (list-of-lists
+      rows and the variables dict-of-dicts) at configurable sizes and
+      latencies,
+    - an in-process GCS stand-in installed with gcs_handler.set_client(),
+    - a config generated into a temporary working directory.
+
+Every run's summary (utils.metrics) is combined with a background RSS
+sampler to report, per stage: latency percentiles, throughput and peak RSS.
+The results are written as JSON so runs can be compared over time
+(--compare previous.json prints the change per stage).
+
+Usage:
+    python benchmarks/pipeline.py [--rows 50000] [--cols 8] [--variables 5000]
+        [--shards 8] [--endpoints 2] [--formats csv,json] [--stream]
+        [--encode-processes 4]
+        [--latency-ms 20] [--upload | --stream-upload] [--repeat 5] [--warmup 1]
+        [--output results.json] [--compare previous.json]
+"""
+import argparse
+import base64
+import hashlib
+import http.server
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from urllib.parse import parse_qs, urlparse
+
+import yaml
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+ENV = "bench"
+BUCKET = "bench-bucket"
+
+# First FIPS codes used for sharded endpoints.
+SHARD_STATES = ["01", "02", "04", "05", "06", "08", "09", "10", "11", "12", "13", "15", "16",
+                "17", "18", "19", "20", "21", "22", "23", "24", "25", "26", "27", "28", "29"]
+
+
+# --------------------------------------------------------------------------
+# Census API stand-in
+# --------------------------------------------------------------------------
+
+@lru_cache(maxsize=32)
+def rows_payload(rows: int, cols: int, state: str = "01") -> bytes:
+    """
+    Census list-of-lists body: header row, then `rows` rows of strings.
+
+    Values are deterministic; every 97th estimate is null, as Census does
+    for suppressed cells.
+    """
+    header = ["NAME"] + [f"B01001_{j + 1:03d}E" for j in range(cols)] + ["state", "county"]
+    body = [header]
+    for i in range(rows):
+        values = [None if (i + j) % 97 == 0 else str((i * 7919 + j * 104729) % 100000) for j in range(cols)]
+        body.append([f"County {i}, State {state}"] + values + [state, f"{i % 1000:03d}"])
+    return json.dumps(body).encode("utf-8")
+
+
+@lru_cache(maxsize=8)
+def variables_payload(count: int) -> bytes:
+    """Census variables.json body: {"variables": {name: {label, concept, ...}}}."""
+    variables = {
+        "for": {"label": "Census API FIPS 'for' clause", "concept": "Census API Geography Specification",
+                "predicateType": "fips-for", "group": "N/A", "limit": 0, "predicateOnly": True},
+        "in": {"label": "Census API FIPS 'in' clause", "concept": "Census API Geography Specification",
+               "predicateType": "fips-in", "group": "N/A", "limit": 0, "predicateOnly": True},
+    }
+    for i in range(count):
+        name = f"DP{i % 5 + 1:02d}_{i:04d}E"
+        variables[name] = {
+            "label": f"Estimate!!SEX AND AGE!!Total population!!Group {i}",
+            "concept": "SELECTED SOCIAL CHARACTERISTICS IN THE UNITED STATES",
+            "predicateType": "int",
+            "group": f"DP{i % 5 + 1:02d}",
+            "limit": 0,
+            "attributes": f"{name}A,{name[:-1]}M,{name[:-1]}MA",
+        }
+    return json.dumps({"variables": variables}).encode("utf-8")
+
+
+class CensusHandler(http.server.BaseHTTPRequestHandler):
+    """Serves /data/rows?rows=&cols=&in=state:XX and /data/variables.json?count=."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        time.sleep(self.server.latency)  # time to first byte
+        if url.path.endswith("/variables.json"):
+            body = variables_payload(int(query.get("count", ["1000"])[0]))
+        elif url.path.endswith("/rows"):
+            state = query.get("in", ["state:01"])[0].split(":")[-1]
+            body = rows_payload(int(query.get("rows", ["1000"])[0]), int(query.get("cols", ["8"])[0]), state)
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json;charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        view = memoryview(body)
+        for offset in range(0, len(body), 256 * 1024):
+            self.wfile.write(view[offset:offset + 256 * 1024])
+
+    def log_message(self, *args):
+        pass
+
+
+def start_census_server(latency_ms: float = 0.0) -> tuple:
+    """
+    Start the Census stand-in on a free local port.
+
+    Returns:
+        tuple: (server, base URL).
+    """
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), CensusHandler)
+    server.daemon_threads = True
+    server.latency = latency_ms / 1000
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+# --------------------------------------------------------------------------
+# GCS stand-in (the subset of google.cloud.storage the uploader uses)
+# --------------------------------------------------------------------------
+
+def _file_digests(path):
+    """md5 and crc32c (if google_crc32c is installed) of a file, base64 like GCS."""
+    md5 = hashlib.md5()
+    try:
+        import google_crc32c
+        crc = google_crc32c.Checksum()
+    except ImportError:
+        crc = None
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(chunk)
+            if crc is not None:
+                crc.update(chunk)
+            size += len(chunk)
+    return size, base64.b64encode(md5.digest()).decode(), (
+        base64.b64encode(crc.digest()).decode() if crc is not None else None
+    )
+
+
+class _LocalBlobWriter(io.RawIOBase):
+    """blob.open("wb") stand-in: hashes the stream, stores metadata on close."""
+
+    def __init__(self, blob, if_generation_match=None):
+        self._blob = blob
+        self._if_generation_match = if_generation_match
+        self._md5 = hashlib.md5()
+        self._size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._md5.update(data)
+        self._size += len(data)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        from google.api_core.exceptions import PreconditionFailed
+
+        bucket = self._blob.bucket
+        if bucket.client.bandwidth:
+            time.sleep(self._size / bucket.client.bandwidth)
+        with bucket.lock:
+            if self._if_generation_match == 0 and self._blob.name in bucket.objects:
+                raise PreconditionFailed(f"{self._blob.name} already exists")
+            bucket.objects[self._blob.name] = {
+                "size": self._size, "md5": base64.b64encode(self._md5.digest()).decode(), "crc32c": None,
+                "content_type": self._blob.content_type, "content_encoding": self._blob.content_encoding,
+            }
+
+
+class LocalBlob:
+    def __init__(self, bucket, name, chunk_size=None):
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size = chunk_size
+        self.content_type = None
+        self.content_encoding = None
+
+    @property
+    def _object(self):
+        return self.bucket.objects.get(self.name, {})
+
+    @property
+    def md5_hash(self):
+        return self._object.get("md5")
+
+    @property
+    def crc32c(self):
+        return self._object.get("crc32c")
+
+    @property
+    def size(self):
+        return self._object.get("size")
+
+    def upload_from_filename(self, filename, content_type=None, if_generation_match=None):
+        from google.api_core.exceptions import PreconditionFailed
+
+        size, md5, crc = _file_digests(filename)
+        if self.bucket.client.bandwidth:
+            time.sleep(size / self.bucket.client.bandwidth)
+        with self.bucket.lock:
+            if if_generation_match == 0 and self.name in self.bucket.objects:
+                raise PreconditionFailed(f"{self.name} already exists")
+            self.bucket.objects[self.name] = {
+                "size": size, "md5": md5, "crc32c": crc,
+                "content_type": content_type, "content_encoding": self.content_encoding,
+            }
+
+
+    def open(self, mode="wb", chunk_size=None, ignore_flush=None, content_type=None,
+             if_generation_match=None, **kwargs):
+        if mode != "wb":
+            raise ValueError("The GCS stand-in only supports streaming writes")
+        self.content_type = content_type
+        return _LocalBlobWriter(self, if_generation_match)
+
+
+class LocalBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def blob(self, name, chunk_size=None):
+        return LocalBlob(self, name, chunk_size)
+
+    def copy_blob(self, blob, destination_bucket, new_name):
+        with self.lock:
+            source = dict(self.objects[blob.name])
+        with destination_bucket.lock:
+            destination_bucket.objects[new_name] = source
+        return destination_bucket.blob(new_name)
+
+
+class LocalGCSClient:
+    """
+    In-process GCS stand-in. Only object metadata (size and hashes) is kept.
+
+    Args:
+        bandwidth (float): Simulated upload bandwidth in bytes/s (0 = unlimited).
+    """
+
+    def __init__(self, bandwidth=0.0):
+        self.bandwidth = bandwidth
+        self.buckets = {}
+
+    def get_bucket(self, name):
+        from google.cloud.exceptions import NotFound
+
+        if name not in self.buckets:
+            raise NotFound(f"bucket {name}")
+        return self.buckets[name]
+
+    def create_bucket(self, name):
+        return self.buckets.setdefault(name, LocalBucket(self, name))
+
+    def list_blobs(self, bucket, prefix=""):
+        bucket = bucket if isinstance(bucket, LocalBucket) else self.get_bucket(bucket)
+        with bucket.lock:
+            names = [name for name in bucket.objects if name.startswith(prefix or "")]
+        return [bucket.blob(name) for name in names]
+
+
+# --------------------------------------------------------------------------
+# Config, RSS sampling and statistics
+# --------------------------------------------------------------------------
+
+def build_config(base_url, args) -> dict:
+    """Generate a pipeline config exercising rows, variables and sharded endpoints."""
+    formats = [fmt.strip() for fmt in args.formats.split(",") if fmt.strip()]
+    endpoints = []
+    for i in range(args.endpoints):
+        endpoint = {
+            "name": f"rows_{i}",
+            "url": f"{base_url}/data/rows?rows={args.rows}&cols={args.cols}&in=state:01&copy={i}",
+            "output_formats": formats,
+            "gcs_path": f"rows_{i}",
+            "local_path": f"output/rows_{i}",
+        }
+        if args.stream:
+            endpoint["stream"] = True
+        if args.stream_upload:
+            endpoint.update(stream_upload=True, keep_local=False)
+        if args.encode_processes:
+            endpoint["parallel_encode"] = {"processes": args.encode_processes, "min_rows": 0}
+        endpoints.append(endpoint)
+    if args.variables:
+        endpoints.append({
+            "name": "variables",
+            "url": f"{base_url}/data/variables.json?count={args.variables}",
+            "output_formats": [fmt for fmt in formats if fmt in ("csv", "json", "txt")] or ["json"],
+            "gcs_path": "variables",
+            "local_path": "output/variables",
+        })
+    if args.shards:
+        endpoints.append({
+            "name": "sharded",
+            "url": f"{base_url}/data/rows?rows={max(1, args.rows // args.shards)}&cols={args.cols}&in=state:{{state}}",
+            "output_formats": formats,
+            "shard": {"params": {"state": SHARD_STATES[:args.shards]}, "max_workers": min(8, args.shards)},
+            "gcs_path": "sharded",
+            "local_path": "output/sharded",
+        })
+        if args.partition_by:
+            endpoints[-1]["partition_by"] = [column.strip() for column in args.partition_by.split(",")]
+    json_options = {}
+    if args.json_backend != "json":
+        json_options["backend"] = args.json_backend
+    if args.json_compact:
+        json_options["indent"] = None
+    for endpoint in endpoints:
+        if json_options and "json" in endpoint["output_formats"]:
+            endpoint["format_options"] = {"json": dict(json_options)}
+    return {
+        "environment": ENV.upper(),
+        "defaults": {
+            "local_only": not args.upload,
+            "bucket": BUCKET,
+            "gcs_path_prefix": "bench",
+            "create_bucket_if_missing": True,
+            "max_workers": args.max_workers,
+            "max_workers_per_host": args.max_workers,
+            "upload": {"max_workers": 8},
+        },
+        "endpoints": endpoints,
+    }
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (peak RSS where /proc is missing)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RssSampler:
+    """Samples (wall time, RSS) on a background thread every `interval` seconds."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append((time.time(), current_rss()))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.samples.append((time.time(), current_rss()))
+
+    def peak(self, start=None, end=None) -> int:
+        """Max RSS sampled in [start, end] (widened by one interval)."""
+        values = [
+            rss for at, rss in self.samples
+            if (start is None or at >= start - self.interval) and (end is None or at <= end + self.interval)
+        ]
+        return max(values, default=0)
+
+
+def percentile(values, q) -> float:
+    """Linear-interpolated percentile (q in 0..100) of a list of numbers."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def latency_stats(values) -> dict:
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50), 6),
+        "p90": round(percentile(values, 90), 6),
+        "p99": round(percentile(values, 99), 6),
+        "max": round(max(values, default=0.0), 6),
+    }
+
+
+def aggregate(runs) -> dict:
+    """Combine per-run summaries and RSS peaks into per-stage/per-endpoint statistics."""
+    stages = {}
+    endpoints = {}
+    for run in runs:
+        for name, result in run["summary"]["endpoints"].items():
+            endpoints.setdefault(name, []).append(result["wall_seconds"])
+            for stage_name, entry in result["stages"].items():
+                stage = stages.setdefault(stage_name, {
+                    "latencies": [], "wall_seconds": 0.0, "bytes_in": 0, "bytes_out": 0, "rows": 0,
+                    "retries": 0, "cache_hits": 0, "errors": 0, "peak_rss_bytes": 0,
+                })
+                stage["latencies"].append(entry["wall_seconds"])
+                for key in ("wall_seconds", "bytes_in", "bytes_out", "rows", "retries", "cache_hits", "errors"):
+                    stage[key] += entry[key]
+                stage["peak_rss_bytes"] = max(stage["peak_rss_bytes"], run["stage_rss"].get(stage_name, 0))
+
+    report = {}
+    for stage_name, stage in stages.items():
+        wall = stage.pop("wall_seconds") or 1e-9
+        report[stage_name] = dict(
+            latency_seconds=latency_stats(stage.pop("latencies")),
+            rows_per_second=round(stage["rows"] / wall, 1),
+            mb_in_per_second=round(stage["bytes_in"] / wall / 1e6, 3),
+            mb_out_per_second=round(stage["bytes_out"] / wall / 1e6, 3),
+            **stage,
+        )
+    return {
+        "stages": report,
+        "endpoints": {name: latency_stats(values) for name, values in endpoints.items()},
+        "runs": latency_stats([run["summary"]["wall_seconds"] for run in runs]),
+        "peak_rss_bytes": max((run["peak_rss_bytes"] for run in runs), default=0),
+    }
+
+
+def stage_peaks(summary, sampler) -> dict:
+    """Peak RSS during each stage's span (across endpoints) in one run."""
+    run_start = datetime.fromisoformat(summary["started_at"]).timestamp()
+    peaks = {}
+    for result in summary["endpoints"].values():
+        for stage_name, entry in result["stages"].items():
+            if entry.get("started_s") is None:
+                continue
+            peak = sampler.peak(run_start + entry["started_s"], run_start + entry["ended_s"])
+            peaks[stage_name] = max(peaks.get(stage_name, 0), peak)
+    return peaks
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result, previous=None):
+    print(f"run wall: p50 {result['runs']['p50']:.3f}s  p90 {result['runs']['p90']:.3f}s  "
+          f"peak RSS {result['peak_rss_bytes'] / 2**20:.1f} MiB")
+    print(f"{'stage':<8} {'p50 s':>9} {'p90 s':>9} {'p99 s':>9} {'rows/s':>12} "
+          f"{'MB/s in':>9} {'MB/s out':>9} {'peak MiB':>9}")
+    for stage_name, stage in result["stages"].items():
+        latency = stage["latency_seconds"]
+        line = (f"{stage_name:<8} {latency['p50']:>9.4f} {latency['p90']:>9.4f} {latency['p99']:>9.4f} "
+                f"{stage['rows_per_second']:>12.0f} {stage['mb_in_per_second']:>9.2f} "
+                f"{stage['mb_out_per_second']:>9.2f} {stage['peak_rss_bytes'] / 2**20:>9.1f}")
+        old = (previous or {}).get("stages", {}).get(stage_name)
+        if old and old["latency_seconds"]["p50"]:
+            change = latency["p50"] / old["latency_seconds"]["p50"] - 1
+            line += f"   p50 {change:+.1%} vs baseline"
+        print(line)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline end-to-end pipeline benchmark.")
+    parser.add_argument("--rows", type=int, default=50000, help="Rows per list-of-lists endpoint.")
+    parser.add_argument("--cols", type=int, default=8, help="Estimate columns per row.")
+    parser.add_argument("--variables", type=int, default=5000,
+                        help="Entries in the variables dict-of-dicts endpoint (0 = none).")
+    parser.add_argument("--shards", type=int, default=8, help="Shards of the sharded endpoint (0 = none).")
+    parser.add_argument("--endpoints", type=int, default=2, help="Number of list-of-lists endpoints.")
+    parser.add_argument("--formats", default="csv,json", help="Comma-separated output formats.")
+    parser.add_argument("--stream", action="store_true", help="Stream the list-of-lists endpoints.")
+    parser.add_argument("--encode-processes", type=int, default=0,
+                        help="Encode in-memory list-of-lists payloads across this many processes.")
+    parser.add_argument("--json-backend", choices=["json", "orjson"], default="json",
+                        help="JSON serializer for json output.")
+    parser.add_argument("--json-compact", action="store_true", help="Write json output without indentation.")
+    parser.add_argument("--partition-by", default="",
+                        help="Comma-separated columns to partition the sharded endpoint's output by (e.g. state).")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Server time to first byte.")
+    parser.add_argument("--upload", action="store_true", help="Upload to the in-process GCS stand-in.")
+    parser.add_argument("--stream-upload", action="store_true",
+                        help="Stream encoder output straight into uploads, without local files (implies --upload).")
+    parser.add_argument("--bandwidth-mbps", type=float, default=0.0,
+                        help="Simulated GCS upload bandwidth in MB/s (0 = unlimited).")
+    parser.add_argument("--max-workers", type=int, default=4, help="Endpoint worker threads.")
+    parser.add_argument("--repeat", type=int, default=5, help="Measured runs.")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured warm-up runs.")
+    parser.add_argument("--output", help="Results JSON path (default: benchmarks/results/pipeline-<utc>.json).")
+    parser.add_argument("--compare", help="Previous results JSON to compare against.")
+    args = parser.parse_args()
+    args.upload = args.upload or args.stream_upload
+
+    # Keep the pipeline's own logging out of the measurements
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("LOG_FILE", "0")
+
+    server, base_url = start_census_server(args.latency_ms)
+    config = build_config(base_url, args)
+    output = args.output or os.path.join(
+        REPO_ROOT, "benchmarks", "results", f"pipeline-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.json"
+    )
+    output = os.path.abspath(output)
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+
+    cwd = os.getcwd()
+    runs = []
+    with tempfile.TemporaryDirectory(prefix="pipeline-bench-") as workdir:
+        os.makedirs(os.path.join(workdir, "config"))
+        with open(os.path.join(workdir, "config", f"{ENV}.yml"), "w", encoding="utf-8") as f:
+            yaml.safe_dump(config, f, sort_keys=False)
+        os.chdir(workdir)
+        try:
+            import main as pipeline
+
+            if args.upload:
+                from utils.gcs_handler import set_client
+
+                set_client(LocalGCSClient(bandwidth=args.bandwidth_mbps * 1e6))
+
+            for i in range(args.warmup + args.repeat):
+                with RssSampler() as sampler:
+                    summary = pipeline.run_pipeline(ENV)
+                if summary["status"] != "success":
+                    print(json.dumps(summary, indent=2))
+                    raise RuntimeError(f"Benchmark run failed: {summary['status']}")
+                if i >= args.warmup:
+                    runs.append({
+                        "summary": summary,
+                        "stage_rss": stage_peaks(summary, sampler),
+                        "peak_rss_bytes": sampler.peak(),
+                    })
+        finally:
+            os.chdir(cwd)
+            server.shutdown()
+
+    result = {
+        "benchmark": "pipeline",
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": vars(args),
+        **aggregate(runs),
+        "run_summaries": [
+            {key: value for key, value in run["summary"].items() if key != "endpoints"} for run in runs
+        ],
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    print_report(result, previous)
+    print(f"results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
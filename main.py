@@ -1,229 +1,729 @@
-# import sys
-# import os
-
-# sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
-
-# from utils.config_loader import load_config
-# from utils.api_client import fetch_api_data
-# from utils.data_formatter import format_data
-# from utils.storage_handler import save_local
-# from utils.gcs_handler import upload_to_gcs
-# from utils.error_handler import handle_error
-# from utils.logger import get_logger
-# from utils.config_loader import load_config
-
-
-
-# logger = get_logger()
-
-# def main():
-#     env = os.getenv("ENV", "dev")
-#     config = load_config(env)
-
-#     defaults = config["defaults"]
-#     endpoints = config["endpoints"]
-
-#     for ep in endpoints:
-#         try:
-#             logger.info(f"📡 Fetching {ep['name']} from {ep['url']} ...")
-#             data = fetch_api_data(ep["url"], method=ep.get("method", "GET"))
-
-#             for fmt in ep["output_formats"]:
-#                 formatted = format_data(data, fmt)
-#                 local_file = save_local(formatted, fmt, ep["name"], base_path=ep.get("local_path", "output"))
-
-#                 if not defaults["local_only"]:
-#                     destination = f"{defaults['gcs_path_prefix']}/{ep['gcs_path']}/{os.path.basename(local_file)}"
-#                     upload_to_gcs(
-#                         defaults["bucket"],
-#                         local_file,
-#                         destination,
-#                         create_bucket=defaults.get("create_bucket_if_missing", False)
-#                     )
-#         except Exception as e:
-#             handle_error(e, context=ep["name"])
-
-# if __name__ == "__main__":
-#     main()
-################TESTED# main.py
-# import argparse
-# from flask import Request
-# from utils.config_loader import load_config
-# from utils.logger import get_logger
-# from utils.api_client import fetch_api_data
-# from utils.data_formatter import save_data_formats
-# from utils.storage_handler import save_local_file
-# from utils.gcs_handler import upload_to_gcs
-# from utils.error_handler import handle_exception
-
-# logger = get_logger()
-
-
-# def run_pipeline(env: str = "dev") -> None:
-#     """
-#     Run the full ETL pipeline for a given environment.
-
-#     Steps:
-#         1. Load environment-specific config.
-#         2. Fetch API data for each endpoint.
-#         3. Save data to local formats (csv/json/txt).
-#         4. Upload to GCS if enabled.
-#     """
-#     try:
-#         config = load_config(env)
-#         logger.info(f"🔧 Running pipeline in environment: {env}")
-
-#         for endpoint in config.get("endpoints", []):
-#             logger.info(f"📡 Fetching data for endpoint: {endpoint['name']}")
-
-#             # Step 1: Fetch data
-#             data = fetch_api_data(endpoint["url"], endpoint.get("method", "GET"))
-
-#             # Step 2: Save in multiple formats
-#             file_paths = save_data_formats(endpoint, data)
-
-#             # Step 3: Save locally
-#             for file_path in file_paths:
-#                 save_local_file(file_path)
-
-#                 # Step 4: Upload to GCS if not local_only
-#                 if not config["defaults"]["local_only"]:
-#                     upload_to_gcs(
-#                         bucket_name=config["defaults"]["bucket"],
-#                         source_file=file_path,
-#                         destination_blob=f"{config['defaults']['gcs_path_prefix']}/"
-#                                          f"{endpoint['gcs_path']}/"
-#                                          f"{file_path.split('/')[-1]}",
-#                         create_bucket=config["defaults"]["create_bucket_if_missing"],
-#                     )
-
-#         logger.info("✅ Pipeline execution completed successfully")
-
-#     except Exception as e:
-#         handle_exception(e)
-#         raise
-
-
-# # -------------------------------
-# # Entry point for Google Cloud Function
-# # -------------------------------
-# def main(request: Request):
-#     """
-#     HTTP Cloud Function entry point.
-#     Example:
-#         curl "https://REGION-PROJECT_ID.cloudfunctions.net/api-pipeline?env=qa"
-#     """
-#     env = request.args.get("env", "dev")  # default is "dev"
-#     run_pipeline(env)
-#     return f"Pipeline executed for environment: {env}", 200
-
-
-# # -------------------------------
-# # Entry point for local execution
-# # -------------------------------
-# if __name__ == "__main__":
-#     parser = argparse.ArgumentParser(description="Run API pipeline locally.")
-#     parser.add_argument("--env", default="dev", help="Environment: dev | qa | prod")
-#     args = parser.parse_args()
-
-#     run_pipeline(args.env)
-##########################################TESTEDEND#######################
-# main.py
-import argparse
-import os
-from flask import Request
-from utils.config_loader import load_config
-from utils.logger import get_logger
-from utils.api_client import fetch_api_data
-from utils.data_formatter import save_data_formats
-from utils.storage_handler import save_local_file
-from utils.gcs_handler import upload_to_gcs
-from utils.error_handler import handle_exception
-
-logger = get_logger()
-
-
-def run_pipeline(env: str = "dev") -> None:
-    """
-    Run the full ETL pipeline for a given environment.
-
-    Args:
-        env (str): Environment to run the pipeline in (dev, qa, prod).
-
-    Workflow:
-        1. Load environment-specific configuration from YAML.
-        2. Fetch data from all configured API endpoints.
-        3. Save API response in multiple formats (csv/json/txt).
-        4. Store locally (output/ for local runs, /tmp/ for GCF).
-        5. Upload to Google Cloud Storage if enabled in config.
-    """
-    try:
-        # Step 1: Load config
-        config = load_config(env)
-        logger.info(f"🔧 Running pipeline in environment: {env}")
-
-        # Step 2: Process each API endpoint
-        for endpoint in config.get("endpoints", []):
-            logger.info(f"📡 Fetching data for endpoint: {endpoint['name']}")
-
-            # Fetch data
-            data = fetch_api_data(endpoint["url"], endpoint.get("method", "GET"))
-
-            # Save in configured formats
-            file_paths = save_data_formats(endpoint, data)
-
-            # Save locally (uses /tmp in GCF, output/ locally)
-            for file_path in file_paths:
-                save_local_file(file_path)
-
-                # Upload to GCS if not local_only
-                if not config["defaults"]["local_only"]:
-                    destination_blob = (
-                        f"{config['defaults']['gcs_path_prefix']}/"
-                        f"{endpoint['gcs_path']}/"
-                        f"{os.path.basename(file_path)}"
-                    )
-                    upload_to_gcs(
-                        bucket_name=config["defaults"]["bucket"],
-                        source_file=file_path,
-                        destination_blob=destination_blob,
-                        create_bucket=config["defaults"]["create_bucket_if_missing"],
-                    )
-
-        logger.info("✅ Pipeline execution completed successfully")
-
-    except Exception as e:
-        handle_exception(e)
-        raise
-
-
-def main(request: Request):
-    """
-    Google Cloud Function HTTP entry point.
-
-    Args:
-        request (flask.Request): Incoming HTTP request object.
-
-    Returns:
-        tuple: Response message and HTTP status code.
-
-    Example:
-        curl "https://REGION-PROJECT_ID.cloudfunctions.net/api-pipeline?env=qa"
-    """
-    env = request.args.get("env", "dev")  # Default to 'dev'
-    run_pipeline(env)
-    return f"Pipeline executed for environment: {env}", 200
-
-
-if __name__ == "__main__":
-    """
-    Local execution entry point.
-    Example:
-        python main.py --env qa
-    """
-    parser = argparse.ArgumentParser(description="Run API pipeline locally.")
-    parser.add_argument("--env", default="dev", help="Environment: dev | qa | prod")
-    args = parser.parse_args()
-
-    run_pipeline(args.env)
-
+# import sys
+# import os
+
+# sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+# from utils.config_loader import load_config
+# from utils.api_client import fetch_api_data
+# from utils.data_formatter import format_data
+# from utils.storage_handler import save_local
+# from utils.gcs_handler import upload_to_gcs
+# from utils.error_handler import handle_error
+# from utils.logger import get_logger
+# from utils.config_loader import load_config
+
+
+
+# logger = get_logger()
+
+# def main():
+#     env = os.getenv("ENV", "dev")
+#     config = load_config(env)
+
+#     defaults = config["defaults"]
+#     endpoints = config["endpoints"]
+
+#     for ep in endpoints:
+#         try:
+#             logger.info(f"📡 Fetching {ep['name']} from {ep['url']} ...")
+#             data = fetch_api_data(ep["url"], method=ep.get("method", "GET"))
+
+#             for fmt in ep["output_formats"]:
+#                 formatted = format_data(data, fmt)
+#                 local_file = save_local(formatted, fmt, ep["name"], base_path=ep.get("local_path", "output"))
+
+#                 if not defaults["local_only"]:
+#                     destination = f"{defaults['gcs_path_prefix']}/{ep['gcs_path']}/{os.path.basename(local_file)}"
+#                     upload_to_gcs(
+#                         defaults["bucket"],
+#                         local_file,
+#                         destination,
+#                         create_bucket=defaults.get("create_bucket_if_missing", False)
+#                     )
+#         except Exception as e:
+#             handle_error(e, context=ep["name"])
+
+# if __name__ == "__main__":
+#     main()
+################TESTED# main.py
+# import argparse
+# from flask import Request
+# from utils.config_loader import load_config
+# from utils.logger import get_logger
+# from utils.api_client import fetch_api_data
+# from utils.data_formatter import save_data_formats
+# from utils.storage_handler import save_local_file
+# from utils.gcs_handler import upload_to_gcs
+# from utils.error_handler import handle_exception
+
+# logger = get_logger()
+
+
+# def run_pipeline(env: str = "dev") -> None:
+#     """
+#     Run the full ETL pipeline for a given environment.
+
+#     Steps:
+#         1. Load environment-specific config.
+#         2. Fetch API data for each endpoint.
+#         3. Save data to local formats (csv/json/txt).
+#         4. Upload to GCS if enabled.
+#     """
+#     try:
+#         config = load_config(env)
+#         logger.info(f"🔧 Running pipeline in environment: {env}")
+
+#         for endpoint in config.get("endpoints", []):
+#             logger.info(f"📡 Fetching data for endpoint: {endpoint['name']}")
+
+#             # Step 1: Fetch data
+#             data = fetch_api_data(endpoint["url"], endpoint.get("method", "GET"))
+
+#             # Step 2: Save in multiple formats
+#             file_paths = save_data_formats(endpoint, data)
+
+#             # Step 3: Save locally
+#             for file_path in file_paths:
+#                 save_local_file(file_path)
+
+#                 # Step 4: Upload to GCS if not local_only
+#                 if not config["defaults"]["local_only"]:
+#                     upload_to_gcs(
+#                         bucket_name=config["defaults"]["bucket"],
+#                         source_file=file_path,
+#                         destination_blob=f"{config['defaults']['gcs_path_prefix']}/"
+#                                          f"{endpoint['gcs_path']}/"
+#                                          f"{file_path.split('/')[-1]}",
+#                         create_bucket=config["defaults"]["create_bucket_if_missing"],
+#                     )
+
+#         logger.info("✅ Pipeline execution completed successfully")
+
+#     except Exception as e:
+#         handle_exception(e)
+#         raise
+
+
+# # -------------------------------
+# # Entry point for Google Cloud Function
+# # -------------------------------
+# def main(request: Request):
+#     """
+#     HTTP Cloud Function entry point.
+#     Example:
+#         curl "https://REGION-PROJECT_ID.cloudfunctions.net/api-pipeline?env=qa"
+#     """
+#     env = request.args.get("env", "dev")  # default is "dev"
+#     run_pipeline(env)
+#     return f"Pipeline executed for environment: {env}", 200
+
+
+# # -------------------------------
+# # Entry point for local execution
+# # -------------------------------
+# if __name__ == "__main__":
+#     parser = argparse.ArgumentParser(description="Run API pipeline locally.")
+#     parser.add_argument("--env", default="dev", help="Environment: dev | qa | prod")
+#     args = parser.parse_args()
+
+#     run_pipeline(args.env)
+##########################################TESTEDEND#######################
+# main.py
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from itertools import chain
+from typing import TYPE_CHECKING
+from utils.config_loader import load_plan
+from utils.logger import flush_logs, get_logger
+from utils.api_client import configure_session, fetch_api_data, fetch_api_data_cached, fetch_api_rows
+from utils.data_formatter import group_outputs, save_data_formats
+from utils.env import is_running_in_gcf
+from utils.http_cache import DEFAULT_MAX_BYTES, get_response_cache
+from utils.delta import DeltaTracker, LocalIndexStore, index_store
+from utils.sharding import build_shards, fetch_sharded_rows
+from utils.tabular import normalize_payload
+from utils.error_handler import handle_exception
+from utils.concurrency import run_concurrently
+from utils.manifest import COMPLETED_STATUSES, RunManifest, manifest_store, new_run_id
+from utils.metrics import collect, endpoint_scope, export_summary, record, stage, to_prometheus
+from utils.rate_limit import configure_rate_limits, rate_limit_stats
+from utils.scheduler import Schedule
+from utils.storage_handler import forget_checksums
+
+if TYPE_CHECKING:
+    from flask import Request
+
+logger = get_logger()
+
+# env -> unscheduled endpoint names run_due last warned about
+_warned_unscheduled = {}
+
+
+def _response_cache(defaults: dict):
+    """Shared response cache from defaults.http_cache (in /tmp on GCF)."""
+    settings = defaults.get("http_cache") or {}
+    default_dir = "/tmp/http_cache" if is_running_in_gcf() else ".cache/http"
+    return get_response_cache(
+        settings.get("dir", default_dir),
+        settings.get("max_bytes", DEFAULT_MAX_BYTES),
+    )
+
+
+def _state_dir(defaults: dict) -> str:
+    """Directory for persisted pipeline state (in /tmp on GCF)."""
+    return defaults.get("state_dir") or ("/tmp/state" if is_running_in_gcf() else ".state")
+
+
+def _object_name(endpoint, file_path):
+    """GCS object name of an output: its path under local_path, below the endpoint's gcs_destination."""
+    relative = os.path.relpath(file_path, endpoint["local_path"]).replace(os.sep, "/")
+    return f"{endpoint['gcs_destination']}/{relative}"
+
+
+def _upload_stream_factory(endpoint, defaults):
+    """Map an output path to a streaming upload under the endpoint's GCS destination."""
+    # google-cloud-storage is only imported by runs that upload
+    from utils.gcs_handler import open_upload_stream
+
+    def _open(file_path):
+        return open_upload_stream(
+            defaults["bucket"],
+            _object_name(endpoint, file_path),
+            create_bucket=defaults["create_bucket_if_missing"],
+            chunk_size=defaults.get("upload", {}).get("chunk_size"),
+        )
+    return _open
+
+
+def _iter_rows(data, flatten=None):
+    """Header+rows view of a payload (normalized once) or of a row stream."""
+    if isinstance(data, (dict, list)):
+        table = normalize_payload(data, flatten)
+        return chain([table.columns], table.rows)
+    return data
+
+
+def _run_endpoint(endpoint, defaults, manifest=None) -> dict:
+    """process_endpoint with its metrics attributed to the endpoint and its progress checkpointed."""
+    with endpoint_scope(endpoint["name"]):
+        if manifest is None:
+            return process_endpoint(endpoint, defaults)
+        checkpoint = manifest.endpoint(endpoint["name"])
+        try:
+            result = process_endpoint(endpoint, defaults, checkpoint)
+        except Exception as e:
+            checkpoint.fail(e)
+            raise
+        checkpoint.finish(result)
+        return result
+
+
+def _fetch_endpoint(endpoint, defaults, checkpoint=None):
+    """
+    Fetch an endpoint's data: a payload, or a header+rows stream for
+    streamed and sharded endpoints.
+
+    Returns:
+        tuple: (data, commit_cache). data is None if a cached response is
+        unchanged; commit_cache (None without a response cache) updates
+        the cache and is called once the output is stored.
+    """
+    http = {**defaults.get("http", {}), **endpoint.get("http", {})}
+    fetch_options = dict(
+        retries=http.get("retries", 3),
+        timeout=http.get("timeout", 30),
+        backoff_factor=http.get("backoff_factor", 0.5),
+        max_backoff=http.get("max_backoff", 30.0),
+    )
+    if endpoint.get("shard"):
+        # Fan out one sub-request per shard and stream-merge them in order;
+        # with a checkpoint, completed shards are spooled for a resumed run
+        shard = endpoint["shard"]
+        spool_shards = (defaults.get("manifest") or {}).get("spool_shards", True)
+        # One attempt per fetch: shard.retries/backoff retry a failed shard,
+        # so its sleeps and retry counts are not stacked on http.retries
+        shard_fetch_options = dict(fetch_options, retries=1)
+        rows = fetch_sharded_rows(
+            build_shards(endpoint["url"], shard.get("params", {})),
+            lambda url: fetch_api_data(url, endpoint["method"], **shard_fetch_options),
+            max_workers=shard.get("max_workers", 4),
+            retries=shard.get("retries", 2),
+            backoff=shard.get("backoff", 1.0),
+            spool=checkpoint.spool if checkpoint is not None and spool_shards else None,
+        )
+        return rows, None
+    if endpoint.get("stream", False):
+        # Rows are parsed incrementally and consumed once by the writers
+        rows = fetch_api_rows(
+            endpoint["url"],
+            endpoint["method"],
+            chunk_size=http.get("chunk_size", 64 * 1024),
+            **fetch_options,
+        )
+        return rows, None
+    if endpoint.get("cache_ttl") is not None:
+        # Conditional fetch; an unchanged response short-circuits the endpoint.
+        # The cache only records responses whose output was stored, so an
+        # endpoint whose last run failed is never "unchanged"
+        data, changed, commit_cache = fetch_api_data_cached(
+            endpoint["url"],
+            _response_cache(defaults),
+            endpoint["cache_ttl"],
+            endpoint["method"],
+            **fetch_options,
+        )
+        return (data if changed else None), commit_cache
+    return fetch_api_data(endpoint["url"], endpoint["method"], **fetch_options), None
+
+
+def process_endpoint(endpoint: dict, defaults: dict, checkpoint=None) -> dict:
+    """
+    Fetch, format, save and (optionally) upload a single API endpoint.
+
+    Args:
+        endpoint (Mapping): Resolved endpoint from the execution plan.
+        defaults (Mapping): The plan's 'defaults' section.
+        checkpoint (EndpointCheckpoint): Progress record of the endpoint in
+            the run manifest (see utils.manifest). Formats written and
+            objects uploaded by an earlier attempt of the run are skipped,
+            and the fetch too once every format is written; delta endpoints
+            are always redone in full.
+
+    Returns:
+        dict: {'status': 'success', 'files': [...], 'objects': [...]} with
+        the local files kept and the gs:// objects written, or, when the
+        endpoint has a cache_ttl and the response did not change since it
+        was cached, {'status': 'unchanged', 'files': []}. If a format could
+        not be written the status is 'partial' and 'failed_formats' lists
+        the missing ones; the formats that were written are still stored,
+        and a resumed run only writes the missing ones.
+    """
+    formats = list(endpoint["output_formats"])
+    timestamp = checkpoint.timestamp if checkpoint is not None else None
+    written = {}
+    if checkpoint is not None:
+        if endpoint.get("delta"):
+            # Delta output depends on the index state at fetch time
+            checkpoint.reset_outputs()
+        else:
+            written = {fmt: file_paths for fmt, file_paths in checkpoint.written_formats().items()
+                       if fmt in formats and (not endpoint["keep_local"] or all(map(os.path.exists, file_paths)))}
+    missing = [fmt for fmt in formats if fmt not in written]
+
+    tracker = commit_cache = None
+    if not missing:
+        logger.info("⏩ %s: every format was written by an earlier attempt; skipping fetch", endpoint["name"])
+    else:
+        logger.info("📡 Fetching data for endpoint: %s", endpoint["name"])
+
+        # Streamed and sharded bodies are read lazily, so most of their fetch time
+        # lands in the format stage; their bytes/retries are still counted as fetch.
+        with stage("fetch"):
+            data, commit_cache = _fetch_endpoint(endpoint, defaults, checkpoint)
+            if data is None:
+                if commit_cache is not None:
+                    commit_cache()
+                logger.info("⏭️ %s unchanged since last fetch; skipping format/upload", endpoint["name"])
+                return {"status": "unchanged", "files": []}
+
+        # Delta mode: keep only rows inserted/updated/deleted since the last run
+        if endpoint.get("delta"):
+            delta = endpoint["delta"]
+            tracker = DeltaTracker(
+                endpoint["name"],
+                delta.get("key_columns"),
+                LocalIndexStore(delta["state_dir"]) if "state_dir" in delta
+                else index_store(defaults, _state_dir(defaults)),
+                delta.get("compact_every", 24),
+            )
+            delta_rows = tracker.apply(_iter_rows(data, endpoint.get("flatten")))
+            header = next(delta_rows, None)  # decides delta vs full snapshot
+            data = chain([header], delta_rows) if header is not None else iter(())
+            if not tracker.full:
+                endpoint = dict(endpoint, name=f"{endpoint['name']}_delta")
+
+        # Save in configured formats under the endpoint's local_path. With
+        # stream_upload the encoded bytes go straight into resumable GCS uploads
+        # (the local file is then an optional tee), so upload overlaps this stage.
+        stream_upload = endpoint["stream_upload"] and endpoint["gcs_destination"]
+        with stage("format"):
+            file_paths = save_data_formats(
+                dict(endpoint, output_formats=missing),
+                data,
+                folder=endpoint["local_path"],
+                upload=_upload_stream_factory(endpoint, defaults) if stream_upload else None,
+                keep_local=endpoint["keep_local"],
+                timestamp=timestamp,
+            )
+            if endpoint["keep_local"]:
+                record(bytes_out=sum(os.path.getsize(file_path) for file_path in file_paths))
+        new = group_outputs(endpoint, missing, file_paths)
+        if checkpoint is not None:
+            checkpoint.record_formats(new, [fmt for fmt in missing if fmt not in new])
+            if stream_upload:
+                checkpoint.record_uploads([_object_name(endpoint, file_path) for file_path in file_paths], [])
+        written.update(new)
+
+    file_paths = [file_path for fmt in formats for file_path in written.get(fmt, [])]
+    destinations = [
+        _object_name(endpoint, file_path) for file_path in file_paths
+    ] if endpoint["gcs_destination"] else []
+    # destination -> existing object holding the same content (dedup 'skip')
+    deduplicated = checkpoint.deduplicated() if checkpoint is not None else {}
+    local_files = file_paths if endpoint["keep_local"] else []
+
+    if tracker is not None and not tracker.full and tracker.changes == 0:
+        for file_path in file_paths:
+            os.remove(file_path)
+            forget_checksums(file_path)
+        tracker.commit()
+        if commit_cache is not None:
+            commit_cache()
+        logger.info("⏭️ %s: no row changes; nothing to upload", endpoint["name"])
+        return {"status": "unchanged", "files": []}
+
+    # Upload to GCS if not local_only (and not already streamed), all files
+    # of the endpoint in one batch; objects stored by an earlier attempt are skipped
+    uploads = list(zip(file_paths, destinations)) if not endpoint["stream_upload"] else []
+    if checkpoint is not None:
+        uploads = [(file_path, destination) for file_path, destination in uploads
+                   if not checkpoint.uploaded(destination)]
+    for file_path in set(file_paths).difference(file_path for file_path, _ in uploads):
+        forget_checksums(file_path)  # no upload will look its checksums up
+    if uploads:
+        with stage("upload"):
+            # google-cloud-storage is only imported by runs that upload
+            from utils.gcs_handler import upload_many_to_gcs
+
+            upload_options = defaults.get("upload", {})
+            results = upload_many_to_gcs(
+                bucket_name=defaults["bucket"],
+                uploads=uploads,
+                create_bucket=defaults["create_bucket_if_missing"],
+                max_workers=upload_options.get("max_workers", 8),
+                chunk_size=upload_options.get("chunk_size"),
+                composite_threshold=upload_options.get("composite_threshold"),
+                dedup=upload_options.get("dedup"),
+                dedup_prefix=f"{endpoint['gcs_destination']}/",
+            )
+            stored = {destination: stored_as for _, destination, error, stored_as in results
+                      if error is None and stored_as != destination}
+            deduplicated.update(stored)
+            if checkpoint is not None:
+                checkpoint.record_uploads(
+                    [destination for _, destination, error, _ in results if error is None],
+                    [destination for _, destination, error, _ in results if error is not None],
+                    stored,
+                )
+            errors = [error for _, _, error, _ in results if error is not None]
+            if errors:
+                raise RuntimeError(f"{len(errors)} of {len(uploads)} upload(s) failed for {endpoint['name']}") from errors[0]
+
+    objects = [f"gs://{defaults['bucket']}/{deduplicated.get(destination, destination)}"
+               for destination in destinations]
+    failed_formats = [fmt for fmt in formats if fmt not in written]
+    if failed_formats:
+        # Leave the delta index and the response cache as they were, so the
+        # next run does not skip the data these formats are missing
+        logger.warning("⚠️ %s: %s not written", endpoint["name"], ", ".join(failed_formats))
+        return {"status": "partial", "files": local_files, "objects": objects,
+                "failed_formats": failed_formats}
+
+    # Only advance the delta index and the response cache once the output
+    # is safely stored
+    if tracker is not None:
+        tracker.commit()
+    if commit_cache is not None:
+        commit_cache()
+    return {"status": "success", "files": local_files, "objects": objects}
+
+
+def _open_manifest(env, defaults, resume=None):
+    """The run manifest for a new run, or the saved one of the run being resumed."""
+    settings = defaults.get("manifest") or {}
+    if not settings.get("enabled", True):
+        if resume:
+            raise ValueError("Cannot resume a run: defaults.manifest.enabled is false")
+        return None
+    store = manifest_store(defaults, _state_dir(defaults))
+    if resume:
+        return RunManifest.load(resume, env, store, _state_dir(defaults))
+    return RunManifest(new_run_id(), env, store, _state_dir(defaults))
+
+
+def run_pipeline(env: str = "dev", endpoints=None, resume=None) -> dict:
+    """
+    Run the full ETL pipeline for a given environment.
+
+    Args:
+        env (str): Environment to run the pipeline in (dev, qa, prod).
+        endpoints (list): Names of the endpoints to run, started in this
+            order (default: every endpoint, in config order; when resuming,
+            the endpoints of the resumed run).
+        resume (str): run_id of an earlier run to resume. Its manifest
+            records what that run completed (see utils.manifest):
+            succeeded endpoints are reported from it without running again
+            and the others pick up where they stopped, writing the same
+            file and object names.
+
+    Workflow:
+        1. Load the environment's execution plan (config/<env>.yml or .yaml,
+           validated and cached until the file changes).
+        2. Fetch data from all configured API endpoints, concurrently
+           (defaults.max_workers threads, at most defaults.max_workers_per_host
+           per API host).
+        3. Save API response in multiple formats (csv/json/txt).
+        4. Store locally under each endpoint's local_path (inside /tmp/ on GCF).
+        5. Upload to Google Cloud Storage if enabled in config.
+
+    Returns:
+        dict: Run summary (see utils.metrics.RunMetrics.summary): run_id,
+        overall 'status' ('success', 'partial' or 'failed'), wall time,
+        totals, and 'endpoints' keyed by endpoint name, each with a
+        'status' ('success', 'unchanged', 'partial' or 'failed'), 'files'
+        or 'error',
+        and per-stage (fetch/format/upload) wall time, bytes, rows,
+        retries, cache hits and throttled responses (endpoints completed
+        by the resumed run are marked 'resumed'); plus 'rate_limits'
+        with each API host's current rate, concurrency window and peak
+        queue depth, and 'manifest', where the run's progress is recorded.
+        A failing endpoint does not stop the others.
+    """
+    try:
+        # Step 1: Load the execution plan (parsed and validated once per warm instance)
+        plan = load_plan(env)
+        defaults = plan["defaults"]
+        manifest = _open_manifest(env, defaults, resume)
+        if manifest is not None and resume and endpoints is None:
+            endpoints = list(manifest.data["endpoints"])
+        selected = plan["endpoints"]
+        if endpoints is not None:
+            by_name = {endpoint["name"]: endpoint for endpoint in plan["endpoints"]}
+            unknown = [name for name in endpoints if name not in by_name]
+            if unknown:
+                raise ValueError(f"Unknown endpoint(s) for {env}: {', '.join(unknown)}")
+            selected = [by_name[name] for name in endpoints]
+        logger.info("🔧 Running pipeline in environment: %s", env)
+
+        # Size the shared keep-alive pool so per-host workers never wait on a socket
+        http = defaults.get("http", {})
+        configure_session(
+            pool_size=http.get("pool_size", max(10, defaults["max_workers"])),
+            pool_block=http.get("pool_block", True),
+        )
+        # Process-wide adaptive limiter per API host, shared by all workers and shards
+        configure_rate_limits(defaults.get("rate_limit"))
+        if manifest is not None:
+            manifest.start([endpoint["name"] for endpoint in selected])
+    except Exception as e:
+        handle_exception(e, context=f"config:{env}")
+        raise
+
+    # Endpoints the resumed run already completed are reported as they were
+    pending = selected
+    resumed = {}
+    if manifest is not None and resume:
+        pending = [endpoint for endpoint in selected if not manifest.completed(endpoint["name"])]
+        resumed = {endpoint["name"]: dict(manifest.result(endpoint["name"]), resumed=True)
+                   for endpoint in selected if manifest.completed(endpoint["name"])}
+        logger.info("⏩ Resuming run %s: %d endpoint(s) already done, %d to go", resume, len(resumed), len(pending))
+
+    # Step 2: Process every API endpoint on a bounded worker pool, collecting
+    # per-stage metrics (workers inherit the collector through their context)
+    with collect(env, run_id=manifest.run_id if manifest is not None else None) as run:
+        outcomes = run_concurrently(
+            lambda endpoint: _run_endpoint(endpoint, defaults, manifest),
+            pending,
+            max_workers=defaults["max_workers"],
+            key=lambda endpoint: endpoint["host"],
+            per_key_limit=defaults.get("max_workers_per_host"),
+        )
+
+    outcomes = {endpoint["name"]: (result, error) for endpoint, result, error in outcomes}
+    results = {}
+    for endpoint in selected:
+        name = endpoint["name"]
+        if name in resumed:
+            results[name] = resumed[name]
+            continue
+        result, error = outcomes[name]
+        if error is not None:
+            handle_exception(error, context=name)
+            results[name] = {"status": "failed", "error": str(error)}
+        else:
+            results[name] = result
+
+    failed = [name for name, result in results.items() if result["status"] not in COMPLETED_STATUSES]
+    if failed:
+        logger.warning("⚠️ Pipeline finished with %d failed or partial endpoint(s): %s", len(failed), ", ".join(failed))
+        if manifest is not None:
+            logger.info("🔁 Resume the failed work with: --resume %s", manifest.run_id)
+    else:
+        logger.info("✅ Pipeline execution completed successfully")
+
+    summary = run.summary(results)
+    summary["rate_limits"] = rate_limit_stats(reset_peaks=True)
+    if manifest is not None:
+        summary["manifest"] = manifest.store.location(manifest.run_id)
+        try:
+            manifest.finish(summary["status"])
+        except Exception as e:
+            handle_exception(e, context=f"manifest:{manifest.run_id}")
+    export_summary(summary, defaults.get("metrics"))
+    return summary
+
+
+def run_due(env: str = "dev", now=None):
+    """
+    Run only the endpoints whose refresh_interval has elapsed.
+
+    Due times come from the persisted last run of each endpoint (see
+    utils.scheduler); endpoints without a refresh_interval are not
+    scheduled and are skipped (with a warning). Due endpoints are started
+    highest priority first.
+
+    On Cloud Functions the last runs would be kept in /tmp and forgotten on
+    every cold start, making everything due again, so due mode requires
+    defaults.state_dir (e.g. a mounted volume) there.
+
+    Args:
+        env (str): Environment to run the pipeline in (dev, qa, prod).
+        now (float): Unix timestamp to evaluate due times at (default: now).
+
+    Returns:
+        dict: Run summary as returned by run_pipeline, or None if nothing
+        was due.
+
+    Raises:
+        ValueError: On Cloud Functions without defaults.state_dir.
+    """
+    plan = load_plan(env)
+    if is_running_in_gcf() and not plan["defaults"].get("state_dir"):
+        raise ValueError("Due mode on Cloud Functions needs defaults.state_dir on durable storage "
+                         "(the schedule state in /tmp is lost on cold starts)")
+    schedule = Schedule(env, plan, _state_dir(plan["defaults"]))
+    unscheduled = schedule.unscheduled()
+    if unscheduled and _warned_unscheduled.get(env) != unscheduled:
+        # Once per process and config, not on every scheduler tick
+        _warned_unscheduled[env] = unscheduled
+        logger.warning("⚠️ Not scheduled in %s (no refresh_interval): %s", env, ", ".join(unscheduled))
+    started = time.time() if now is None else now
+    due = schedule.due(started)
+    if not due:
+        return None
+    logger.info("⏰ Due in %s: %s", env, ", ".join(due))
+    summary = run_pipeline(env, endpoints=due)
+    schedule.record(summary, started)
+    return summary
+
+
+def run_scheduler(env: str = "dev", stop=None) -> None:
+    """
+    Long-running scheduler: run due endpoints, sleep until the next one is due, repeat.
+
+    Staying in one process keeps the pooled HTTP connections, the response
+    cache and the compiled plan warm between runs; config changes are
+    picked up on the next pass. Each endpoint runs on its own
+    refresh_interval, on a fixed per-endpoint phase so endpoints sharing an
+    interval don't all start at once (defaults.scheduler.jitter).
+
+    Args:
+        env (str): Environment to run the pipeline in (dev, qa, prod).
+        stop (threading.Event): Set to stop after the current pass.
+    """
+    stop = stop or threading.Event()
+    logger.info("🗓️ Scheduler started for environment: %s", env)
+    while not stop.is_set():
+        try:
+            run_due(env)
+            plan = load_plan(env)
+            wait = Schedule(env, plan, _state_dir(plan["defaults"])).seconds_until_due()
+        except Exception as e:
+            handle_exception(e, context=f"scheduler:{env}")
+            wait = 60.0  # e.g. a broken config; retry once it is fixed
+        finally:
+            flush_logs()
+        stop.wait(wait)
+    logger.info("🛑 Scheduler stopped")
+
+
+def main(request: "Request"):
+    """
+    Google Cloud Function HTTP entry point.
+
+    Args:
+        request (flask.Request): Incoming HTTP request object.
+
+    Returns:
+        tuple: The run summary as JSON (or Prometheus text with
+        ?metrics=prometheus) and the HTTP status code (500 if any endpoint
+        failed).
+
+    Example:
+        curl "https://REGION-PROJECT_ID.cloudfunctions.net/api-pipeline?env=qa"
+        curl ".../api-pipeline?env=qa&due=1"   # only endpoints that are due (needs defaults.state_dir)
+        curl ".../api-pipeline?env=qa&resume=<run_id>"   # finish a failed run
+    """
+    env = request.args.get("env", "dev")  # Default to 'dev'
+    try:
+        if request.args.get("resume"):
+            summary = run_pipeline(env, resume=request.args["resume"])
+        elif request.args.get("due") in ("1", "true"):
+            summary = run_due(env)
+            if summary is None:
+                return {"status": "idle", "endpoints": {}}, 200
+        else:
+            summary = run_pipeline(env)
+    finally:
+        flush_logs()  # CPU may be throttled once the response is sent
+    status_code = 200 if summary["status"] == "success" else 500
+    if request.args.get("metrics") == "prometheus":
+        return to_prometheus(summary), status_code, {"Content-Type": "text/plain; version=0.0.4"}
+    return summary, status_code  # Flask serializes the dict as JSON
+
+
+if __name__ == "__main__":
+    """
+    Local execution entry point.
+    Example:
+        python main.py --env qa
+        python main.py --env prod --daemon
+        python main.py --env qa --resume 3f2a9c1b7d4e
+    """
+    parser = argparse.ArgumentParser(description="Run API pipeline locally.")
+    parser.add_argument("--env", default="dev", help="Environment: dev | qa | prod")
+    parser.add_argument("--due", action="store_true",
+                        help="Run only the endpoints whose refresh_interval has elapsed")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Keep running, executing each endpoint on its refresh_interval")
+    parser.add_argument("--resume", metavar="RUN_ID",
+                        help="Resume a failed run, skipping the work it completed")
+    parser.add_argument("--metrics", choices=["json", "prometheus"],
+                        help="Print the run summary to stdout in this format")
+    args = parser.parse_args()
+
+    if args.daemon:
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+        run_scheduler(args.env, stop)
+        sys.exit(0)
+
+    if args.resume:
+        summary = run_pipeline(args.env, resume=args.resume)
+    else:
+        summary = run_due(args.env) if args.due else run_pipeline(args.env)
+    if summary is None:
+        logger.info("💤 No endpoints due")
+        sys.exit(0)
+    if args.metrics == "json":
+        print(json.dumps(summary, indent=2))
+    elif args.metrics == "prometheus":
+        print(to_prometheus(summary), end="")
+    if summary["status"] != "success":
+        sys.exit(1)
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+import utils.gcs_handler as gcs_handler
+
+
+class FakeAPI:
+    """Stands in for fetch_api_data and upload_many_to_gcs, failing on demand."""
+
+    def __init__(self):
+        self.fetched, self.uploaded = [], []
+        self.fetch_options = []  # keyword arguments of each fetch
+        self.failing_urls, self.failing_uploads = set(), set()
+        self.responses = {}  # url -> payload, instead of two rows named after the url
+
+    def fetch(self, url, method="GET", **kwargs):
+        self.fetched.append(url)
+        self.fetch_options.append(kwargs)
+        if url in self.failing_urls:
+            raise ConnectionError(url)
+        if url in self.responses:
+            return self.responses[url]
+        return [["NAME", "POP"], [f"{url} a", "1"], [f"{url} b", "2"]]
+
+    def upload_many(self, bucket_name, uploads, **kwargs):
+        results = []
+        for file_path, destination in uploads:
+            self.uploaded.append(destination)
+            error = OSError(destination) if destination.endswith(tuple(self.failing_uploads)) else None
+            results.append((file_path, destination, error, destination))
+        return results
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    """run_pipeline over a config in tmp_path, with a LocalStore manifest under tmp_path/state."""
+    import main
+
+    api = FakeAPI()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, "fetch_api_data", api.fetch)
+    monkeypatch.setattr(gcs_handler, "upload_many_to_gcs", api.upload_many)
+
+    def _configure(*endpoints):
+        config = {
+            "environment": "TEST",
+            "defaults": {"local_only": False, "bucket": "b", "gcs_path_prefix": "p",
+                         "state_dir": str(tmp_path / "state"), "manifest": {"store": "local"},
+                         "http": {"retries": 1, "backoff_factor": 0}},
+            "endpoints": [dict({"local_path": str(tmp_path / "output"), "gcs_path": endpoint["name"]}, **endpoint)
+                          for endpoint in endpoints],
+        }
+        (tmp_path / "config").mkdir(exist_ok=True)
+        (tmp_path / "config" / "test.yml").write_text(json.dumps(config))
+        return main.run_pipeline
+
+    api.configure = _configure
+    return api
@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+from utils.api_client import iter_json_array
+
+ROWS = [
+    ["NAME", "POP", "state"],
+    ["Doña Ana County, New Mexico", "219561", "35"],
+    ["Añasco Municipio, Puerto Rico", None, "72"],
+    [12345, -1.5e-3, True, False, {"a": [1, "]"]}, "quote \" comma , bracket ]"],
+]
+BODY = json.dumps(ROWS, ensure_ascii=False).encode("utf-8")
+
+
+def _parse(*chunks):
+    return list(iter_json_array(chunks))
+
+
+def test_parses_a_single_chunk():
+    assert _parse(BODY) == ROWS
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+def test_values_split_across_chunks(size):
+    chunks = [BODY[i:i + size] for i in range(0, len(BODY), size)]
+    assert _parse(*chunks) == ROWS
+
+
+def test_every_split_point():
+    body = b'[12, "\xc3\xb1", 3.5, [null, "a,]"], 1e5]'
+    expected = json.loads(body)
+    for i in range(len(body) + 1):
+        assert _parse(body[:i], body[i:]) == expected, i
+
+
+def test_numbers_are_not_cut_at_chunk_boundaries():
+    assert _parse(b"[1", b"23", b"4, 5", b"6]") == [1234, 56]
+    assert _parse(b"[3.", b"5, -", b"2e", b"-", b"3, 1E", b"+2]") == [3.5, -2e-3, 1e2]
+
+
+@pytest.mark.parametrize("body", [b"[]", b"  [ ]  ", b"[\r\n]"])
+def test_empty_arrays(body):
+    assert _parse(body) == []
+
+
+def test_whitespace_and_empty_chunks():
+    assert _parse(b"", b" \n[", b"", b' 1 ,\t"a"\n', b"]", b"") == [1, "a"]
+
+
+@pytest.mark.parametrize("body", [b'{"a": [1, 2]}', b'"text"', b"1", b"null"])
+def test_non_array_payloads_are_rejected(body):
+    with pytest.raises(ValueError, match="top-level JSON array"):
+        _parse(body)
+
+
+@pytest.mark.parametrize("body", [b"", b"  \n"])
+def test_empty_bodies_are_rejected(body):
+    with pytest.raises(ValueError, match="Empty response body"):
+        _parse(body)
+
+
+@pytest.mark.parametrize("body", [b"[", b"[1,", b"[1, 2", b'[["a", "b"]', b"[1]"[:-1]])
+def test_truncated_bodies_are_rejected(body):
+    with pytest.raises(ValueError):
+        _parse(body)
+
+
+@pytest.mark.parametrize("body", [b'[["a"', b'[["a", "b', b"[1, [2"])
+def test_truncated_elements_are_rejected(body):
+    with pytest.raises(ValueError):
+        _parse(*[body[i:i + 2] for i in range(0, len(body), 2)])
+
+
+@pytest.mark.parametrize("body,message", [
+    (b"[1 2]", "expected ',' or ']'"),
+    (b"[1,,2]", "unexpected ','"),
+    (b"[,1]", "unexpected ','"),
+    (b"[1,]", "unexpected ']'"),
+    (b"[1; 2]", "expected ',' or ']'"),
+])
+def test_malformed_arrays_are_rejected(body, message):
+    with pytest.raises(ValueError, match=message):
+        _parse(body)
+
+
+def test_malformed_elements_are_rejected():
+    with pytest.raises(ValueError):
+        _parse(b'[["a", nope]]')
+
+
+def test_invalid_utf8_is_rejected():
+    with pytest.raises(ValueError):
+        _parse(b'["\xff"]')
+
+
+def test_elements_before_an_error_are_yielded():
+    rows = iter_json_array([b'[["NAME"], ["a"]', b", ["])
+    assert next(rows) == ["NAME"]
+    assert next(rows) == ["a"]
+    with pytest.raises(ValueError):
+        next(rows)
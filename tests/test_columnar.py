@@ -0,0 +1,86 @@
+import io
+
+import pytest
+
+from utils.columnar import ColumnarRowWriter, encode_columnar, infer_schema
+from utils.data_formatter import save_data_formats
+from utils.tabular import Table
+
+ipc = pytest.importorskip("pyarrow.ipc")
+pq = pytest.importorskip("pyarrow.parquet")
+
+HEADER = ["NAME", "POP", "RATE", "state"]
+ROWS = [[f"County {i}", str(i * 10), f"{i}.5", "01" if i % 2 else "02"] for i in range(7)]
+
+
+def _stream(rows, fmt="parquet", row_group_size=2, schema=None):
+    fh = io.BytesIO()
+    writer = ColumnarRowWriter(fh, fmt, "zstd", row_group_size, schema)
+    writer.write_row(HEADER)
+    for row in rows:
+        writer.write_row(row)
+    writer.close()
+    return fh.getvalue()
+
+
+def _read(data, fmt="parquet"):
+    if fmt == "parquet":
+        return pq.read_table(io.BytesIO(data))
+    return ipc.open_file(io.BytesIO(data)).read_all()
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_types_are_inferred_over_all_rows(fmt):
+    table = _read(_stream(ROWS, fmt), fmt)
+    assert [str(field.type) for field in table.schema] == ["string", "int64", "double", "string"]
+    assert table.column("POP").to_pylist() == [i * 10 for i in range(7)]
+    assert table.column("state").to_pylist()[:2] == ["02", "01"]  # leading zeros kept
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_type_drift_after_the_first_row_group_widens_the_column(fmt):
+    rows = [list(row) for row in ROWS]
+    rows[5][1] = "N"   # a suppressed count in a numeric column
+    rows[6][2] = "7"   # an integer among decimals stays a double
+    table = _read(_stream(rows, fmt), fmt)
+    assert str(table.schema.field("POP").type) == "string"
+    assert table.column("POP").to_pylist() == [str(i * 10) for i in range(5)] + ["N", "60"]
+    assert str(table.schema.field("RATE").type) == "double"
+    assert table.column("RATE").to_pylist()[-1] == 7.0
+
+
+def test_int_column_widens_to_float():
+    rows = [["a", "1", "1", "01"], ["b", "2", "2", "01"], ["c", "2.5", "3", "01"]]
+    table = _read(_stream(rows))
+    assert str(table.schema.field("POP").type) == "double"
+    assert str(table.schema.field("RATE").type) == "int64"
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_streamed_output_matches_the_table_encoder(fmt):
+    fh = io.BytesIO()
+    encode_columnar(fmt)(Table(HEADER, ROWS), fh, row_group_size=2)
+    assert _stream(ROWS, fmt) == fh.getvalue()
+
+
+def test_header_only_writes_an_empty_string_table():
+    table = _read(_stream([]))
+    assert table.num_rows == 0
+    assert table.column_names == HEADER
+
+
+def test_explicit_schema_mismatch_is_rejected():
+    schema = infer_schema(HEADER, ROWS)
+    with pytest.raises(ValueError, match="POP"):
+        _stream(ROWS + [["x", "N", "1.5", "01"]], schema=schema)
+
+
+def test_partition_files_share_the_partition_schema(tmp_path):
+    rows = [[f"County {i}", str(i) if i < 2500 else "N", "1.5", "01"] for i in range(3000)]
+    endpoint = {"name": "pop", "output_formats": ["parquet"], "partition_by": ["state"],
+                "partition_options": {"max_bytes": 1}, "format_options": {"parquet": {"row_group_size": 500}}}
+    file_paths = save_data_formats(endpoint, iter([HEADER] + rows), str(tmp_path), timestamp="20240101000000")
+    assert len(file_paths) > 1
+    schemas = {str(pq.read_schema(file_path).field("POP").type) for file_path in file_paths}
+    assert schemas == {"string"}
+    assert sum(pq.read_metadata(file_path).num_rows for file_path in file_paths) == 3000
@@ -0,0 +1,123 @@
+import json
+import os
+from types import MappingProxyType
+
+import pytest
+
+import utils.config_loader as config_loader
+from utils.config_loader import load_plan, validate_config
+
+
+def _config(**endpoint):
+    return {
+        "defaults": {"local_only": True},
+        "endpoints": [dict({"name": "pop", "url": "http://api/pop?in=state:{state}" if "shard" in endpoint
+                            else "http://api/pop"}, **endpoint)],
+    }
+
+
+def _defaults(**defaults):
+    config = _config()
+    config["defaults"].update(defaults)
+    return config
+
+
+def _errors(config):
+    try:
+        validate_config(config)
+    except ValueError as e:
+        return str(e).splitlines()[1:]
+    return []
+
+
+@pytest.mark.parametrize("endpoint", [
+    {"stream": True},
+    {"shard": {"params": {"state": ["01", "02"]}}},
+])
+def test_partition_by_is_rejected_on_streamed_and_sharded_endpoints(endpoint):
+    assert _errors(_config(partition_by="state", **endpoint)) == [
+        "  - endpoints[pop].partition_by: cannot be combined with stream or shard "
+        "(rows are routed to their partitions in memory)",
+    ]
+    assert _errors(_config(**endpoint)) == []
+
+
+def test_partition_by_is_accepted_on_whole_payloads():
+    assert _errors(_config(partition_by=["state", "YEAR"], partition_options={"max_partitions": 60})) == []
+
+
+def test_unknown_keys_are_reported_with_their_path():
+    config = _config(fromats=["csv"], http={"retry": 3})
+    config["defaults"]["uplaod"] = {}
+    assert sorted(_errors(config)) == [
+        "  - defaults.uplaod: unknown key",
+        "  - endpoints[0].fromats: unknown key",
+        "  - endpoints[pop].http.retry: unknown key",
+    ]
+
+
+@pytest.mark.parametrize("config,error", [
+    (_config(stream="yes"), "endpoints[0].stream: expected bool, got str"),
+    (_config(http={"retries": True}), "endpoints[pop].http.retries: expected int, got bool"),
+    (_config(http={"retries": 0}), "endpoints[pop].http.retries: must be >= 1"),
+    (_defaults(local_only="false"), "defaults.local_only: expected bool, got str"),
+    (_defaults(max_workers=2.5), "defaults.max_workers: expected int, got float"),
+    ({"defaults": {"local_only": True}, "endpoints": {"name": "pop"}}, "config.endpoints: expected list, got dict"),
+])
+def test_bad_types_are_rejected(config, error):
+    assert _errors(config) == [f"  - {error}"]
+
+
+@pytest.mark.parametrize("interval", ["1y", "soon", 0, -60])
+def test_bad_refresh_intervals_are_rejected(interval):
+    errors = _errors(_config(refresh_interval=interval))
+    assert len(errors) == 1 and ".refresh_interval: " in errors[0]
+
+
+def test_refresh_intervals_are_parsed_into_the_plan():
+    assert _errors(_config(refresh_interval="15m")) == []
+    plan = config_loader.compile_plan(_config(refresh_interval="15m"))
+    assert plan["endpoints"][0]["refresh_seconds"] == 900.0
+
+
+@pytest.mark.parametrize("chunk_size,valid", [(256 * 1024, True), (8 * 1024 * 1024, True),
+                                              (1000, False), (5 * 1000 * 1000, False)])
+def test_upload_chunk_size_must_be_a_multiple_of_256_kib(chunk_size, valid):
+    errors = _errors(_defaults(upload={"chunk_size": chunk_size}))
+    assert errors == ([] if valid else ["  - defaults.upload.chunk_size: must be a multiple of 256 KiB (262144 bytes)"])
+
+
+@pytest.fixture
+def config_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config_loader, "_plans", {})
+    path = tmp_path / "test.yml"
+    path.write_text(json.dumps(_config(output_formats=["csv"])))
+    return path
+
+
+def test_load_plan_returns_a_frozen_plan(config_dir):
+    plan = load_plan("test", str(config_dir.parent))
+    endpoint = plan["endpoints"][0]
+    assert isinstance(plan, MappingProxyType) and isinstance(endpoint, MappingProxyType)
+    assert endpoint["output_formats"] == ("csv",)
+    with pytest.raises(TypeError):
+        endpoint["url"] = "http://elsewhere"
+    with pytest.raises(TypeError):
+        plan["defaults"]["local_only"] = False
+
+
+def test_load_plan_is_cached_until_the_file_changes(config_dir):
+    plan = load_plan("test", str(config_dir.parent))
+    assert load_plan("TEST", str(config_dir.parent)) is plan
+
+    stat = os.stat(config_dir)
+    config_dir.write_text(json.dumps(_config(output_formats=["txt"])))  # same size, new content
+    os.utime(config_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    reloaded = load_plan("test", str(config_dir.parent))
+    assert reloaded is not plan and reloaded["endpoints"][0]["output_formats"] == ("txt",)
+
+
+def test_load_plan_rejects_an_invalid_file(config_dir):
+    config_dir.write_text(json.dumps(_config(output_formats=["xlsx"])))
+    with pytest.raises(ValueError, match=r"endpoints\[pop\]\.output_formats: unsupported format 'xlsx'"):
+        load_plan("test", str(config_dir.parent))
@@ -0,0 +1,90 @@
+import io
+import json
+
+import pytest
+
+from utils.data_formatter import JsonRowWriter, json_dumps, save_data_formats, write_json
+
+pytest.importorskip("orjson")
+
+CENSUS = [
+    ["NAME", "POP", "state", "county"],
+    ["Autauga County, Alabama", "58805", "01", "001"],
+    ["Baldwin County, Alabama", None, "01", "003"],
+    ["Barbour \"Co\", Alabama", "", "01", "005"],
+]
+MIXED = {
+    "variables": {"POP": {"label": "Total", "limit": 0, "predicateOnly": False, "values": None}},
+    "numbers": [0, -1, 2 ** 63 - 1, 0.1, -2.5, 3.0, 123456789.125],
+    "nested": [[[]], {}, [{"a": [1, {"b": None}]}]],
+    "text": ["", " ", "tab\tquote\"backslash\\", "\x00\x1f"],
+}
+NON_ASCII = ["Doña Ana County, New Mexico", "Añasco Municipio, Puerto Rico", "Ω ≈ 😀"]
+
+
+def _write_json(data, **options):
+    fh = io.StringIO()
+    write_json(data, fh, **options)
+    return fh.getvalue()
+
+
+@pytest.mark.parametrize("indent", [2, None])
+@pytest.mark.parametrize("data", [CENSUS, MIXED, [], {}, None, "text"], ids=["census", "mixed", "list", "dict", "null", "str"])
+@pytest.mark.parametrize("batch_size", [1, 2, 1000])
+def test_orjson_writes_the_same_bytes_as_json(data, indent, batch_size):
+    expected = _write_json(data, indent=indent, batch_size=batch_size)
+    assert _write_json(data, indent=indent, backend="orjson", batch_size=batch_size) == expected
+
+
+@pytest.mark.parametrize("indent", [2, None])
+def test_orjson_writes_non_ascii_as_utf8(indent):
+    data = [["NAME"]] + [[name] for name in NON_ASCII]
+    separators = (",", ":") if indent is None else None
+    assert _write_json(data, indent=indent, backend="orjson", batch_size=2) == json.dumps(
+        data, indent=indent, separators=separators, ensure_ascii=False)
+    assert json.loads(_write_json(data, indent=indent, backend="orjson")) == data
+
+
+def test_orjson_writes_non_string_keys_as_json_does():
+    data = {1: "a", 2.5: "b", True: "c", None: "d"}
+    assert json_dumps(2, "orjson")(data) == json_dumps(2, "json")(data)
+
+
+@pytest.mark.parametrize("value,expected", [
+    (1e16, "1e16"),
+    (1e-07, "1e-7"),
+    (float("nan"), "null"),
+    (float("inf"), "null"),
+])
+def test_orjson_documented_float_differences(value, expected):
+    assert json_dumps(None, "orjson")([value]) == f"[{expected}]"
+
+
+def test_orjson_rejects_integers_beyond_64_bits():
+    with pytest.raises(TypeError):
+        json_dumps(None, "orjson")([2 ** 64])
+
+
+def test_orjson_row_writer_matches_json_for_streamed_rows():
+    outputs = {}
+    for backend in ("json", "orjson"):
+        fh = io.StringIO()
+        writer = JsonRowWriter(fh, 2, backend, batch_size=3)
+        for row in CENSUS * 3:
+            writer.write_row(row)
+        writer.close()
+        outputs[backend] = fh.getvalue()
+    assert outputs["orjson"] == outputs["json"] == json.dumps(CENSUS * 3, indent=2)
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_orjson_json_files_match(tmp_path, stream):
+    contents = {}
+    for backend in ("json", "orjson"):
+        endpoint = {"name": backend, "output_formats": ["json"], "compression": "gzip",
+                    "format_options": {"json": {"backend": backend}}}
+        data = iter(CENSUS) if stream else CENSUS
+        [file_path] = save_data_formats(endpoint, data, str(tmp_path), timestamp="20240101000000")
+        with open(file_path, "rb") as f:
+            contents[backend] = f.read()
+    assert contents["orjson"] == contents["json"]
@@ -0,0 +1,137 @@
+import csv
+import gzip
+
+import pytest
+
+import utils.data_formatter as data_formatter
+from utils.delta import DeltaTracker, LocalIndexStore
+
+HEADER = ["state", "county", "POP"]
+SNAPSHOT = [HEADER, ["01", "001", "10"], ["01", "003", "20"], ["02", "001", "30"]]
+
+
+def _run(store, rows, compact_every=24, commit=True):
+    tracker = DeltaTracker("pop", ["state", "county"], store, compact_every)
+    output = list(tracker.apply(rows))
+    if commit:
+        tracker.commit()
+    return tracker, output
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalIndexStore(str(tmp_path / "state"))
+
+
+def test_first_run_is_a_full_snapshot(store):
+    tracker, output = _run(store, SNAPSHOT)
+    assert tracker.full
+    assert output == SNAPSHOT
+
+
+def test_inserts_updates_and_deletes_are_classified(store):
+    _run(store, SNAPSHOT)
+    changed = [HEADER, ["01", "001", "10"], ["01", "003", "21"], ["04", "005", "40"]]
+    tracker, output = _run(store, changed)
+    assert not tracker.full
+    assert output == [
+        ["_op"] + HEADER,
+        ["update", "01", "003", "21"],
+        ["insert", "04", "005", "40"],
+        ["delete", "02", "001", None],  # key columns only
+    ]
+    assert tracker.counts == {"insert": 1, "update": 1, "delete": 1}
+
+    tracker, output = _run(store, changed)
+    assert output == [["_op"] + HEADER]
+    assert tracker.changes == 0
+
+
+def test_keys_keep_their_types(store):
+    for rows in ([["id", "v"], [1, "a"], ["1", "b"]], [["id", "v"], [1, "a"], ["1", "c"]]):
+        tracker = DeltaTracker("pop", ["id"], store)
+        output = list(tracker.apply(rows))
+        tracker.commit()
+    assert output == [["_op", "id", "v"], ["update", "1", "c"]]
+
+
+def test_compact_every_emits_full_snapshots(store):
+    modes = [_run(store, SNAPSHOT, compact_every=3)[0].full for _ in range(7)]
+    assert modes == [True, False, True, False, False, True, False]
+
+
+def test_changed_columns_emit_a_full_snapshot(store):
+    _run(store, SNAPSHOT)
+    tracker, output = _run(store, [HEADER + ["YEAR"], ["01", "001", "10", "2020"]])
+    assert tracker.full
+    assert output[0] == HEADER + ["YEAR"]
+
+
+def test_index_is_not_advanced_without_commit(store):
+    _run(store, SNAPSHOT)
+    changed = [HEADER] + SNAPSHOT[1:3]
+    _run(store, changed, commit=False)
+    tracker, output = _run(store, changed)
+    assert output == [["_op"] + HEADER, ["delete", "02", "001", None]]  # reported again
+
+
+def test_missing_key_columns_are_rejected(store):
+    tracker = DeltaTracker("pop", ["state", "tract"], store)
+    with pytest.raises(ValueError, match="tract"):
+        list(tracker.apply(SNAPSHOT))
+
+
+def test_unreadable_index_is_rebuilt(store):
+    _run(store, SNAPSHOT)
+    with open(store.location("pop"), "wb") as f:
+        f.write(b"not gzip")
+    tracker, output = _run(store, SNAPSHOT)
+    assert tracker.full
+
+
+def _delta_endpoint(**options):
+    return dict({"name": "pop", "url": "http://api/pop", "formats": ["csv"], "compression": "gzip",
+                 "delta": {"key_columns": ["state", "county"]}}, **options)
+
+
+def _csv(file_path):
+    with gzip.open(file_path, "rt", newline="") as f:
+        return list(csv.reader(f))
+
+
+def test_pipeline_advances_the_index_only_after_a_stored_run(pipeline):
+    run = pipeline.configure(_delta_endpoint())
+    pipeline.responses["http://api/pop"] = SNAPSHOT
+    assert run("test")["endpoints"]["pop"]["status"] == "success"
+
+    pipeline.responses["http://api/pop"] = [HEADER] + SNAPSHOT[1:3]
+    pipeline.failing_uploads.add(".csv.gz")
+    assert run("test")["endpoints"]["pop"]["status"] == "failed"
+
+    pipeline.failing_uploads.clear()
+    summary = run("test")
+    [file_path] = summary["endpoints"]["pop"]["files"]
+    assert _csv(file_path) == [["_op"] + HEADER, ["delete", "02", "001", ""]]
+
+    assert run("test")["endpoints"]["pop"]["status"] == "unchanged"
+
+
+def test_pipeline_keeps_the_index_on_partial_runs(pipeline, monkeypatch):
+    run = pipeline.configure(_delta_endpoint(formats=["csv", "json"]))
+    pipeline.responses["http://api/pop"] = SNAPSHOT
+    run("test")
+
+    pipeline.responses["http://api/pop"] = [HEADER] + SNAPSHOT[1:3]
+    write_json = data_formatter.ROW_WRITERS["json"]  # delta output is a row stream
+
+    def _broken(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setitem(data_formatter.ROW_WRITERS, "json", _broken)
+    assert run("test")["endpoints"]["pop"]["status"] == "partial"
+
+    monkeypatch.setitem(data_formatter.ROW_WRITERS, "json", write_json)
+    summary = run("test")
+    assert summary["endpoints"]["pop"]["status"] == "success"
+    csv_path = next(path for path in summary["endpoints"]["pop"]["files"] if path.endswith(".csv.gz"))
+    assert _csv(csv_path) == [["_op"] + HEADER, ["delete", "02", "001", ""]]
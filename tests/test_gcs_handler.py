@@ -0,0 +1,107 @@
+import base64
+import hashlib
+
+import pytest
+from google.api_core.exceptions import PreconditionFailed
+
+import utils.storage_handler as storage_handler
+from utils import gcs_handler
+from utils.storage_handler import open_output_file
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket, self.name = bucket, name
+        self.content_encoding = None
+
+    @property
+    def md5_hash(self):
+        return base64.b64encode(hashlib.md5(self.bucket.objects[self.name]).digest()).decode("ascii")
+
+    crc32c = None  # like an object whose crc32c is not reported: dedup goes by md5
+
+    def upload_from_filename(self, file_path, content_type=None, if_generation_match=None):
+        if if_generation_match == 0 and self.name in self.bucket.objects:
+            raise PreconditionFailed(self.name)
+        with open(file_path, "rb") as f:
+            self.bucket.objects[self.name] = f.read()
+        self.bucket.uploaded.append(self.name)
+
+
+class FakeBucket:
+    def __init__(self, client, name):
+        self.client, self.name = client, name
+        self.objects = {}
+        self.uploaded, self.copied = [], []
+
+    def blob(self, name, chunk_size=None):
+        return FakeBlob(self, name)
+
+    def copy_blob(self, blob, destination_bucket, new_name):
+        destination_bucket.objects[new_name] = self.objects[blob.name]
+        self.copied.append((blob.name, new_name))
+
+
+class FakeClient:
+    def __init__(self):
+        self.bucket = FakeBucket(self, "b")
+
+    def get_bucket(self, name):
+        return self.bucket
+
+    def list_blobs(self, bucket, prefix=""):
+        return [FakeBlob(bucket, name) for name in bucket.objects if name.startswith(prefix)]
+
+
+@pytest.fixture
+def bucket():
+    client = FakeClient()
+    gcs_handler.set_client(client)
+    yield client.bucket
+    gcs_handler.set_client(None)
+
+
+def _write(path, data):
+    with open_output_file(str(path), binary=True) as fh:
+        fh.write(data)
+    return str(path)
+
+
+def _upload(uploads, dedup, max_workers=2):
+    results = gcs_handler.upload_many_to_gcs("b", uploads, max_workers=max_workers, dedup=dedup, dedup_prefix="pop/")
+    assert [error for _, _, error, _ in results] == [None] * len(uploads)
+    return [stored_as for _, _, _, stored_as in results]
+
+
+def test_unchanged_content_is_skipped(tmp_path, bucket):
+    bucket.objects["pop/pop_1.csv"] = b"NAME,POP\na,1\n"
+    old = _write(tmp_path / "pop_2.csv", b"NAME,POP\na,1\n")
+    new = _write(tmp_path / "pop_3.csv", b"NAME,POP\na,2\n")
+    stored = _upload([(old, "pop/pop_2.csv"), (new, "pop/pop_3.csv")], "skip")
+    assert stored == ["pop/pop_1.csv", "pop/pop_3.csv"]
+    assert bucket.uploaded == ["pop/pop_3.csv"] and bucket.copied == []
+    assert "pop/pop_2.csv" not in bucket.objects
+    assert old not in storage_handler._checksums
+
+
+def test_unchanged_content_is_aliased(tmp_path, bucket):
+    bucket.objects["pop/pop_1.csv"] = b"NAME,POP\na,1\n"
+    old = _write(tmp_path / "pop_2.csv", b"NAME,POP\na,1\n")
+    assert _upload([(old, "pop/pop_2.csv")], "alias") == ["pop/pop_2.csv"]
+    assert bucket.uploaded == [] and bucket.copied == [("pop/pop_1.csv", "pop/pop_2.csv")]
+
+
+def test_duplicates_within_one_batch_are_uploaded_once(tmp_path, bucket):
+    first = _write(tmp_path / "a.csv", b"same")
+    second = _write(tmp_path / "b.csv", b"same")
+    assert _upload([(first, "pop/a.csv"), (second, "pop/b.csv")], "skip", max_workers=1) == ["pop/a.csv", "pop/a.csv"]
+    assert bucket.uploaded == ["pop/a.csv"]
+
+
+@pytest.mark.parametrize("dedup", [None, "skip"])
+def test_checksums_are_dropped_once_used(tmp_path, bucket, dedup):
+    file_path = _write(tmp_path / "pop_1.csv", b"NAME,POP\na,1\n")
+    assert file_path in storage_handler._checksums
+    _upload([(file_path, "pop/pop_1.csv")], dedup)
+    assert file_path not in storage_handler._checksums
+    assert bucket.uploaded == ["pop/pop_1.csv"]
@@ -0,0 +1,152 @@
+import json
+import os
+
+import pytest
+
+import utils.api_client as api_client
+import utils.http_cache as http_cache
+from utils.api_client import fetch_api_data_cached
+from utils.http_cache import ResponseCache, cache_key
+
+URL = "http://api/variables.json"
+TTL = 3600
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=b"", headers=None):
+        self.status_code = status_code
+        self.content = body
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeServer:
+    """Stands in for _request_with_retries, honouring If-None-Match."""
+
+    def __init__(self, body, etag='"v1"'):
+        self.body, self.etag = body, etag
+        self.requests = []  # headers of each request
+
+    def request(self, method, url, params, *args, headers=None, **kwargs):
+        self.requests.append(dict(headers or {}))
+        if self.etag is not None and (headers or {}).get("If-None-Match") == self.etag:
+            return FakeResponse(304)
+        return FakeResponse(200, self.body, {"ETag": self.etag} if self.etag else {})
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(api_client.time, "time", fake.time)
+    return fake
+
+
+@pytest.fixture
+def server(monkeypatch):
+    fake = FakeServer(b'{"variables": {"A": {"label": "x"}}}')
+    monkeypatch.setattr(api_client, "_request_with_retries", fake.request)
+    return fake
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(str(tmp_path / "cache"))
+
+
+def _fetch(cache, commit=True):
+    data, changed, commit_cache = fetch_api_data_cached(URL, cache, TTL)
+    if commit and commit_cache is not None:
+        commit_cache()
+    return data, changed, commit_cache
+
+
+def test_first_fetch_is_changed_and_cached_on_commit(cache, server, clock):
+    data, changed, commit = _fetch(cache, commit=False)
+    assert changed and data == {"variables": {"A": {"label": "x"}}}
+    assert cache.get(cache_key("GET", URL)) is None  # only once the output is stored
+    commit()
+    meta, body = cache.get(cache_key("GET", URL))
+    assert (meta["etag"], meta["validated_at"], body) == ('"v1"', clock.now, server.body)
+
+
+def test_fresh_entries_are_used_without_a_request(cache, server, clock):
+    _fetch(cache)
+    clock.now += TTL - 1
+    data, changed, commit = _fetch(cache)
+    assert (changed, commit) == (False, None)
+    assert data == json.loads(server.body)
+    assert len(server.requests) == 1
+
+
+def test_stale_entries_are_revalidated_with_a_304(cache, server, clock):
+    _fetch(cache)
+    clock.now += TTL + 1
+    data, changed, commit = _fetch(cache, commit=False)
+    assert server.requests[-1] == {"If-None-Match": '"v1"'}
+    assert not changed and data == json.loads(server.body)
+
+    commit()  # touch_validated: fresh again for another ttl
+    assert cache.get(cache_key("GET", URL))[0]["validated_at"] == clock.now
+    clock.now += TTL - 1
+    _fetch(cache)
+    assert len(server.requests) == 2
+
+
+def test_uncommitted_revalidation_stays_stale(cache, server, clock):
+    _fetch(cache)
+    clock.now += TTL + 1
+    _fetch(cache, commit=False)
+    _fetch(cache, commit=False)
+    assert len(server.requests) == 3
+
+
+def test_changed_body_replaces_the_entry(cache, server, clock):
+    _fetch(cache)
+    clock.now += TTL + 1
+    server.body, server.etag = b'{"variables": {}}', '"v2"'
+    data, changed, _ = _fetch(cache)
+    assert changed and data == {"variables": {}}
+    assert cache.get(cache_key("GET", URL))[0]["etag"] == '"v2"'
+
+
+def test_identical_body_without_validators_is_unchanged(cache, server, clock):
+    server.etag = None
+    _fetch(cache)
+    clock.now += TTL + 1
+    data, changed, commit = _fetch(cache)
+    assert server.requests[-1] == {}
+    assert not changed and commit is not None
+    assert cache.get(cache_key("GET", URL))[0]["validated_at"] == clock.now
+
+
+def test_entry_removed_while_read_is_a_miss(cache, monkeypatch):
+    cache.put("k", b"body")
+
+    def _evicted(path, times):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(http_cache.os, "utime", _evicted)
+    assert cache.get("k") is None
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    cache.max_bytes = 10
+    for age, key in ((200, "a"), (100, "b")):
+        cache.put(key, b"12345")
+        then = os.path.getmtime(cache._paths(key)[1]) - age
+        os.utime(cache._paths(key)[1], (then, then))
+    assert cache.get("a") is not None  # now the most recently used
+    cache.put("c", b"12345")
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert not [name for name in os.listdir(cache.directory) if name.endswith(".tmp")]
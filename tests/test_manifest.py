@@ -0,0 +1,187 @@
+import json
+import os
+
+import pytest
+from google.api_core.exceptions import PreconditionFailed
+
+import utils.data_formatter as data_formatter
+import utils.gcs_handler as gcs_handler
+from utils.manifest import GCSStore, LocalStore, RunManifest
+
+
+class FlakyStore(LocalStore):
+    """LocalStore whose writes fail while `failing` is set."""
+
+    def __init__(self, state_dir, min_interval=0.0):
+        super().__init__(state_dir)
+        self.min_interval = min_interval
+        self.failing = False
+        self.writes = 0
+
+    def write(self, run_id, text):
+        self.writes += 1
+        if self.failing:
+            raise OSError("store unavailable")
+        super().write(run_id, text)
+
+
+def _saved(store, run_id):
+    return json.loads(store.read(run_id))
+
+
+def test_failed_save_does_not_fail_the_endpoint(tmp_path):
+    store = FlakyStore(tmp_path)
+    manifest = RunManifest("r1", "dev", store, str(tmp_path))
+    manifest.start(["a"])
+    store.failing = True
+    checkpoint = manifest.endpoint("a")
+    checkpoint.finish({"status": "success", "files": []})  # logged, not raised
+    assert _saved(store, "r1")["endpoints"]["a"]["status"] == "pending"
+
+    store.failing = False
+    manifest.finish("success")
+    assert _saved(store, "r1")["endpoints"]["a"]["status"] == "success"
+
+
+def test_saves_within_min_interval_are_coalesced(tmp_path):
+    store = FlakyStore(tmp_path, min_interval=0.2)
+    manifest = RunManifest("r1", "dev", store, str(tmp_path))
+    manifest.start(["a", "b"])
+    for name in ("a", "b"):
+        manifest.endpoint(name).finish({"status": "success", "files": []})
+    assert store.writes == 1
+    assert _saved(store, "r1")["endpoints"]["b"]["status"] == "pending"
+
+    manifest.finish("success")  # waits out the interval, then writes everything
+    assert store.writes == 2
+    saved = _saved(store, "r1")
+    assert saved["status"] == "success"
+    assert {state["status"] for state in saved["endpoints"].values()} == {"success"}
+
+
+class FakeObject:
+    """One GCS object behind write_text_to_gcs/read_text_from_gcs."""
+
+    def __init__(self):
+        self.text, self.generation = None, 0
+        self.retried = 0  # writes the client retries after the first attempt landed
+
+    def write(self, bucket, name, text, create_bucket=False, if_generation_match=None, **kwargs):
+        if if_generation_match is not None and if_generation_match != self.generation:
+            raise PreconditionFailed(name)
+        self.text, self.generation = text, self.generation + 1
+        if self.retried:
+            self.retried -= 1
+            raise PreconditionFailed(name)  # the retry sees the generation just written
+        return self.generation
+
+    def read(self, bucket, name):
+        return self.text, self.generation
+
+
+@pytest.fixture
+def gcs_object(monkeypatch):
+    obj = FakeObject()
+    monkeypatch.setattr(gcs_handler, "write_text_to_gcs", obj.write)
+    monkeypatch.setattr(gcs_handler, "read_text_from_gcs", obj.read)
+    return obj
+
+
+def test_gcs_store_writes_only_the_generation_it_knows(gcs_object):
+    store = GCSStore("bucket", "prefix")
+    store.write("r1", "one")
+    store.write("r1", "two")
+    assert (gcs_object.text, gcs_object.generation) == ("two", 2)
+
+    other = GCSStore("bucket", "prefix")
+    assert other.read("r1") == "two"
+    other.write("r1", "three")
+    with pytest.raises(RuntimeError, match="changed by another process"):
+        store.write("r1", "four")
+    assert gcs_object.text == "three"
+
+
+def test_gcs_store_accepts_its_own_retried_write(gcs_object):
+    store = GCSStore("bucket", "prefix")
+    store.write("r1", "one")
+    gcs_object.retried = 1
+    store.write("r1", "two")
+    store.write("r1", "three")
+    assert (gcs_object.text, gcs_object.generation) == ("three", 3)
+
+
+def _statuses(summary):
+    return {name: result["status"] for name, result in summary["endpoints"].items()}
+
+
+def test_resume_skips_completed_endpoints(pipeline):
+    run = pipeline.configure({"name": "a", "url": "http://api/a", "formats": ["json"]},
+                             {"name": "b", "url": "http://api/b", "formats": ["json"]})
+    pipeline.failing_urls.add("http://api/b")
+    first = run("test")
+    assert _statuses(first) == {"a": "success", "b": "failed"}
+
+    pipeline.failing_urls.clear()
+    pipeline.fetched.clear()
+    second = run("test", resume=first["run_id"])
+    assert _statuses(second) == {"a": "success", "b": "success"}
+    assert second["endpoints"]["a"]["resumed"] is True
+    assert pipeline.fetched == ["http://api/b"]
+    assert _saved(LocalStore("state"), first["run_id"])["status"] == "success"
+
+
+def test_resume_skips_uploaded_objects_and_written_formats(pipeline):
+    run = pipeline.configure({"name": "a", "url": "http://api/a", "formats": ["json", "csv"]})
+    pipeline.failing_uploads.add(".csv")
+    first = run("test")
+    assert _statuses(first) == {"a": "failed"}
+    assert [name.rsplit(".", 1)[1] for name in pipeline.uploaded] == ["json", "csv"]
+
+    pipeline.failing_uploads.clear()
+    pipeline.fetched.clear()
+    pipeline.uploaded.clear()
+    second = run("test", resume=first["run_id"])
+    assert _statuses(second) == {"a": "success"}
+    assert pipeline.fetched == []  # every format was written by the first attempt
+    assert [name.rsplit(".", 1)[1] for name in pipeline.uploaded] == ["csv"]
+    assert len(second["endpoints"]["a"]["objects"]) == 2
+
+
+def test_resume_retries_a_partial_endpoint(pipeline, monkeypatch):
+    run = pipeline.configure({"name": "a", "url": "http://api/a", "formats": ["json", "csv"]})
+    write_csv = data_formatter.ENCODERS["csv"]
+
+    def _broken(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setitem(data_formatter.ENCODERS, "csv", _broken)
+    first = run("test")
+    assert _statuses(first) == {"a": "partial"}
+    assert first["endpoints"]["a"]["failed_formats"] == ["csv"]
+
+    monkeypatch.setitem(data_formatter.ENCODERS, "csv", write_csv)
+    pipeline.fetched.clear()
+    pipeline.uploaded.clear()
+    second = run("test", resume=first["run_id"])
+    assert _statuses(second) == {"a": "success"}
+    assert "resumed" not in second["endpoints"]["a"]
+    assert pipeline.fetched == ["http://api/a"]  # refetched for the missing format only
+    assert [name.rsplit(".", 1)[1] for name in pipeline.uploaded] == ["csv"]
+
+
+def test_resume_skips_spooled_shards(pipeline):
+    run = pipeline.configure({"name": "a", "url": "http://api/a?part={part}", "formats": ["csv"],
+                              "shard": {"params": {"part": ["1", "2", "3"]}, "retries": 1, "backoff": 0, "max_workers": 1}})
+    pipeline.failing_urls.add("http://api/a?part=3")
+    first = run("test")
+    assert _statuses(first) == {"a": "failed"}
+
+    pipeline.failing_urls.clear()
+    pipeline.fetched.clear()
+    second = run("test", resume=first["run_id"])
+    assert _statuses(second) == {"a": "success"}
+    assert pipeline.fetched == ["http://api/a?part=3"]
+    [csv_path] = second["endpoints"]["a"]["files"]
+    with open(csv_path) as f:
+        assert len(f.read().splitlines()) == 1 + 3 * 2
+    assert not os.path.exists(os.path.join("state", "shards", "a"))
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+import utils.data_formatter as data_formatter
+from utils.data_formatter import save_data_formats
+from utils.parallel_encode import pack_rows, shutdown_pools, unpack_rows
+
+HEADER = ["NAME", "POP", "state"]
+ROWS = [[f"County {i}, \"{i % 7}\"", str(i * 31) if i % 5 else None, f"{i % 56:02d}"] for i in range(23)]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def _pools():
+    yield
+    shutdown_pools()
+
+
+@pytest.fixture
+def parallel_calls(monkeypatch):
+    """Formats encoded through encode_parallel (so a fallback can't pass unnoticed)."""
+    calls = []
+    encode_parallel = data_formatter.encode_parallel
+
+    def _spy(fmt, *args, **kwargs):
+        calls.append(fmt)
+        return encode_parallel(fmt, *args, **kwargs)
+
+    monkeypatch.setattr(data_formatter, "encode_parallel", _spy)
+    return calls
+
+
+def _save(tmp_path, label, data, fmt, compression, parallel, indent=2):
+    endpoint = {"name": "data", "output_formats": [fmt], "compression": compression,
+                "format_options": {"json": {"indent": indent}}}
+    if parallel:
+        endpoint["parallel_encode"] = {"processes": 2, "min_rows": 0, "chunk_rows": 7}
+    folder = os.path.join(tmp_path, label)
+    [file_path] = save_data_formats(endpoint, data, folder, timestamp="20240101000000")
+    with open(file_path, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+@pytest.mark.parametrize("fmt,indent", [("csv", 2), ("json", 2), ("json", None), ("txt", 2)])
+@pytest.mark.parametrize("rows", [ROWS, ROWS[:5], []], ids=["chunks", "single-chunk", "empty"])
+def test_parallel_output_is_byte_identical(tmp_path, parallel_calls, fmt, indent, compression, rows):
+    data = [HEADER] + rows
+    serial = _save(tmp_path, "serial", data, fmt, compression, parallel=False, indent=indent)
+    assert parallel_calls == []
+    parallel = _save(tmp_path, "parallel", data, fmt, compression, parallel=True, indent=indent)
+    assert parallel_calls == [fmt]
+    assert parallel == serial
+
+
+def test_parallel_csv_pads_short_rows_like_serial(tmp_path, parallel_calls):
+    data = [HEADER] + [row[:2] if i % 3 == 0 else row for i, row in enumerate(ROWS)]
+    assert _save(tmp_path, "p", data, "csv", None, True) == _save(tmp_path, "s", data, "csv", None, False)
+    assert parallel_calls == ["csv"]
+
+
+@pytest.mark.parametrize("rows", [
+    [["a", None, ""], [], ["b"]],
+    [["a\x1fb", "c"]],  # contains the cell separator
+    [["a", 1, 2.5]],
+    [("a", "b")],
+    [],
+])
+def test_pack_rows_round_trips(rows):
+    assert unpack_rows(pack_rows(rows)) == rows
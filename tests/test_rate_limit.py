@@ -0,0 +1,150 @@
+import threading
+from contextlib import ExitStack
+
+import pytest
+
+import utils.rate_limit as rate_limit
+from utils.rate_limit import HostLimiter, latency_key
+
+
+class FakeTime:
+    """Stands in for the time module: a clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(rate_limit, "time", fake)
+    return fake
+
+
+def _request(limiter, clock, status=200, latency=0.1, retry_after=None, key=""):
+    with limiter.slot(key) as outcome:
+        clock.now += latency
+        outcome.status = status
+        outcome.retry_after = retry_after
+
+
+def _concurrent(limiter, clock, statuses, latency=0.1):
+    """Requests that are all in flight at once and complete together."""
+    with ExitStack() as stack:
+        outcomes = [stack.enter_context(limiter.slot()) for _ in statuses]
+        clock.now += latency
+        for outcome, status in zip(outcomes, statuses):
+            outcome.status = status
+
+
+def test_concurrent_overloads_decrease_once_per_round_trip(clock):
+    limiter = HostLimiter("api", initial_concurrency=8)
+    _concurrent(limiter, clock, [503] * 4)
+    assert limiter.limit == 4
+    assert limiter.throttled == 4
+
+    clock.now += 0.5  # still within the 1 s minimum round trip
+    _request(limiter, clock, status=429)
+    assert limiter.limit == 4
+
+    clock.now += 1.0
+    _request(limiter, clock, status=503)
+    assert limiter.limit == 2
+
+
+def test_timeouts_count_as_overload_and_connection_errors_do_not(clock):
+    limiter = HostLimiter("api", initial_concurrency=8)
+    with limiter.slot():
+        pass  # no status: e.g. a connection error
+    assert limiter.limit == 8
+    with limiter.slot() as outcome:
+        outcome.timed_out = True
+    assert limiter.limit == 4
+
+
+def test_retry_after_pauses_the_host(clock):
+    limiter = HostLimiter("api")
+    _request(limiter, clock, status=429, retry_after=30)
+    entered = threading.Event()
+    worker = threading.Thread(target=lambda: _request_and_signal(limiter, entered))
+    worker.start()
+    try:
+        assert not entered.wait(0.2)
+        clock.now += 29
+        _wake(limiter)
+        assert not entered.wait(0.2)
+        clock.now += 2
+        _wake(limiter)
+        assert entered.wait(5)
+    finally:
+        clock.now += 1000
+        _wake(limiter)
+        worker.join(5)
+
+
+def _request_and_signal(limiter, entered):
+    with limiter.slot() as outcome:
+        entered.set()
+        outcome.status = 200
+
+
+def _wake(limiter):
+    with limiter._cond:
+        limiter._cond.notify_all()
+
+
+def test_window_only_grows_while_saturated(clock):
+    limiter = HostLimiter("api", initial_concurrency=4, max_concurrency=8)
+    for _ in range(20):
+        _request(limiter, clock)  # one at a time: the window is not the limit
+    assert limiter.limit == 4
+
+    _concurrent(limiter, clock, [200] * 4)
+    assert 4 < limiter.limit < 5  # about one slot per round trip
+    for _ in range(40):
+        _concurrent(limiter, clock, [200] * int(limiter.limit))
+    assert limiter.limit == 8  # capped at max_concurrency
+
+
+def test_rate_backs_off_from_the_achieved_rate(clock):
+    limiter = HostLimiter("api", max_rate=100, burst=100)
+    for _ in range(10):
+        _request(limiter, clock, latency=0.1)
+        clock.now += 0.4  # 2 requests/s, far below max_rate
+    _request(limiter, clock, status=503, latency=0.1)
+    assert limiter.rate == pytest.approx(2 * 0.5)  # not 100 * 0.5
+    assert limiter.bucket.rate == limiter.rate
+
+
+def test_unlimited_rate_is_set_on_first_overload(clock):
+    limiter = HostLimiter("api")
+    assert limiter.rate is None
+    _request(limiter, clock, status=503)
+    assert limiter.rate is None  # nothing achieved yet to back off from
+    clock.now += 2
+    for _ in range(5):
+        _request(limiter, clock, latency=0.2)
+    _request(limiter, clock, status=503)
+    assert limiter.rate is not None and limiter.rate > 0
+
+
+def test_latency_spike_counts_as_congestion_per_request_kind(clock):
+    limiter = HostLimiter("api", initial_concurrency=8)
+    for _ in range(6):
+        _request(limiter, clock, latency=0.1, key="/data?get")
+    _request(limiter, clock, latency=2.0, key="/data?for&get")  # another kind: no baseline yet
+    assert limiter.limit == 8
+    _request(limiter, clock, latency=2.0, key="/data?get")
+    assert limiter.limit == 4
+
+
+def test_latency_key_ignores_parameter_values():
+    assert latency_key("https://api/data?get=NAME&for=state:01") == "/data?for&get"
+    assert latency_key("https://api/data?for=state:02&get=POP") == "/data?for&get"
+    assert latency_key("https://api/data") == "/data"
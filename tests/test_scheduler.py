@@ -0,0 +1,85 @@
+import json
+import math
+import os
+
+import pytest
+
+from utils.scheduler import Schedule, next_due, parse_interval, start_offset
+
+HOUR = 3600.0
+
+
+def _plan(**intervals):
+    return {"defaults": {"scheduler": {"jitter": 0, "tick": 60}},
+            "endpoints": [{"name": name, "refresh_seconds": seconds, "priority": 0}
+                          for name, seconds in intervals.items()]}
+
+
+@pytest.mark.parametrize("value,seconds", [(90, 90.0), ("90s", 90.0), ("15m", 900.0), ("1.5h", 5400.0), ("7d", 604800.0)])
+def test_parse_interval(value, seconds):
+    assert parse_interval(value) == seconds
+
+
+@pytest.mark.parametrize("value", [0, -5, "0m", "1y", "soon", True])
+def test_parse_interval_rejects_bad_values(value):
+    with pytest.raises(ValueError):
+        parse_interval(value)
+
+
+def test_runs_fall_on_a_fixed_grid():
+    offset = start_offset("a", HOUR)
+    assert 0 <= offset < 300
+    assert next_due("a", HOUR, 10 * HOUR + offset + 1) == 11 * HOUR + offset
+    assert next_due("a", HOUR, 10 * HOUR + offset + 3000) == 11 * HOUR + offset  # long run, same phase
+    assert next_due("a", HOUR, None) == 0.0
+    assert next_due("a", HOUR, 10 * HOUR, "failed", retry_after=300) == 10 * HOUR + 300
+
+
+def test_endpoints_without_an_interval_are_never_due(tmp_path):
+    assert next_due("a", None, None) == math.inf
+    schedule = Schedule("test", _plan(hourly=HOUR, manual=None), str(tmp_path))
+    assert schedule.unscheduled() == ["manual"]
+    assert schedule.due(now=0) == ["hourly"]
+    schedule.record({"endpoints": {"hourly": {"status": "success"}}}, started=10 * HOUR)
+    assert schedule.due(now=10 * HOUR + 60) == []
+    assert schedule.seconds_until_due(now=10 * HOUR + 60) == 60  # the tick, not 0 for 'manual'
+
+
+def test_record_replaces_the_state_file(tmp_path):
+    schedule = Schedule("Test", _plan(a=HOUR, b=HOUR), str(tmp_path / "state"))
+    schedule.record({"endpoints": {"a": {"status": "success"}}}, started=100.0)
+    schedule.record({"endpoints": {"b": {"status": "failed"}}}, started=200.0)
+    assert os.listdir(tmp_path / "state") == ["schedule_test.json"]  # no temp files left behind
+    with open(tmp_path / "state" / "schedule_test.json") as f:
+        assert json.load(f) == {"a": {"last_run": 100.0, "status": "success"},
+                                "b": {"last_run": 200.0, "status": "failed"}}
+    assert Schedule("test", _plan(a=HOUR), str(tmp_path / "state")).state["b"]["status"] == "failed"
+
+
+def test_unreadable_state_is_ignored(tmp_path):
+    (tmp_path / "schedule_test.json").write_text("{")
+    assert Schedule("test", _plan(a=HOUR), str(tmp_path)).due(now=0) == ["a"]
+
+
+def test_run_due_skips_unscheduled_endpoints(pipeline):
+    run = pipeline.configure({"name": "hourly", "url": "http://api/hourly", "refresh_interval": "1h"},
+                             {"name": "manual", "url": "http://api/manual"})
+    import main
+
+    summary = main.run_due("test", now=10 * HOUR)
+    assert list(summary["endpoints"]) == ["hourly"]
+    assert main.run_due("test", now=10 * HOUR + 60) is None
+    assert pipeline.fetched == ["http://api/hourly"]
+    assert list(run("test")["endpoints"]) == ["hourly", "manual"]
+
+
+def test_run_due_needs_durable_state_on_cloud_functions(pipeline, monkeypatch):
+    pipeline.configure({"name": "hourly", "url": "http://api/hourly", "refresh_interval": "1h"})
+    import main
+
+    monkeypatch.setattr(main, "is_running_in_gcf", lambda: True)
+    assert main.run_due("test", now=10 * HOUR) is not None  # the fixture sets defaults.state_dir
+
+    monkeypatch.setattr(main, "load_plan", lambda env: {"defaults": {}, "endpoints": []})
+    with pytest.raises(ValueError, match="state_dir"):
+        main.run_due("test")
@@ -0,0 +1,131 @@
+import threading
+import time
+
+import pytest
+
+from utils.manifest import ShardSpool
+from utils.sharding import build_shards, expand_shard_values, fetch_sharded_rows
+
+HEADER = ["NAME", "POP", "state"]
+
+
+def _shard(state, rows=2):
+    return [HEADER] + [[f"{state}-{i}", str(i), state] for i in range(rows)]
+
+
+class ShardAPI:
+    """fetch() for state shards: a fixed payload per URL, failing on demand."""
+
+    def __init__(self, payloads):
+        self.payloads = payloads
+        self.calls = []
+        self.failures = {}  # url -> failures left
+        self._lock = threading.Lock()
+
+    def fetch(self, url):
+        with self._lock:
+            self.calls.append(url)
+            failures = self.failures.get(url, 0)
+            self.failures[url] = max(failures - 1, 0)
+        if failures:
+            raise ConnectionError(url)
+        time.sleep(0.01 * (len(self.payloads) - list(self.payloads).index(url)))  # later shards finish first
+        return self.payloads[url]
+
+
+def _shards(states):
+    return build_shards("http://api/data?in=state:{state}", {"state": states})
+
+
+def _merge(api, states, **options):
+    options = {"max_workers": 4, "retries": 1, "backoff": 0, **options}
+    return list(fetch_sharded_rows(_shards(states), api.fetch, **options))
+
+
+def test_expand_shard_values():
+    assert expand_shard_values("YEAR", "2019-2021") == ["2019", "2020", "2021"]
+    assert expand_shard_values("county", "001-003") == ["001", "002", "003"]
+    assert expand_shard_values("YEAR", [2020, "2021"]) == ["2020", "2021"]
+    assert len(expand_shard_values("state", "all")) == 52
+    with pytest.raises(ValueError):
+        expand_shard_values("YEAR", "all")
+    with pytest.raises(ValueError):
+        expand_shard_values("YEAR", "2021-2019")
+
+
+def test_build_shards_substitutes_every_combination():
+    shards = build_shards("http://api/{YEAR}?in=state:{state}", {"state": ["01", "02"], "YEAR": "2020-2021"})
+    assert [url for _, url in shards] == [
+        "http://api/2020?in=state:01", "http://api/2021?in=state:01",
+        "http://api/2020?in=state:02", "http://api/2021?in=state:02",
+    ]
+    assert shards[1][0] == {"state": "01", "YEAR": "2021"}
+    with pytest.raises(ValueError, match="placeholder"):
+        build_shards("http://api/data", {"state": ["01"]})
+
+
+def test_shards_are_merged_in_shard_order_under_one_header():
+    states = ["01", "02", "04", "05"]
+    api = ShardAPI({url: _shard(label["state"]) for label, url in _shards(states)})
+    rows = _merge(api, states)
+    assert rows[0] == HEADER
+    assert rows[1:] == [row for state in states for row in _shard(state)[1:]]
+
+
+def test_empty_shards_are_skipped():
+    states = ["01", "02", "04"]
+    payloads = {url: _shard(label["state"]) for label, url in _shards(states)}
+    payloads["http://api/data?in=state:01"] = []  # e.g. a 204 No Content
+    payloads["http://api/data?in=state:04"] = [HEADER]
+    rows = _merge(ShardAPI(payloads), states)
+    assert rows == _shard("02")
+
+
+def test_header_mismatch_is_rejected():
+    states = ["01", "02"]
+    payloads = {url: _shard(label["state"]) for label, url in _shards(states)}
+    payloads["http://api/data?in=state:02"] = [["NAME", "state", "POP"], ["x", "02", "1"]]
+    rows = fetch_sharded_rows(_shards(states), ShardAPI(payloads).fetch, backoff=0)
+    assert next(rows) == HEADER
+    with pytest.raises(ValueError, match="different header"):
+        list(rows)
+
+
+def test_failed_shards_are_retried_on_their_own():
+    states = ["01", "02", "04"]
+    api = ShardAPI({url: _shard(label["state"]) for label, url in _shards(states)})
+    api.failures["http://api/data?in=state:02"] = 2
+    rows = _merge(api, states, retries=2)
+    assert len(rows) == 1 + 3 * 2
+    assert sorted(api.calls) == sorted([url for _, url in _shards(states)] + ["http://api/data?in=state:02"] * 2)
+
+
+def test_a_shard_failing_every_attempt_fails_the_stream():
+    states = ["01", "02"]
+    api = ShardAPI({url: _shard(label["state"]) for label, url in _shards(states)})
+    api.failures["http://api/data?in=state:02"] = 5
+    with pytest.raises(RuntimeError, match="after 2 attempt"):
+        _merge(api, states, retries=1)
+    assert api.calls.count("http://api/data?in=state:02") == 2
+
+
+def test_spooled_shards_are_not_fetched_again(tmp_path):
+    states = ["01", "02"]
+    api = ShardAPI({url: _shard(label["state"]) for label, url in _shards(states)})
+    spool = ShardSpool(str(tmp_path / "shards"))
+    spool.save({"state": "01"}, _shard("01"))
+    assert _merge(api, states, spool=spool) == _shard("01") + _shard("02")[1:]
+    assert api.calls == ["http://api/data?in=state:02"]
+    assert spool.load({"state": "02"}) == _shard("02")
+
+
+def test_pipeline_retries_shards_once_per_layer(pipeline):
+    run = pipeline.configure({"name": "a", "url": "http://api/a?in=state:{state}", "formats": ["csv"],
+                              "http": {"retries": 3},
+                              "shard": {"params": {"state": ["01", "02"]}, "retries": 2, "backoff": 0}})
+    pipeline.failing_urls.add("http://api/a?in=state:02")
+    summary = run("test")
+    assert summary["endpoints"]["a"]["status"] == "failed"
+    assert sorted(pipeline.fetched) == ["http://api/a?in=state:01"] + ["http://api/a?in=state:02"] * 3
+    assert [options["retries"] for options in pipeline.fetch_options] == [1] * 4  # one attempt per fetch
+    assert summary["totals"]["retries"] == 2
@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+
+from utils.data_formatter import format_data
+from utils.tabular import is_header_rows
+
+
+def _pandas_csv(data):
+    """CSV the pandas reshaping produced for a list payload."""
+    try:
+        df = pd.DataFrame(data[1:], columns=data[0])
+    except Exception:
+        df = pd.DataFrame(data)
+    return df.to_csv(index=False)
+
+
+@pytest.mark.parametrize("data", [
+    [["a", "b", "c"], ["1", "2", "3"], ["4", "5", None]],
+    [["a", "b", "c"], ["1", "2", "3"], ["4", "5"]],
+    [["a", "b", "c"], ["1", "2"], ["3", "4"]],
+    [["a", "b", "c"], ["1"], ["1", "2"]],
+    [["a", "b"], [], []],
+    [["a", "b"], ["1", "2"], []],
+    [["a", "b"]],
+    [["a", "b"], ["1", "2", "3"]],
+])
+def test_header_rows_csv_matches_pandas(data):
+    assert format_data(data, "csv") == _pandas_csv(data)
+
+
+def test_rows_all_shorter_than_header_are_positional():
+    data = [["a", "b", "c"], ["1", "2"], ["3", "4"]]
+    assert not is_header_rows(data)
+    assert format_data(data, "csv") == "0,1,2\na,b,c\n1,2,\n3,4,\n"
+
+
+def _pandas_variables_csv(variables):
+    """CSV the pandas reshaping produced for a variables payload."""
+    return pd.DataFrame(variables).T.reset_index().to_csv(index=False)
+
+
+@pytest.mark.parametrize("variables", [
+    {"B01001_001E": {"label": "Estimate!!Total", "concept": "SEX BY AGE", "predicateType": "int",
+                     "group": "B01001", "limit": 0, "attributes": "B01001_001EA,B01001_001M"},
+     "for": {"label": "Census API FIPS 'for' clause", "concept": "Census API Geography Specification",
+             "predicateType": "fips-for", "group": "N/A", "limit": 0, "predicateOnly": True},
+     "NAME": {"label": "Geographic Area Name", "predicateType": "string", "limit": 0,
+              "values": {"item": {"1": "x"}}, "required": "true"}},
+    {"A": {"v": 1.5, "label": "x"}, "B": {"n": -3, "label": "y"}},
+    {"A": {"flag": True, "label": "x"}, "B": {"flag": False}},
+    {"A": {"limit": 0, "label": "x"}, "B": {"limit": "N"}},
+    {"A": {"g": ["a", "b"], "values": None}},
+], ids=["census", "numbers", "bools", "mixed", "lists"])
+def test_variables_csv_matches_pandas(variables):
+    assert format_data({"variables": variables}, "csv") == _pandas_variables_csv(variables)
+
+
+@pytest.mark.parametrize("variables,pandas_csv,csv", [
+    ({"A": {"limit": 0, "n": 2 ** 53 + 1}, "B": {"label": "y"}},
+     "index,limit,n,label\nA,0.0,9007199254740992.0,\nB,,,y\n",
+     "index,limit,n,label\nA,0,9007199254740993,\nB,,,y\n"),
+    ({"A": {"v": 1.5, "n": 2}},
+     "index,v,n\nA,1.5,2.0\n",
+     "index,v,n\nA,1.5,2\n"),
+], ids=["missing-field", "float-field"])
+def test_variables_csv_keeps_integers_pandas_wrote_as_floats(variables, pandas_csv, csv):
+    assert _pandas_variables_csv(variables) == pandas_csv
+    assert format_data({"variables": variables}, "csv") == csv
@@ -1,15 +1,373 @@
-import requests
-from utils.logger import get_logger
-
-logger = get_logger()
-
-def fetch_api_data(url, method="GET", params=None, retries=3, timeout=30):
-    for attempt in range(retries):
-        try:
-            resp = requests.request(method, url, params=params, timeout=timeout)
-            resp.raise_for_status()
-            return resp.json()
-        except Exception as e:
-            logger.error(f"API fetch failed (attempt {attempt+1}/{retries}): {e}")
-            if attempt == retries - 1:
-                raise
\ No newline at end of file
+import codecs
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
+from utils.http_cache import cache_key
+from utils.logger import get_logger
+from utils.metrics import record
+from utils.rate_limit import OVERLOAD_STATUSES, request_slot
+
+logger = get_logger()
+
+# Methods that are safe to replay after a failed attempt.
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"})
+
+# Statuses worth retrying; everything else in 4xx is a permanent client error.
+RETRYABLE_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+_session = None
+_session_lock = threading.Lock()
+_session_settings = {"pool_size": 10, "pool_block": True}
+
+
+def configure_session(pool_size: int = 10, pool_block: bool = True) -> None:
+    """
+    Configure the shared HTTP session. Takes effect for the next session created.
+
+    Args:
+        pool_size (int): Max keep-alive connections kept per host.
+        pool_block (bool): Block when the pool is exhausted instead of opening
+            throwaway connections.
+    """
+    global _session
+    with _session_lock:
+        new_settings = {"pool_size": int(pool_size), "pool_block": bool(pool_block)}
+        if new_settings != _session_settings and _session is not None:
+            _session.close()
+            _session = None
+        _session_settings.update(new_settings)
+
+
+def get_session() -> requests.Session:
+    """
+    Return the process-wide pooled session, creating it on first use.
+
+    Connections to the API host are kept alive and reused across endpoints,
+    attempts and threads instead of paying a TCP+TLS handshake per request.
+
+    Returns:
+        requests.Session: Shared session.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=_session_settings["pool_size"],
+                    pool_maxsize=_session_settings["pool_size"],
+                    pool_block=_session_settings["pool_block"],
+                    max_retries=0,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def _retry_after_seconds(resp):
+    """Parse a Retry-After header (delta-seconds or HTTP date) into seconds."""
+    value = resp.headers.get("Retry-After") if resp is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff_delay(attempt, resp, backoff_factor, max_backoff):
+    """
+    Delay before the next attempt: Retry-After on 429/503 if present,
+    otherwise exponential backoff with full jitter.
+    """
+    if resp is not None and resp.status_code in (429, 503):
+        retry_after = _retry_after_seconds(resp)
+        if retry_after is not None:
+            return min(retry_after, max_backoff)
+    return random.uniform(0, min(max_backoff, backoff_factor * (2 ** attempt)))
+
+
+def _is_retryable(method, error):
+    """Only idempotent methods are retried, and only for transient failures."""
+    if method.upper() not in IDEMPOTENT_METHODS:
+        return False
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in RETRYABLE_STATUSES
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def _request_with_retries(method, url, params=None, retries=3, timeout=30,
+                          backoff_factor=0.5, max_backoff=30.0, stream=False, headers=None):
+    """
+    Issue a request on the shared session, retrying transient failures.
+
+    Every attempt waits for the host's adaptive rate limiter (see
+    utils.rate_limit) and reports its status back to it, so 429s and 5xx
+    slow all requests to that host down instead of burning retries. The
+    slot is held until the response headers arrive, so the latency the
+    limiter sees is the server's time to first byte, not the download time
+    of the body (which varies with the response size). Unless `stream` is
+    set, the body is then read after the slot is released, still within
+    the retry loop.
+
+    Returns:
+        requests.Response: A successful (2xx) response.
+    """
+    session = get_session()
+    for attempt in range(retries):
+        resp = None
+        try:
+            with request_slot(url) as outcome:
+                try:
+                    resp = session.request(method, url, params=params, timeout=timeout, stream=True,
+                                           headers=headers)
+                except requests.Timeout:
+                    outcome.timed_out = True
+                    raise
+                outcome.status = resp.status_code
+                if resp.status_code in OVERLOAD_STATUSES:
+                    outcome.retry_after = _retry_after_seconds(resp)
+            resp.raise_for_status()
+            if not stream:
+                resp.content  # download the body outside the limiter slot
+            return resp
+        except Exception as e:
+            logger.error("API fetch failed (attempt %d/%d): %s", attempt + 1, retries, e)
+            if resp is not None:
+                resp.close()
+            if attempt == retries - 1 or not _is_retryable(method, e):
+                raise
+            delay = _backoff_delay(attempt, resp, backoff_factor, max_backoff)
+            record(stage="fetch", retries=1)
+            logger.info("⏳ Retrying %s in %.2fs", url, delay)
+            time.sleep(delay)
+
+
+def fetch_api_data(url, method="GET", params=None, retries=3, timeout=30,
+                   backoff_factor=0.5, max_backoff=30.0):
+    """
+    Fetch JSON from an API endpoint over the shared keep-alive session.
+
+    Args:
+        url (str): Request URL.
+        method (str): HTTP method.
+        params (dict): Optional query parameters.
+        retries (int): Total number of attempts.
+        timeout (int): Per-attempt timeout in seconds.
+        backoff_factor (float): Base delay for exponential backoff.
+        max_backoff (float): Upper bound for a single backoff delay.
+
+    Returns:
+        dict or list: Decoded JSON body ([] for 204 No Content, which the
+        Census API returns when a query matches nothing).
+
+    Raises:
+        requests.RequestException: When all attempts fail or the error is
+            not retryable.
+    """
+    resp = _request_with_retries(method, url, params, retries, timeout, backoff_factor, max_backoff)
+    if resp.status_code == 204:
+        return []
+    record(stage="fetch", bytes_in=len(resp.content))
+    return resp.json()
+
+
+def fetch_api_data_cached(url, cache, ttl, method="GET", params=None, retries=3, timeout=30,
+                          backoff_factor=0.5, max_backoff=30.0):
+    """
+    Fetch JSON through an on-disk response cache with revalidation.
+
+    - Within `ttl` seconds of the last validation the cached body is used
+      without any request.
+    - After that the request is sent with If-None-Match/If-Modified-Since;
+      a 304 reuses the cached body.
+    - A 200 whose body is byte-identical to the cached one also counts as
+      unchanged (many APIs send no validators).
+
+    Only GET requests are cached; anything else is fetched normally.
+
+    Nothing is written to the cache here: the new entry (or the refreshed
+    validation time) is returned as `commit`, to be called once the payload
+    has been stored. A run that fails after fetching then leaves the entry
+    of the last stored payload in place, so "unchanged" always means
+    unchanged since the last successful run.
+
+    Args:
+        url (str): Request URL.
+        cache (ResponseCache): Response cache to use.
+        ttl (float): Seconds a validated entry is served without revalidation.
+        method (str): HTTP method.
+        params (dict): Optional query parameters.
+        retries, timeout, backoff_factor, max_backoff: See fetch_api_data.
+
+    Returns:
+        tuple: (data, changed, commit) where `changed` is False if the
+        payload is the same as the one already cached, and `commit` is a
+        callable that updates the cache (None if there is nothing to update).
+    """
+    if method.upper() != "GET":
+        return fetch_api_data(url, method, params, retries, timeout, backoff_factor, max_backoff), True, None
+
+    key = cache_key(method, url, params)
+    entry = cache.get(key)
+    headers = {}
+    if entry is not None:
+        meta, body = entry
+        if time.time() - meta.get("validated_at", 0) < ttl:
+            logger.info("🗃️ Cache hit (fresh) for %s", url)
+            record(stage="fetch", cache_hits=1)
+            return json.loads(body), False, None
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    resp = _request_with_retries(method, url, params, retries, timeout, backoff_factor, max_backoff,
+                                 headers=headers)
+    if resp.status_code == 304 and entry is not None:
+        logger.info("🗃️ Not modified (304) for %s", url)
+        record(stage="fetch", cache_hits=1)
+        return json.loads(entry[1]), False, partial(cache.touch_validated, key)
+
+    body = resp.content
+    record(stage="fetch", bytes_in=len(body))
+    data = resp.json()
+    changed = entry is None or hashlib.sha256(body).hexdigest() != entry[0].get("digest")
+    if not changed:
+        record(stage="fetch", cache_hits=1)
+    commit = partial(cache.put, key, body, etag=resp.headers.get("ETag"),
+                     last_modified=resp.headers.get("Last-Modified"))
+    return data, changed, commit
+
+
+# Characters that may continue a number cut off at the end of a chunk.
+_NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")
+
+
+def iter_json_array(chunks):
+    """
+    Incrementally parse a top-level JSON array, yielding one element at a time.
+
+    Only the element currently being decoded is buffered, so a Census
+    list-of-lists body never has to be held in memory as a whole.
+
+    Args:
+        chunks (iterable): Raw UTF-8 byte chunks of the response body.
+
+    Yields:
+        Each decoded element of the array (for Census: the header row, then
+        every data row).
+
+    Raises:
+        ValueError: If the body is empty, not a JSON array, malformed
+            (e.g. a missing or doubled ',') or truncated.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    # What may come next: "[", the first element or "]", an element (after
+    # a ','), or the ',' / "]" that follows an element
+    expect = "open"
+    seen = False
+    chunks = iter(chunks)
+
+    while expect != "done":
+        chunk = next(chunks, None)
+        final = chunk is None
+        buffer += utf8.decode(chunk or b"", final=final)
+        pos = 0
+
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos >= len(buffer):
+                break
+            seen = True
+            char = buffer[pos]
+            if expect == "open":
+                if char != "[":
+                    raise ValueError("Streaming fetch expects a top-level JSON array")
+                expect = "first"
+                pos += 1
+                continue
+            if expect in ("first", "separator") and char == "]":
+                expect = "done"
+                break
+            if expect == "separator":
+                if char != ",":
+                    raise ValueError(f"Malformed JSON array: expected ',' or ']', got {char!r}")
+                expect = "element"
+                pos += 1
+                continue
+            if char in ",]":
+                raise ValueError(f"Malformed JSON array: unexpected {char!r}")
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                break  # element continues in the next chunk
+            if not final and _NUMBER_TAIL.fullmatch(buffer, end):
+                break  # a number could still be growing, e.g. "12" -> "123", "3." -> "3.5"
+            yield element
+            expect = "separator"
+            pos = end
+
+        buffer = buffer[pos:]
+        if final and expect != "done":
+            if not seen:
+                raise ValueError("Empty response body (expected a JSON array)")
+            raise ValueError("Truncated JSON array in response body")
+
+
+def _counted(chunks):
+    """Pass body chunks through, counting their bytes as fetched input."""
+    for chunk in chunks:
+        record(stage="fetch", bytes_in=len(chunk))
+        yield chunk
+
+
+def fetch_api_rows(url, method="GET", params=None, retries=3, timeout=30,
+                   backoff_factor=0.5, max_backoff=30.0, chunk_size=64 * 1024):
+    """
+    Stream a list-of-lists API response row by row.
+
+    The body is read in `chunk_size` pieces and parsed incrementally, so
+    memory stays flat regardless of response size. Retries only cover
+    establishing the response; a failure mid-body is raised to the caller.
+
+    Args:
+        url (str): Request URL.
+        method (str): HTTP method.
+        params (dict): Optional query parameters.
+        retries (int): Total number of attempts.
+        timeout (int): Per-attempt timeout in seconds.
+        backoff_factor (float): Base delay for exponential backoff.
+        max_backoff (float): Upper bound for a single backoff delay.
+        chunk_size (int): Bytes read from the socket per chunk.
+
+    Yields:
+        list: The header row, then each data row (nothing for 204 No
+        Content, which fetch_api_data returns as []).
+    """
+    resp = _request_with_retries(method, url, params, retries, timeout, backoff_factor, max_backoff,
+                                 stream=True)
+    try:
+        if resp.status_code == 204:
+            return
+        yield from iter_json_array(_counted(resp.iter_content(chunk_size=chunk_size)))
+    finally:
+        resp.close()
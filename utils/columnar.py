@@ -0,0 +1,246 @@
+import tempfile
+from itertools import islice, zip_longest
+
+# Rows per Parquet row group / Arrow record batch.
+DEFAULT_ROW_GROUP_SIZE = 65536
+
+# Census returns every value as a string; these patterns decide which
+# columns can be stored as numbers without changing their meaning.
+# Leading zeros (FIPS codes such as "01") deliberately stay strings.
+_INT_PATTERN = r"^-?(0|[1-9][0-9]*)$"
+_FLOAT_PATTERN = r"^-?(0|[1-9][0-9]*)(\.[0-9]+)?([eE][-+]?[0-9]+)?$"
+
+COLUMNAR_FORMATS = {"parquet", "arrow"}
+
+
+def _require_pyarrow():
+    """Import pyarrow lazily; it is only needed for columnar output."""
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+    except ImportError as e:
+        raise ImportError("pyarrow is required for parquet/arrow output (pip install pyarrow)") from e
+    return pa, pc
+
+
+def _string_array(pa, values):
+    """Build a string array, stringifying any non-string cells."""
+    try:
+        return pa.array(values, type=pa.string())
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([v if v is None or isinstance(v, str) else str(v) for v in values],
+                        type=pa.string())
+
+
+def _batch_columns(rows, width):
+    """Transpose a batch of rows into `width` columns, padding short rows."""
+    columns = list(zip_longest(*rows))[:width]
+    columns += [(None,) * len(rows)] * (width - len(columns))
+    return columns
+
+
+def _column_kind(pa, pc, array):
+    """Classify a string column as 'int64', 'float64' or 'string'."""
+    values = array.drop_null()
+    if len(values) == 0:
+        return "string"
+    if pc.all(pc.match_substring_regex(values, _INT_PATTERN)).as_py():
+        try:
+            values.cast(pa.int64())
+            return "int64"
+        except (pa.ArrowInvalid, OverflowError):
+            pass  # out of int64 range, try float
+    if pc.all(pc.match_substring_regex(values, _FLOAT_PATTERN)).as_py():
+        return "float64"
+    return "string"
+
+
+# Narrowest-to-widest order used when merging kinds across batches.
+_KIND_ORDER = ["int64", "float64", "string"]
+
+
+def _update_kinds(pa, pc, kinds, arrays):
+    """Widen per-column kinds so they fit a batch of string arrays (None: not inspected)."""
+    for i, array in enumerate(arrays):
+        if kinds[i] == "string" or array is None or array.null_count == len(array):
+            continue
+        kind = _column_kind(pa, pc, array)
+        kinds[i] = kind if kinds[i] is None else max(kinds[i], kind, key=_KIND_ORDER.index)
+
+
+def _schema(pa, columns, kinds):
+    return pa.schema([(str(name), getattr(pa, kind or "string")()) for name, kind in zip(columns, kinds)])
+
+
+def infer_schema(columns, rows, batch_size=DEFAULT_ROW_GROUP_SIZE):
+    """
+    Infer a per-column numeric/string schema from string-valued rows.
+
+    A column is int64 if every non-null value is a canonical integer,
+    float64 if every value is a plain decimal number, otherwise string.
+
+    Args:
+        columns (list): Column names.
+        rows (iterable): Rows to inspect.
+        batch_size (int): Rows converted to Arrow at a time.
+
+    Returns:
+        pyarrow.Schema: Inferred schema.
+    """
+    pa, pc = _require_pyarrow()
+    width = len(columns)
+    kinds = [None] * width
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        _update_kinds(pa, pc, kinds, [
+            None if kinds[i] == "string" else _string_array(pa, values)
+            for i, values in enumerate(_batch_columns(batch, width))
+        ])
+    return _schema(pa, columns, kinds)
+
+
+class ColumnarRowWriter:
+    """
+    Incrementally writes header+rows to Parquet or Arrow IPC in row groups.
+
+    Only one row group is buffered in memory at a time. With an explicit
+    schema every row group is written as it fills up. Without one, column
+    types are inferred over all rows (like infer_schema): row groups are
+    spooled as strings to a temporary file while their types are merged,
+    and the output is written by close(). A column with a value that does
+    not fit its numeric type (e.g. "N" among counts) is thus stored as
+    strings instead of failing the output.
+
+    Args:
+        fh (file): Writable binary handle.
+        fmt (str): "parquet" or "arrow".
+        compression (str): Codec; parquet: snappy/gzip/brotli/zstd/lz4/none,
+            arrow: zstd/lz4/none.
+        row_group_size (int): Rows per row group / record batch.
+        schema (pyarrow.Schema): Optional pre-computed schema.
+    """
+
+    def __init__(self, fh, fmt="parquet", compression="zstd", row_group_size=DEFAULT_ROW_GROUP_SIZE,
+                 schema=None):
+        if fmt not in COLUMNAR_FORMATS:
+            raise ValueError(f"Unsupported columnar format: {fmt}")
+        self._fh = fh
+        self._fmt = fmt
+        self._compression = None if compression in (None, "none") else compression
+        self._row_group_size = int(row_group_size)
+        self._schema = schema
+        self._header = None
+        self._batch = []
+        self._writer = None
+        self._kinds = None   # column kinds inferred so far (no explicit schema)
+        self._spool = None   # temporary file of string row groups
+        self._spool_writer = None
+
+    def write_row(self, row):
+        if self._header is None:
+            self._header = row
+            return
+        self._batch.append(row)
+        if len(self._batch) >= self._row_group_size:
+            self._flush()
+
+    def _open(self, pa):
+        if self._fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            string_columns = [f.name for f in self._schema if pa.types.is_string(f.type)]
+            self._writer = pq.ParquetWriter(
+                self._fh,
+                self._schema,
+                compression=self._compression or "none",
+                use_dictionary=string_columns or False,
+            )
+        else:
+            import pyarrow.ipc as ipc
+
+            self._writer = ipc.new_file(
+                self._fh, self._schema, options=ipc.IpcWriteOptions(compression=self._compression)
+            )
+
+    def _flush(self):
+        pa, pc = _require_pyarrow()
+        if self._schema is None:
+            self._spool_batch(pa, pc)
+        else:
+            self._write_batch(pa, [_string_array(pa, values)
+                                   for values in _batch_columns(self._batch, len(self._schema))])
+        self._batch = []
+
+    def _spool_batch(self, pa, pc):
+        import pyarrow.ipc as ipc
+
+        width = len(self._header)
+        arrays = [_string_array(pa, values) for values in _batch_columns(self._batch, width)]
+        if self._spool is None:
+            self._kinds = [None] * width
+            self._spool = tempfile.TemporaryFile()
+            self._spool_writer = ipc.new_stream(self._spool, _schema(pa, self._header, self._kinds))
+        _update_kinds(pa, pc, self._kinds, arrays)
+        self._spool_writer.write_batch(pa.record_batch(arrays, names=[str(name) for name in self._header]))
+
+    def _write_batch(self, pa, arrays):
+        """Write one row group of string arrays, cast to the schema."""
+        for i, field in enumerate(self._schema):
+            if not pa.types.is_string(field.type):
+                try:
+                    arrays[i] = arrays[i].cast(field.type)
+                except pa.ArrowInvalid as e:
+                    raise ValueError(f"Column '{field.name}' does not match schema type {field.type}: {e}")
+        if self._writer is None:
+            self._open(pa)
+        batch = pa.record_batch(arrays, schema=self._schema)
+        if self._fmt == "parquet":
+            self._writer.write_batch(batch, row_group_size=self._row_group_size)
+        else:
+            self._writer.write_batch(batch)
+
+    def close(self):
+        if self._header is None:
+            raise ValueError("No header row to build a columnar schema from")
+        if self._batch:
+            self._flush()
+        pa, _ = _require_pyarrow()
+        if self._spool is not None:
+            # Every row was seen: write the spooled row groups with their final types
+            import pyarrow.ipc as ipc
+
+            self._spool_writer.close()
+            self._schema = _schema(pa, self._header, self._kinds)
+            self._spool.seek(0)
+            try:
+                for batch in ipc.open_stream(self._spool):
+                    self._write_batch(pa, batch.columns)
+            finally:
+                self._spool.close()
+                self._spool = None
+        if self._writer is None:
+            # Header only: an empty file with the (string) schema
+            if self._schema is None:
+                self._schema = _schema(pa, self._header, [None] * len(self._header))
+            self._write_batch(pa, [pa.array([], type=field.type) for field in self._schema])
+        self._writer.close()
+
+
+def encode_columnar(fmt):
+    """
+    Build a Table encoder for a columnar format.
+
+    Types are inferred over the whole table before writing, then rows are
+    written in row groups.
+    """
+    def _encode(table, fh, compression="zstd", row_group_size=DEFAULT_ROW_GROUP_SIZE):
+        schema = infer_schema(table.columns, table.rows, batch_size=row_group_size)
+        writer = ColumnarRowWriter(fh, fmt, compression, row_group_size, schema)
+        writer.write_row(table.columns)
+        for row in table.rows:
+            writer.write_row(row)
+        writer.close()
+    return _encode
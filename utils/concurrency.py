@@ -0,0 +1,132 @@
+import contextvars
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+
+def host_of(url: str) -> str:
+    """
+    Extract the host (netloc) of a URL, used as the key for per-host limits.
+
+    Args:
+        url (str): Full request URL.
+
+    Returns:
+        str: Lower-cased host, e.g. 'api.census.gov'.
+    """
+    return urlparse(url).netloc.lower()
+
+
+def run_concurrently(func, items, max_workers=1, key=None, per_key_limit=None) -> list:
+    """
+    Run `func(item)` for every item on a bounded thread pool.
+
+    A failing item never cancels the others: exceptions are captured and
+    returned alongside the item instead of being raised. Each item runs in
+    a copy of the caller's context, so context variables (e.g. the active
+    metrics run) are visible in the workers.
+
+    The per-key limit is applied when items are handed to the pool: an item
+    whose key is saturated waits in the caller's queue, not in a worker, so
+    it never holds a thread that an item of another key could use. Items
+    start in input order among those whose key has capacity.
+
+    Args:
+        func (callable): Function applied to each item.
+        items (iterable): Work items.
+        max_workers (int): Global number of worker threads.
+        key (callable): Optional function mapping an item to a limiter key.
+        per_key_limit (int): Max concurrent items per key (None = unlimited).
+
+    Returns:
+        list: (item, result, error) tuples in input order; exactly one of
+        result/error is meaningful.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    workers = max(1, min(int(max_workers or 1), len(items)))
+    limit = per_key_limit if key else None
+    # key -> indexes of its items not yet submitted, in input order
+    queues = {}
+    for index, item in enumerate(items):
+        queues.setdefault(key(item) if limit else None, deque()).append(index)
+    running = dict.fromkeys(queues, 0)
+    futures = {}
+
+    def _next_index():
+        """Earliest queued item whose key has capacity (None if there is none)."""
+        ready = [queue for item_key, queue in queues.items()
+                 if queue and (not limit or running[item_key] < limit)]
+        if not ready:
+            return None
+        return min(ready, key=lambda queue: queue[0]).popleft()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+        while True:
+            while len(in_flight) < workers:
+                index = _next_index()
+                if index is None:
+                    break
+                item_key = key(items[index]) if limit else None
+                running[item_key] += 1
+                future = pool.submit(contextvars.copy_context().run, func, items[index])
+                in_flight[future] = (index, item_key)
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, item_key = in_flight.pop(future)
+                running[item_key] -= 1
+                futures[index] = future
+
+    outcomes = []
+    for index, item in enumerate(items):
+        try:
+            outcomes.append((item, futures[index].result(), None))
+        except Exception as e:
+            outcomes.append((item, None, e))
+    return outcomes
+
+
+def imap_bounded(func, items, max_workers=1, window=None):
+    """
+    Lazily run `func(item)` on a thread pool, yielding outcomes in input order.
+
+    At most `window` items are in flight or finished-but-unconsumed at any
+    time, so results are not accumulated faster than the caller consumes them.
+    Like run_concurrently, each item runs in a copy of the caller's context.
+
+    Args:
+        func (callable): Function applied to each item.
+        items (iterable): Work items.
+        max_workers (int): Worker threads.
+        window (int): Max submitted-but-unyielded items (default 2 * max_workers).
+
+    Yields:
+        tuple: (item, result, error), like run_concurrently.
+    """
+    workers = max(1, int(max_workers or 1))
+    window = max(workers, int(window or 2 * workers))
+    items = iter(items)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for item in items:
+            pending.append((item, pool.submit(contextvars.copy_context().run, func, item)))
+            if len(pending) >= window:
+                break
+        while pending:
+            item, future = pending.popleft()
+            try:
+                outcome = (item, future.result(), None)
+            except Exception as e:
+                outcome = (item, None, e)
+            next_item = next(items, _END)
+            if next_item is not _END:
+                pending.append((next_item, pool.submit(contextvars.copy_context().run, func, next_item)))
+            yield outcome
+
+
+_END = object()
@@ -1,9 +1,503 @@
-import yaml
-import os
-
-def load_config(env="dev"):
-    config_path = os.path.join("config", f"{env.lower()}.yml")
-    if not os.path.exists(config_path):
-        raise FileNotFoundError(f"Config file not found: {config_path}")
-    with open(config_path, "r") as f:
-        return yaml.safe_load(f)
\ No newline at end of file
+import os
+import re
+import threading
+from types import MappingProxyType
+
+import yaml
+
+from utils.concurrency import host_of
+from utils.data_formatter import ENCODERS, JSON_BACKENDS
+from utils.env import is_running_in_gcf
+from utils.logger import get_logger
+from utils.manifest import MANIFEST_STORES
+from utils.partitioning import partition_columns
+from utils.scheduler import parse_interval
+from utils.storage_handler import COMPRESSION_EXTENSIONS
+from utils.tabular import NESTED_MODES
+
+logger = get_logger()
+
+CONFIG_DIR = "config"
+
+# Tried in order, so env.yml wins over env.yaml if both exist.
+CONFIG_EXTENSIONS = (".yml", ".yaml")
+
+HTTP_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"}
+DEDUP_MODES = {"skip", "alias"}
+
+# GCS rejects resumable upload chunks that are not a multiple of 256 KiB.
+UPLOAD_CHUNK_ALIGNMENT = 256 * 1024
+
+_NUMBER = (int, float)
+
+# Schema: key -> (allowed types, required). Unknown keys are errors, so a
+# typo fails at load time instead of being silently ignored mid-run.
+_HTTP_SCHEMA = {
+    "pool_size": (int, False),
+    "pool_block": (bool, False),
+    "retries": (int, False),
+    "timeout": (_NUMBER, False),
+    "backoff_factor": (_NUMBER, False),
+    "max_backoff": (_NUMBER, False),
+    "chunk_size": (int, False),
+}
+_HTTP_CACHE_SCHEMA = {
+    "dir": (str, False),
+    "max_bytes": (int, False),
+}
+_UPLOAD_SCHEMA = {
+    "max_workers": (int, False),
+    "chunk_size": (int, False),
+    "composite_threshold": (int, False),
+    "dedup": ((str, type(None)), False),
+}
+_METRICS_SCHEMA = {
+    "prometheus_file": (str, False),
+    "otlp_endpoint": (str, False),
+}
+_RATE_LIMIT_SCHEMA = {
+    "enabled": (bool, False),
+    "max_rate": ((int, float, type(None)), False),
+    "burst": (int, False),
+    "initial_concurrency": (int, False),
+    "min_concurrency": (int, False),
+    "max_concurrency": (int, False),
+    "backoff": (_NUMBER, False),
+    "latency_factor": (_NUMBER, False),
+}
+_SCHEDULER_SCHEMA = {
+    "tick": (_NUMBER, False),
+    "jitter": (_NUMBER, False),
+    "retry_after": (_NUMBER, False),
+}
+_MANIFEST_SCHEMA = {
+    "enabled": (bool, False),
+    "store": (str, False),
+    "spool_shards": (bool, False),
+    "keep_runs": (int, False),
+}
+_DEFAULTS_SCHEMA = {
+    "local_only": (bool, True),
+    "bucket": (str, False),
+    "gcs_path_prefix": (str, False),
+    "create_bucket_if_missing": (bool, False),
+    "max_workers": (int, False),
+    "max_workers_per_host": (int, False),
+    "state_dir": (str, False),
+    "http": (dict, False),
+    "http_cache": (dict, False),
+    "upload": (dict, False),
+    "metrics": (dict, False),
+    "scheduler": (dict, False),
+    "rate_limit": (dict, False),
+    "manifest": (dict, False),
+}
+_DELTA_SCHEMA = {
+    "key_columns": (list, True),
+    "compact_every": (int, False),
+    "state_dir": (str, False),
+}
+_SHARD_SCHEMA = {
+    "params": (dict, True),
+    "max_workers": (int, False),
+    "retries": (int, False),
+    "backoff": (_NUMBER, False),
+}
+_PARALLEL_ENCODE_SCHEMA = {
+    "processes": (int, False),
+    "min_rows": (int, False),
+    "chunk_rows": (int, False),
+}
+_FLATTEN_SCHEMA = {
+    "nested": (str, False),
+    "max_depth": (int, False),
+    "separator": (str, False),
+    "index_name": (str, False),
+}
+_PARTITION_OPTIONS_SCHEMA = {
+    "workers": (int, False),
+    "max_bytes": (int, False),
+    "max_partitions": (int, False),
+}
+_ENDPOINT_SCHEMA = {
+    "name": (str, True),
+    "url": (str, True),
+    "method": (str, False),
+    "output_formats": (list, False),
+    "formats": (list, False),  # legacy spelling of output_formats
+    "format_options": (dict, False),
+    "format_workers": (int, False),
+    "parallel_encode": (dict, False),
+    "flatten": (dict, False),
+    "partition_by": ((str, list), False),
+    "partition_options": (dict, False),
+    "compression": ((str, type(None)), False),
+    "stream": (bool, False),
+    "cache_ttl": (_NUMBER, False),
+    "delta": (dict, False),
+    "shard": (dict, False),
+    "http": (dict, False),
+    "local_path": (str, False),
+    "gcs_path": (str, False),
+    "stream_upload": (bool, False),
+    "keep_local": (bool, False),
+    "refresh_interval": ((int, float, str), False),
+    "priority": (int, False),
+}
+_CONFIG_SCHEMA = {
+    "environment": (str, False),
+    "defaults": (dict, True),
+    "endpoints": (list, True),
+}
+
+_POSITIVE_INTS = ("max_workers", "max_workers_per_host", "pool_size", "retries",
+                  "chunk_size", "composite_threshold", "max_bytes", "format_workers",
+                  "processes", "chunk_rows", "burst", "initial_concurrency",
+                  "min_concurrency", "max_concurrency", "keep_runs", "workers",
+                  "max_partitions")
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+
+def find_config_file(env="dev", config_dir=CONFIG_DIR) -> str:
+    """
+    Locate the config file for an environment (<env>.yml or <env>.yaml).
+
+    Args:
+        env (str): Environment name (dev, qa, prod).
+        config_dir (str): Directory holding the config files.
+
+    Returns:
+        str: Path to the config file.
+
+    Raises:
+        FileNotFoundError: If neither extension exists.
+    """
+    candidates = [os.path.join(config_dir, f"{env.lower()}{ext}") for ext in CONFIG_EXTENSIONS]
+    for path in candidates:
+        if os.path.isfile(path):
+            return path
+    raise FileNotFoundError(f"Config file not found: {' or '.join(candidates)}")
+
+
+def load_config(env="dev", config_dir=CONFIG_DIR) -> dict:
+    """
+    Read and parse the raw YAML config for an environment.
+
+    Args:
+        env (str): Environment name (dev, qa, prod).
+        config_dir (str): Directory holding the config files.
+
+    Returns:
+        dict: Parsed YAML.
+    """
+    config_path = find_config_file(env, config_dir)
+    with open(config_path, "r") as f:
+        return yaml.safe_load(f)
+
+
+def _check_section(section, schema, where, errors):
+    """Check one mapping against a schema, appending problems to `errors`."""
+    if not isinstance(section, dict):
+        errors.append(f"{where}: expected a mapping, got {type(section).__name__}")
+        return False
+    for key in section.keys() - schema.keys():
+        errors.append(f"{where}.{key}: unknown key")
+    for key, (types, required) in schema.items():
+        if key not in section:
+            if required:
+                errors.append(f"{where}.{key}: required")
+            continue
+        value = section[key]
+        allowed = types if isinstance(types, tuple) else (types,)
+        if isinstance(value, bool) and bool not in allowed:
+            ok = False  # bool is an int subclass; never accept it as a number
+        else:
+            ok = isinstance(value, allowed)
+        if not ok:
+            names = "/".join("null" if t is type(None) else t.__name__ for t in allowed)
+            errors.append(f"{where}.{key}: expected {names}, got {type(value).__name__}")
+        elif key in _POSITIVE_INTS and value < 1:
+            errors.append(f"{where}.{key}: must be >= 1")
+    return True
+
+
+def _check_endpoint(endpoint, where, defaults, errors):
+    """Endpoint-level rules beyond the plain schema."""
+    url = endpoint.get("url")
+    if isinstance(url, str) and not url.startswith(("http://", "https://")):
+        errors.append(f"{where}.url: must be an http(s) URL")
+    method = endpoint.get("method", "GET")
+    if isinstance(method, str) and method.upper() not in HTTP_METHODS:
+        errors.append(f"{where}.method: unsupported method {method!r}")
+
+    if "formats" in endpoint and "output_formats" in endpoint:
+        errors.append(f"{where}: use output_formats only (formats is its legacy spelling)")
+    formats = endpoint.get("output_formats", endpoint.get("formats", ["json"]))
+    if isinstance(formats, list):
+        if not formats:
+            errors.append(f"{where}.output_formats: must not be empty")
+        for fmt in formats:
+            if fmt not in ENCODERS:
+                errors.append(f"{where}.output_formats: unsupported format {fmt!r} "
+                              f"(expected one of {', '.join(sorted(ENCODERS))})")
+        if len(set(map(str, formats))) != len(formats):
+            errors.append(f"{where}.output_formats: duplicate format")
+    options = endpoint.get("format_options")
+    if isinstance(options, dict):
+        for fmt in options.keys() - set(formats if isinstance(formats, list) else []):
+            errors.append(f"{where}.format_options.{fmt}: format not in output_formats")
+        json_options = options.get("json")
+        if isinstance(json_options, dict):
+            backend = json_options.get("backend", "json")
+            indent = json_options.get("indent", 2)
+            if backend not in JSON_BACKENDS:
+                errors.append(f"{where}.format_options.json.backend: expected one of {', '.join(JSON_BACKENDS)}")
+            if indent is not None and (not isinstance(indent, int) or isinstance(indent, bool) or indent < 0):
+                errors.append(f"{where}.format_options.json.indent: must be a non-negative integer or null")
+            elif backend == "orjson" and indent not in (None, 2):
+                errors.append(f"{where}.format_options.json.indent: orjson only supports 2 or null")
+
+    compression = endpoint.get("compression")
+    if compression is not None and compression not in COMPRESSION_EXTENSIONS:
+        errors.append(f"{where}.compression: expected one of {', '.join(COMPRESSION_EXTENSIONS)}")
+    if isinstance(endpoint.get("cache_ttl"), _NUMBER) and endpoint["cache_ttl"] < 0:
+        errors.append(f"{where}.cache_ttl: must be >= 0")
+    if "cache_ttl" in endpoint and (endpoint.get("stream") or endpoint.get("shard")):
+        errors.append(f"{where}.cache_ttl: cannot be combined with stream or shard")
+
+    if "delta" in endpoint and _check_section(endpoint["delta"], _DELTA_SCHEMA, f"{where}.delta", errors):
+        if endpoint["delta"].get("key_columns") == []:
+            errors.append(f"{where}.delta.key_columns: must not be empty")
+        durable = ((defaults.get("manifest") or {}).get("store") == "gcs"
+                   or "state_dir" in endpoint["delta"] or "state_dir" in defaults)
+        if is_running_in_gcf() and not durable:
+            errors.append(f"{where}.delta: on Cloud Functions the index needs defaults.manifest.store: gcs "
+                          "or a state_dir on durable storage (/tmp does not outlive the instance)")
+    if "shard" in endpoint and _check_section(endpoint["shard"], _SHARD_SCHEMA, f"{where}.shard", errors):
+        params = endpoint["shard"].get("params")
+        if isinstance(params, dict) and isinstance(url, str):
+            for name in set(_PLACEHOLDER.findall(url)) - params.keys():
+                errors.append(f"{where}.url: placeholder {{{name}}} has no shard.params entry")
+            for name in params.keys() - set(_PLACEHOLDER.findall(url)):
+                errors.append(f"{where}.shard.params.{name}: no {{{name}}} placeholder in url")
+    if "http" in endpoint:
+        _check_section(endpoint["http"], _HTTP_SCHEMA, f"{where}.http", errors)
+    if "parallel_encode" in endpoint:
+        _check_section(endpoint["parallel_encode"], _PARALLEL_ENCODE_SCHEMA, f"{where}.parallel_encode", errors)
+    if "flatten" in endpoint and _check_section(endpoint["flatten"], _FLATTEN_SCHEMA, f"{where}.flatten", errors):
+        flatten = endpoint["flatten"]
+        if "nested" in flatten and flatten["nested"] not in NESTED_MODES:
+            errors.append(f"{where}.flatten.nested: expected one of {', '.join(NESTED_MODES)}")
+        if isinstance(flatten.get("max_depth"), int) and flatten["max_depth"] < 0:
+            errors.append(f"{where}.flatten.max_depth: must be >= 0")
+    if "partition_by" in endpoint:
+        columns = partition_columns(endpoint["partition_by"])
+        if not columns or not all(isinstance(column, str) and column for column in columns):
+            errors.append(f"{where}.partition_by: expected a column name or a non-empty list of them")
+        elif len(set(columns)) != len(columns):
+            errors.append(f"{where}.partition_by: duplicate column")
+        if endpoint.get("stream_upload"):
+            errors.append(f"{where}.partition_by: cannot be combined with stream_upload "
+                          "(partitions are written locally, then uploaded)")
+        if endpoint.get("stream") or endpoint.get("shard"):
+            errors.append(f"{where}.partition_by: cannot be combined with stream or shard "
+                          "(rows are routed to their partitions in memory)")
+    if "partition_options" in endpoint:
+        _check_section(endpoint["partition_options"], _PARTITION_OPTIONS_SCHEMA, f"{where}.partition_options", errors)
+        if "partition_by" not in endpoint:
+            errors.append(f"{where}.partition_options: requires partition_by")
+
+    if defaults.get("local_only") is False and not endpoint.get("gcs_path"):
+        errors.append(f"{where}.gcs_path: required when defaults.local_only is false")
+    if endpoint.get("stream_upload"):
+        if defaults.get("local_only") is not False:
+            errors.append(f"{where}.stream_upload: requires defaults.local_only: false")
+        if "delta" in endpoint:
+            errors.append(f"{where}.stream_upload: cannot be combined with delta "
+                          "(an empty delta is only known after the upload)")
+    elif endpoint.get("keep_local") is False:
+        errors.append(f"{where}.keep_local: false requires stream_upload")
+    if "refresh_interval" in endpoint:
+        try:
+            parse_interval(endpoint["refresh_interval"])
+        except ValueError as e:
+            errors.append(f"{where}.refresh_interval: {e}")
+
+
+def validate_config(config, source="config") -> None:
+    """
+    Validate a parsed config against the schema, reporting every problem at once.
+
+    Args:
+        config (dict): Parsed YAML.
+        source (str): Name used in the error message (usually the file path).
+
+    Raises:
+        ValueError: If the config is invalid.
+    """
+    errors = []
+    if _check_section(config, _CONFIG_SCHEMA, "config", errors):
+        defaults = config.get("defaults")
+        if isinstance(defaults, dict) and _check_section(defaults, _DEFAULTS_SCHEMA, "defaults", errors):
+            for key, schema in (("http", _HTTP_SCHEMA), ("http_cache", _HTTP_CACHE_SCHEMA),
+                                ("upload", _UPLOAD_SCHEMA), ("metrics", _METRICS_SCHEMA),
+                                ("scheduler", _SCHEDULER_SCHEMA), ("rate_limit", _RATE_LIMIT_SCHEMA),
+                                ("manifest", _MANIFEST_SCHEMA)):
+                if key in defaults:
+                    _check_section(defaults[key], schema, f"defaults.{key}", errors)
+            scheduler = defaults.get("scheduler")
+            if isinstance(scheduler, dict):
+                for key, value in scheduler.items():
+                    if isinstance(value, _NUMBER) and not isinstance(value, bool) and value <= 0:
+                        errors.append(f"defaults.scheduler.{key}: must be > 0")
+            rate_limit = defaults.get("rate_limit")
+            if isinstance(rate_limit, dict):
+                if isinstance(rate_limit.get("max_rate"), _NUMBER) and rate_limit["max_rate"] <= 0:
+                    errors.append("defaults.rate_limit.max_rate: must be > 0 (or null for adaptive)")
+                backoff = rate_limit.get("backoff")
+                if isinstance(backoff, _NUMBER) and not 0 < backoff < 1:
+                    errors.append("defaults.rate_limit.backoff: must be between 0 and 1")
+                factor = rate_limit.get("latency_factor")
+                if isinstance(factor, _NUMBER) and factor <= 1:
+                    errors.append("defaults.rate_limit.latency_factor: must be > 1")
+            manifest = defaults.get("manifest")
+            if isinstance(manifest, dict) and "store" in manifest:
+                if manifest["store"] not in MANIFEST_STORES:
+                    errors.append(f"defaults.manifest.store: expected one of {', '.join(MANIFEST_STORES)}")
+                elif manifest["store"] == "gcs" and defaults.get("local_only") is not False:
+                    errors.append("defaults.manifest.store: 'gcs' requires local_only: false")
+            upload = defaults.get("upload")
+            if isinstance(upload, dict) and upload.get("dedup") not in (None, *DEDUP_MODES):
+                errors.append(f"defaults.upload.dedup: expected one of {', '.join(sorted(DEDUP_MODES))}")
+            chunk_size = upload.get("chunk_size") if isinstance(upload, dict) else None
+            if isinstance(chunk_size, int) and not isinstance(chunk_size, bool) and chunk_size % UPLOAD_CHUNK_ALIGNMENT:
+                errors.append(f"defaults.upload.chunk_size: must be a multiple of 256 KiB ({UPLOAD_CHUNK_ALIGNMENT} bytes)")
+            if defaults.get("local_only") is False:
+                for key in ("bucket", "gcs_path_prefix"):
+                    if not defaults.get(key):
+                        errors.append(f"defaults.{key}: required when local_only is false")
+        else:
+            defaults = {}
+
+        endpoints = config.get("endpoints")
+        if isinstance(endpoints, list):
+            if not endpoints:
+                errors.append("endpoints: must not be empty")
+            seen = set()
+            for i, endpoint in enumerate(endpoints):
+                where = f"endpoints[{i}]"
+                if not _check_section(endpoint, _ENDPOINT_SCHEMA, where, errors):
+                    continue
+                name = endpoint.get("name")
+                if name in seen:
+                    errors.append(f"{where}.name: duplicate endpoint name {name!r}")
+                seen.add(name)
+                _check_endpoint(endpoint, f"endpoints[{name or i}]", defaults, errors)
+
+    if errors:
+        raise ValueError(f"Invalid config {source}:\n  - " + "\n  - ".join(errors))
+
+
+def _freeze(value):
+    """Recursively turn dicts into read-only mappings and lists into tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _resolve_endpoint(endpoint, defaults) -> dict:
+    """Fill in the derived fields every run needs, so workers never recompute them."""
+    resolved = dict(endpoint)
+    resolved["method"] = endpoint.get("method", "GET").upper()
+    resolved["host"] = host_of(endpoint["url"])
+    resolved["output_formats"] = list(resolved.pop("formats", None) or endpoint.get("output_formats") or ["json"])
+
+    local_path = endpoint.get("local_path", "output")
+    if is_running_in_gcf() and not os.path.isabs(local_path):
+        local_path = os.path.join("/tmp", local_path)  # only /tmp is writable in GCF
+    resolved["local_path"] = local_path
+    resolved["stream_upload"] = bool(endpoint.get("stream_upload", False))
+    resolved["keep_local"] = endpoint.get("keep_local", not resolved["stream_upload"])
+    resolved["refresh_seconds"] = (
+        parse_interval(endpoint["refresh_interval"]) if "refresh_interval" in endpoint else None
+    )
+    resolved["priority"] = endpoint.get("priority", 0)
+    resolved["partition_by"] = partition_columns(endpoint.get("partition_by"))
+
+    resolved["gcs_destination"] = (
+        None if defaults["local_only"]
+        else f"{defaults['gcs_path_prefix'].strip('/')}/{endpoint['gcs_path'].strip('/')}"
+    )
+    return resolved
+
+
+def compile_plan(config, source=None):
+    """
+    Compile a validated config into an immutable execution plan.
+
+    The plan is the config with every derived value resolved up front
+    (method, API host, output formats, local folder and GCS destination per
+    endpoint, defaults filled in) and frozen, so it can be shared safely by
+    concurrent workers and reused across warm invocations.
+
+    Args:
+        config (dict): Parsed and validated YAML.
+        source (str): Path the config was read from.
+
+    Returns:
+        MappingProxyType: Read-only plan with 'environment', 'source',
+        'defaults' and 'endpoints' (a tuple of read-only endpoint mappings).
+    """
+    defaults = {"create_bucket_if_missing": False, "max_workers": 1, **config["defaults"]}
+    return _freeze({
+        "environment": config.get("environment"),
+        "source": source,
+        "defaults": defaults,
+        "endpoints": [_resolve_endpoint(endpoint, defaults) for endpoint in config["endpoints"]],
+    })
+
+
+_plans = {}
+_plans_lock = threading.Lock()
+
+
+def load_plan(env="dev", config_dir=CONFIG_DIR):
+    """
+    Return the execution plan for an environment, cached for warm invocations.
+
+    The plan is built (parse + validate + compile) once per environment and
+    reused until the config file's modification time or size changes, so a
+    warm Cloud Function instance only pays for a stat() per request.
+
+    Args:
+        env (str): Environment name (dev, qa, prod).
+        config_dir (str): Directory holding the config files.
+
+    Returns:
+        MappingProxyType: Read-only execution plan (see compile_plan).
+
+    Raises:
+        FileNotFoundError: If no config file exists for the environment.
+        ValueError: If the config fails validation.
+    """
+    config_path = find_config_file(env, config_dir)
+    stat = os.stat(config_path)
+    signature = (os.path.abspath(config_path), stat.st_mtime_ns, stat.st_size)
+    cache_key = (os.path.abspath(config_dir), env.lower())
+
+    with _plans_lock:
+        cached = _plans.get(cache_key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        with open(config_path, "r") as f:
+            config = yaml.safe_load(f)
+        validate_config(config, source=config_path)
+        plan = compile_plan(config, source=config_path)
+        _plans[cache_key] = (signature, plan)
+        logger.info("🗂️ Compiled execution plan for %s from %s (%d endpoint(s))",
+                    env, config_path, len(plan["endpoints"]))
+        return plan
@@ -1,166 +1,759 @@
-# import pandas as pd
-# import json
-
-# def format_data(data, fmt="json"):
-#     if fmt == "json":
-#         return json.dumps(data, indent=2)
-#     elif fmt == "csv":
-#         if isinstance(data, dict) and "variables" in data:
-#             df = pd.DataFrame(data["variables"]).T.reset_index()
-#             return df.to_csv(index=False)
-#         elif isinstance(data, list):
-#             df = pd.DataFrame(data[1:], columns=data[0])
-#             return df.to_csv(index=False)
-#         else:
-#             df = pd.DataFrame([data])
-#             return df.to_csv(index=False)
-#     elif fmt == "txt":
-#         return json.dumps(data, indent=2)
-#     else:
-#         raise ValueError(f"Unsupported format: {fmt}")
-
-##################### Below code ###########################
-# import os
-# import json
-# import pandas as pd
-# from datetime import datetime
-# from utils.logger import get_logger
-
-# logger = get_logger()
-
-# def format_data(data, fmt="json"):
-#     if fmt == "json":
-#         return json.dumps(data, indent=2)
-#     elif fmt == "csv":
-#         if isinstance(data, dict) and "variables" in data:
-#             df = pd.DataFrame(data["variables"]).T.reset_index()
-#             return df.to_csv(index=False)
-#         elif isinstance(data, list):
-#             df = pd.DataFrame(data[1:], columns=data[0])
-#             return df.to_csv(index=False)
-#         else:
-#             df = pd.DataFrame([data])
-#             return df.to_csv(index=False)
-#     elif fmt == "txt":
-#         return json.dumps(data, indent=2)
-#     else:
-#         raise ValueError(f"Unsupported format: {fmt}")
-
-# def save_data_formats(endpoint: dict, data: dict) -> list:
-#     formats = endpoint.get("formats", ["json"])
-#     name = endpoint.get("name", "data")
-#     timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-#     folder = "output"
-#     os.makedirs(folder, exist_ok=True)
-
-#     file_paths = []
-
-#     for fmt in formats:
-#         formatted_data = format_data(data, fmt)
-#         file_name = f"{name}_{timestamp}.{fmt}"
-#         file_path = os.path.join(folder, file_name)
-
-#         with open(file_path, "w", encoding="utf-8") as f:
-#             f.write(formatted_data)
-
-#         logger.info(f"💾 Saved file: {file_path}")
-#         file_paths.append(file_path)
-
-#     return file_paths
-
-################################### END OF CODE #####################################
-import os
-import json
-import pandas as pd
-from datetime import datetime
-from utils.logger import get_logger
-
-logger = get_logger()
-
-def format_data(data, fmt="json"):
-    """
-    Format data into the specified format.
-
-    Args:
-        data (dict or list): Raw data to format.
-        fmt (str): Format type ("json", "csv", "txt").
-
-    Returns:
-        str: Formatted string.
-
-    Raises:
-        ValueError: If format is unsupported.
-    """
-    if not isinstance(data, (dict, list)):
-        raise TypeError("Data must be a dict or list.")
-
-    if fmt == "json":
-        return json.dumps(data, indent=2)
-
-    elif fmt == "txt":
-        # Text format - simplified version of the JSON dump, or line-based string.
-        if isinstance(data, dict):
-            return "\n".join(f"{k}: {v}" for k, v in data.items())
-        elif isinstance(data, list):
-            return "\n".join(map(str, data))
-        else:
-            return str(data)
-
-    elif fmt == "csv":
-        if isinstance(data, dict):
-            if "variables" in data and isinstance(data["variables"], dict):
-                df = pd.DataFrame(data["variables"]).T.reset_index()
-            elif all(isinstance(v, (list, tuple)) for v in data.values()):
-                df = pd.DataFrame.from_dict(data, orient='index').reset_index()
-            else:
-                df = pd.DataFrame([data])
-        elif isinstance(data, list):
-            try:
-                # If it's a list of lists with a header
-                df = pd.DataFrame(data[1:], columns=data[0])
-            except Exception:
-                df = pd.DataFrame(data)
-        else:
-            df = pd.DataFrame([data])
-        return df.to_csv(index=False)
-
-    else:
-        raise ValueError(f"Unsupported format: {fmt}")
-
-
-def save_data_formats(endpoint: dict, data: dict, folder: str = "output") -> list:
-    """
-    Save formatted data to disk in multiple formats.
-
-    Args:
-        endpoint (dict): Contains 'name' and 'formats' keys.
-        data (dict or list): Raw data to save.
-        folder (str): Directory where files should be saved.
-
-    Returns:
-        list: List of saved file paths.
-    """
-    formats = endpoint.get("formats", ["json"])
-    name = endpoint.get("name", "data")
-    timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-
-    os.makedirs(folder, exist_ok=True)
-
-    file_paths = []
-
-    for fmt in formats:
-        try:
-            formatted_data = format_data(data, fmt)
-            file_name = f"{name}_{timestamp}.{fmt}"
-            file_path = os.path.join(folder, file_name)
-
-            with open(file_path, "w", encoding="utf-8") as f:
-                f.write(formatted_data)
-
-            logger.info(f"💾 Saved file: {file_path}")
-            file_paths.append(file_path)
-
-        except Exception as e:
-            logger.error(f"❌ Failed to save {fmt} format: {e}")
-
-    return file_paths
+# import pandas as pd
+# import json
+
+# def format_data(data, fmt="json"):
+#     if fmt == "json":
+#         return json.dumps(data, indent=2)
+#     elif fmt == "csv":
+#         if isinstance(data, dict) and "variables" in data:
+#             df = pd.DataFrame(data["variables"]).T.reset_index()
+#             return df.to_csv(index=False)
+#         elif isinstance(data, list):
+#             df = pd.DataFrame(data[1:], columns=data[0])
+#             return df.to_csv(index=False)
+#         else:
+#             df = pd.DataFrame([data])
+#             return df.to_csv(index=False)
+#     elif fmt == "txt":
+#         return json.dumps(data, indent=2)
+#     else:
+#         raise ValueError(f"Unsupported format: {fmt}")
+
+##################### Below code ###########################
+# import os
+# import json
+# import pandas as pd
+# from datetime import datetime
+# from utils.logger import get_logger
+
+# logger = get_logger()
+
+# def format_data(data, fmt="json"):
+#     if fmt == "json":
+#         return json.dumps(data, indent=2)
+#     elif fmt == "csv":
+#         if isinstance(data, dict) and "variables" in data:
+#             df = pd.DataFrame(data["variables"]).T.reset_index()
+#             return df.to_csv(index=False)
+#         elif isinstance(data, list):
+#             df = pd.DataFrame(data[1:], columns=data[0])
+#             return df.to_csv(index=False)
+#         else:
+#             df = pd.DataFrame([data])
+#             return df.to_csv(index=False)
+#     elif fmt == "txt":
+#         return json.dumps(data, indent=2)
+#     else:
+#         raise ValueError(f"Unsupported format: {fmt}")
+
+# def save_data_formats(endpoint: dict, data: dict) -> list:
+#     formats = endpoint.get("formats", ["json"])
+#     name = endpoint.get("name", "data")
+#     timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+#     folder = "output"
+#     os.makedirs(folder, exist_ok=True)
+
+#     file_paths = []
+
+#     for fmt in formats:
+#         formatted_data = format_data(data, fmt)
+#         file_name = f"{name}_{timestamp}.{fmt}"
+#         file_path = os.path.join(folder, file_name)
+
+#         with open(file_path, "w", encoding="utf-8") as f:
+#             f.write(formatted_data)
+
+#         logger.info(f"💾 Saved file: {file_path}")
+#         file_paths.append(file_path)
+
+#     return file_paths
+
+################################### END OF CODE #####################################
+import csv
+import io
+import os
+import json
+from datetime import datetime
+from functools import partial
+from itertools import chain, islice
+
+from utils.columnar import COLUMNAR_FORMATS, ColumnarRowWriter, encode_columnar, infer_schema
+from utils.concurrency import run_concurrently
+from utils.logger import get_logger
+from utils.metrics import record
+from utils.parallel_encode import PARALLEL_FORMATS, encode_parallel, parallel_settings
+from utils.partitioning import DEFAULT_MAX_PARTITIONS, partition_columns, partition_path, route_rows
+from utils.storage_handler import compressed_path, discard_output_file, open_output_file, output_size
+from utils.tabular import Table, normalize_payload
+
+logger = get_logger()
+
+# Rows buffered per write when streaming CSV to a handle.
+CSV_BATCH_ROWS = 10000
+
+# Items (rows, or keys of a dict payload) encoded per write for json/txt.
+JSON_BATCH_ITEMS = 1000
+
+# JSON serializers: the standard library, or orjson (optional, much faster).
+JSON_BACKENDS = ("json", "orjson")
+
+
+def write_csv(header, rows, fh, batch_size=CSV_BATCH_ROWS) -> int:
+    """
+    Write header+rows as CSV straight to a handle, without pandas.
+
+    Rows are rendered into a small buffer and flushed every `batch_size`
+    rows, so memory stays flat however many rows there are. Output matches
+    pd.DataFrame(rows, columns=header).to_csv(index=False): minimal quoting,
+    '\\n' line endings, nulls as empty fields and short rows padded.
+
+    Args:
+        header (list): Column names.
+        rows (iterable): Data rows.
+        fh (file): Writable text handle (file or io.StringIO).
+        batch_size (int): Rows per flush.
+
+    Returns:
+        int: Number of data rows written.
+    """
+    width = len(header)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(header)
+    rows = iter(rows)
+    count = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        if min(map(len, batch)) < width:
+            batch = [row if len(row) >= width else row + [None] * (width - len(row)) for row in batch]
+        writer.writerows(batch)
+        count += len(batch)
+        fh.write(buffer.getvalue())
+        buffer.seek(0)
+        buffer.truncate()
+    fh.write(buffer.getvalue())
+    return count
+
+
+def json_dumps(indent=2, backend="json"):
+    """
+    Return a dumps(obj) -> str function for a JSON backend.
+
+    Args:
+        indent (int): Indentation, as json.dumps; None for compact output
+            without any whitespace.
+        backend (str): 'json' (standard library) or 'orjson'. orjson only
+            indents by 2. Its output is the same for strings, nulls,
+            booleans, integers, plain floats and nesting (so for Census
+            payloads), except that non-ASCII characters are written as
+            UTF-8 instead of \\u escapes. Floats in exponent notation
+            are written without '+' and padding (1e16, not 1e+16), NaN and
+            Infinity become null, and integers beyond 64 bits raise.
+
+    Raises:
+        ValueError: If the backend is unknown or cannot use the indent.
+        ImportError: If the backend is not installed.
+    """
+    if backend == "orjson":
+        try:
+            import orjson
+        except ImportError as e:
+            raise ImportError("orjson is required for the orjson JSON backend (pip install orjson)") from e
+        if indent not in (None, 2):
+            raise ValueError(f"orjson only supports indent 2 or None, not {indent!r}")
+        # non-string keys are written as strings, as json does
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent == 2 else 0)
+        return lambda obj: orjson.dumps(obj, option=option).decode("utf-8")
+    if backend != "json":
+        raise ValueError(f"Unsupported JSON backend: {backend} (expected one of {', '.join(JSON_BACKENDS)})")
+    if indent is None:
+        return partial(json.dumps, separators=(",", ":"))
+    return partial(json.dumps, indent=indent)
+
+
+def write_json(data, fh, indent=2, backend="json", batch_size=JSON_BATCH_ITEMS) -> None:
+    """
+    Write a payload as JSON straight to a handle, `batch_size` items at a time.
+
+    A list or dict payload is serialized in batches of elements/keys, so
+    only one batch's text exists at a time; with the default options the
+    output is byte-identical to json.dumps(data, indent=2).
+
+    Args:
+        data: Payload to serialize.
+        fh (file): Writable text handle.
+        indent (int): See json_dumps (None = compact).
+        backend (str): See json_dumps.
+        batch_size (int): Items serialized per write.
+    """
+    if isinstance(data, dict):
+        writer = JsonRowWriter(fh, indent, backend, batch_size, container=dict)
+        items = data.items()
+    elif isinstance(data, list):
+        writer = JsonRowWriter(fh, indent, backend, batch_size)
+        items = data
+    else:
+        fh.write(json_dumps(indent, backend)(data))
+        return
+    for item in items:
+        writer.write_row(item)
+    writer.close()
+
+
+def write_txt(data, fh, batch_size=JSON_BATCH_ITEMS) -> None:
+    """
+    Write a payload as text lines straight to a handle, `batch_size` lines
+    at a time: str() of each list element, or 'key: value' per dict entry.
+    """
+    if isinstance(data, dict):
+        lines = (f"{k}: {v}" for k, v in data.items())
+    elif isinstance(data, list):
+        lines = map(str, data)
+    else:
+        fh.write(str(data))
+        return
+    separator = ""
+    while True:
+        batch = list(islice(lines, batch_size))
+        if not batch:
+            break
+        fh.write(separator + "\n".join(batch))
+        separator = "\n"
+
+
+def encode_csv(table, fh, batch_size=CSV_BATCH_ROWS):
+    """Encode a normalized Table as CSV into an open text handle."""
+    write_csv(table.columns, table.rows, fh, batch_size=batch_size)
+
+
+def encode_json(table, fh, indent=2, backend="json", batch_size=JSON_BATCH_ITEMS):
+    """Encode the raw payload of a Table as JSON into an open text handle."""
+    write_json(table.source, fh, indent=indent, backend=backend, batch_size=batch_size)
+
+
+def encode_txt(table, fh, batch_size=JSON_BATCH_ITEMS):
+    """Encode the raw payload of a Table as text lines into an open text handle."""
+    write_txt(table.source, fh, batch_size=batch_size)
+
+
+# Format encoders reading from the shared Table representation.
+ENCODERS = {
+    "csv": encode_csv,
+    "json": encode_json,
+    "txt": encode_txt,
+    "parquet": encode_columnar("parquet"),
+    "arrow": encode_columnar("arrow"),
+}
+
+# Formats that need the payload normalized into a Table.
+TABULAR_FORMATS = {"csv"} | COLUMNAR_FORMATS
+
+# Formats written to binary handles.
+BINARY_FORMATS = COLUMNAR_FORMATS
+
+# Rows written to a partition file between checks of its size cap.
+PARTITION_CHECK_ROWS = 1000
+
+
+def _format_suffix(fmt, compression):
+    """
+    File name suffix of a format. Columnar formats are compressed
+    internally by their own codec, so file-level compression skips them.
+    """
+    if fmt in BINARY_FORMATS:
+        return f".{fmt}"
+    return compressed_path(f".{fmt}", compression)
+
+
+def _output_path(folder, name, timestamp, fmt, compression):
+    """Build the output path for a format."""
+    return os.path.join(folder, f"{name}_{timestamp}{_format_suffix(fmt, compression)}")
+
+
+def group_outputs(endpoint: dict, formats, file_paths) -> dict:
+    """
+    Group the paths returned by save_data_formats by format.
+
+    Returns:
+        dict: fmt -> list of its output paths (several for partitioned
+        output), for every format in `formats` that has any.
+    """
+    suffixes = {fmt: _format_suffix(fmt, endpoint.get("compression")) for fmt in formats}
+    grouped = {}
+    for file_path in file_paths:
+        for fmt, suffix in suffixes.items():
+            if file_path.endswith(suffix):
+                grouped.setdefault(fmt, []).append(file_path)
+                break
+    return grouped
+
+
+def _open_output(file_path, fmt, compression=None, upload=None, keep_local=True):
+    """
+    Open an output in the mode the format's encoder expects, teeing the
+    bytes into `upload(file_path)` (a binary stream) when given.
+    """
+    tee = upload(file_path) if upload is not None else None
+    if fmt in BINARY_FORMATS:
+        return open_output_file(file_path, binary=True, tee=tee, local=keep_local)
+    return open_output_file(file_path, compression=compression, tee=tee, local=keep_local)
+
+
+def _close_output(file_path, fh, keep_local):
+    """Close (and so finalize) an output; a failure discards what is left of it."""
+    try:
+        fh.close()
+    except Exception:
+        discard_output_file(file_path, fh)
+        raise
+    if keep_local:
+        logger.info("💾 Saved file: %s", file_path)
+
+
+def _parallel_input(fmt, table, options):
+    """Header and rows a format can be encoded from in parallel, or None."""
+    if fmt == "csv":
+        return table.columns, table.rows
+    if fmt == "json" and options.get("backend", "json") != "json":
+        return None  # workers serialize with the standard library
+    if fmt in PARALLEL_FORMATS and isinstance(table.source, list):
+        return None, table.source  # json/txt serialize the payload's elements
+    return None
+
+
+def format_options(endpoint: dict, fmt: str) -> dict:
+    """
+    Per-format encoder options from the endpoint config, e.g.:
+
+        format_options:
+          parquet: {compression: zstd, row_group_size: 65536}
+
+    Returns:
+        dict: Keyword arguments for the format's encoder/row writer.
+    """
+    return dict((endpoint.get("format_options") or {}).get(fmt) or {})
+
+
+def format_data(data, fmt="json"):
+    """
+    Format data into the specified format.
+
+    Args:
+        data (dict or list): Raw data to format.
+        fmt (str): Format type ("json", "csv", "txt").
+
+    Returns:
+        str: Formatted string.
+
+    Raises:
+        ValueError: If format is unsupported.
+    """
+    if not isinstance(data, (dict, list)):
+        raise TypeError("Data must be a dict or list.")
+
+    if fmt == "json":
+        buffer = io.StringIO()
+        write_json(data, buffer)
+        return buffer.getvalue()
+
+    elif fmt == "txt":
+        # Text format - simplified version of the JSON dump, or line-based string.
+        buffer = io.StringIO()
+        write_txt(data, buffer)
+        return buffer.getvalue()
+
+    elif fmt == "csv":
+        buffer = io.StringIO()
+        encode_csv(normalize_payload(data), buffer)
+        return buffer.getvalue()
+
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+class CsvRowWriter:
+    """
+    Incrementally writes header+rows as CSV (same bytes as pandas' to_csv).
+
+    `batch_size` is accepted for parity with encode_csv's options; rows are
+    handed to the csv module as they arrive.
+    """
+
+    def __init__(self, fh, batch_size=None):
+        self._writer = csv.writer(fh, lineterminator="\n")
+        self._width = None
+
+    def write_row(self, row):
+        if self._width is None:
+            self._width = len(row)
+        elif len(row) < self._width:
+            row = row + [None] * (self._width - len(row))
+        self._writer.writerow(row)
+
+    def close(self):
+        if self._width is None:
+            self._writer.writerow([])  # pandas writes an empty header line for no data
+
+
+class JsonRowWriter:
+    """
+    Incrementally writes rows as a JSON array, matching json.dumps(rows, indent=2)
+    (or the given indent/backend, see json_dumps).
+
+    Rows are serialized `batch_size` at a time and each batch's elements
+    are spliced into the array, so the bytes are the same as one dumps of
+    the whole array. With container=dict, rows are (key, value) pairs of
+    a JSON object instead.
+    """
+
+    def __init__(self, fh, indent=2, backend="json", batch_size=JSON_BATCH_ITEMS, container=list):
+        self._fh = fh
+        self._dumps = json_dumps(indent, backend)
+        self._container = container
+        self._batch_size = batch_size
+        self._batch = []
+        # dumps(batch) is opening + elements + closing; compact output has
+        # 1-character brackets, indented output a bracket plus a newline
+        self._cut = 1 if indent is None else 2
+        self._separator = "," if indent is None else ",\n"
+        self._closing = None
+
+    def write_row(self, row):
+        self._batch.append(row)
+        if len(self._batch) >= self._batch_size:
+            self._flush()
+
+    def _flush(self):
+        text = self._dumps(self._container(self._batch))
+        self._batch = []
+        cut = self._cut
+        self._fh.write(text[:-cut] if self._closing is None else self._separator + text[cut:-cut])
+        self._closing = text[-cut:]
+
+    def close(self):
+        if self._batch:
+            self._flush()
+        self._fh.write(self._closing if self._closing is not None else self._dumps(self._container()))
+
+
+class TxtRowWriter:
+    """
+    Incrementally writes one str(row) per line, matching the txt format.
+
+    `batch_size` is accepted for parity with encode_txt's options.
+    """
+
+    def __init__(self, fh, batch_size=None):
+        self._fh = fh
+        self._count = 0
+
+    def write_row(self, row):
+        self._fh.write(("\n" if self._count else "") + str(row))
+        self._count += 1
+
+    def close(self):
+        pass
+
+
+ROW_WRITERS = {
+    "csv": CsvRowWriter,
+    "json": JsonRowWriter,
+    "txt": TxtRowWriter,
+    "parquet": partial(ColumnarRowWriter, fmt="parquet"),
+    "arrow": partial(ColumnarRowWriter, fmt="arrow"),
+}
+
+
+def write_rows(rows, fmt, fh, **options):
+    """
+    Stream header+rows into an open handle in the given format.
+
+    Args:
+        rows (iterable): Header row followed by data rows.
+        fmt (str): Format type ("json", "csv", "txt", "parquet", "arrow").
+        fh (file): Writable handle (binary for parquet/arrow, text otherwise).
+        **options: Format options passed to the row writer.
+
+    Raises:
+        ValueError: If format is unsupported for row streaming.
+    """
+    if fmt not in ROW_WRITERS:
+        raise ValueError(f"Unsupported streaming format: {fmt}")
+    writer = ROW_WRITERS[fmt](fh, **options)
+    for row in rows:
+        writer.write_row(row)
+    writer.close()
+
+
+def _save_streamed_rows(rows, endpoint, formats, name, timestamp, folder, upload=None,
+                        keep_local=True) -> list:
+    """
+    Fan a single pass over a row iterator out to one writer per format.
+
+    A format whose writer fails is dropped (its partial file removed, its
+    upload abandoned) without interrupting the others; a failure of the
+    row source itself is raised.
+    """
+    compression = endpoint.get("compression")
+    open_files = {}
+    writers = {}
+
+    def _drop(fmt, error):
+        file_path, fh = open_files.pop(fmt)
+        writers.pop(fmt, None)
+        discard_output_file(file_path, fh)
+        logger.error("❌ Failed to save %s format: %s", fmt, error)
+
+    for fmt in formats:
+        if fmt not in ROW_WRITERS:
+            logger.error("❌ Failed to save %s format: unsupported for streamed data", fmt)
+            continue
+        file_path = _output_path(folder, name, timestamp, fmt, compression)
+        try:
+            fh = _open_output(file_path, fmt, compression, upload, keep_local)
+        except Exception as e:
+            logger.error("❌ Failed to save %s format: %s", fmt, e)
+            continue
+        open_files[fmt] = (file_path, fh)
+        try:
+            writers[fmt] = ROW_WRITERS[fmt](fh, **format_options(endpoint, fmt))
+        except Exception as e:
+            _drop(fmt, e)
+
+    count = 0
+    try:
+        for row in rows:
+            count += 1
+            for fmt, writer in list(writers.items()):
+                try:
+                    writer.write_row(row)
+                except Exception as e:
+                    _drop(fmt, e)
+        for fmt, writer in list(writers.items()):
+            try:
+                writer.close()
+            except Exception as e:
+                _drop(fmt, e)
+    except Exception:
+        for fmt in list(open_files):
+            file_path, fh = open_files.pop(fmt)
+            discard_output_file(file_path, fh)
+        raise
+
+    record(rows=max(count - 1, 0))  # header excluded
+    file_paths = []
+    for fmt, (file_path, fh) in open_files.items():
+        try:
+            _close_output(file_path, fh, keep_local)
+        except Exception as e:
+            logger.error("❌ Failed to save %s format: %s", fmt, e)
+            continue
+        file_paths.append(file_path)
+    return file_paths
+
+
+def _write_partition_files(rows, header, directory, name, timestamp, fmt, endpoint, max_bytes) -> list:
+    """
+    Write one partition's rows in one format, starting a new numbered file
+    (-00000, -00001, ...) whenever the current one has reached max_bytes.
+    The cap is checked every PARTITION_CHECK_ROWS rows against the bytes
+    encoded so far, so parquet/arrow files can overshoot it by up to a
+    row group; their column types are inferred over the whole partition,
+    so every file of it has the same schema. On failure nothing of the
+    partition is left behind.
+    """
+    compression = endpoint.get("compression")
+    options = format_options(endpoint, fmt)
+    if fmt in COLUMNAR_FORMATS:
+        options = dict(options, schema=infer_schema(header, rows))
+    os.makedirs(directory, exist_ok=True)
+    file_paths = []
+    fh = None
+    try:
+        for start in range(0, len(rows), PARTITION_CHECK_ROWS):
+            if fh is None:
+                file_path = _output_path(directory, name, f"{timestamp}-{len(file_paths):05d}", fmt, compression)
+                fh = _open_output(file_path, fmt, compression)
+                file_paths.append(file_path)
+                writer = ROW_WRITERS[fmt](fh, **options)
+                writer.write_row(header)
+            for row in rows[start:start + PARTITION_CHECK_ROWS]:
+                writer.write_row(row)
+            if (max_bytes and start + PARTITION_CHECK_ROWS < len(rows)
+                    and output_size(file_path, fh) >= max_bytes):
+                writer.close()
+                current, fh = fh, None
+                _close_output(file_path, current, True)
+        writer.close()
+        current, fh = fh, None
+        _close_output(file_path, current, True)
+    except Exception:
+        if fh is not None:
+            discard_output_file(file_paths[-1], fh)
+        for file_path in file_paths:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        raise
+    return file_paths
+
+
+def _save_partitioned(rows, endpoint, formats, name, timestamp, folder) -> list:
+    """
+    Write header+rows as Hive-style partitions: one directory per distinct
+    value of the partition_by columns (e.g. state=01/YEAR=2020/), holding
+    that partition's rows in every format.
+
+    Rows are routed to their partition in a single pass, then every
+    partition x format is written concurrently (partition_options.workers)
+    with the row writers also used for streamed data, rolling over to a new
+    file at partition_options.max_bytes. A format that fails in any
+    partition is dropped everywhere, like a failed unpartitioned format.
+    """
+    columns = partition_columns(endpoint.get("partition_by"))
+    settings = endpoint.get("partition_options") or {}
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return []
+    partitions = route_rows(header, rows, columns, settings.get("max_partitions", DEFAULT_MAX_PARTITIONS))
+    record(rows=sum(map(len, partitions.values())))
+
+    supported = []
+    for fmt in formats:
+        if fmt in ROW_WRITERS:
+            supported.append(fmt)
+        else:
+            logger.error("❌ Failed to save %s format: unsupported for partitioned output", fmt)
+
+    def _write(task):
+        key, fmt = task
+        directory = os.path.join(folder, *partition_path(columns, key).split("/"))
+        return _write_partition_files(partitions[key], header, directory, name, timestamp, fmt,
+                                      endpoint, settings.get("max_bytes"))
+
+    outcomes = run_concurrently(
+        _write, [(key, fmt) for key in partitions for fmt in supported],
+        max_workers=settings.get("workers", 4),
+    )
+
+    written = {fmt: [] for fmt in supported}
+    failed = {}
+    for (_, fmt), file_paths, error in outcomes:
+        if error is not None:
+            failed.setdefault(fmt, error)
+        else:
+            written[fmt].extend(file_paths)
+    file_paths = []
+    for fmt in supported:
+        if fmt in failed:
+            for file_path in written[fmt]:
+                os.remove(file_path)
+            logger.error("❌ Failed to save %s format: %s", fmt, failed[fmt])
+        else:
+            file_paths.extend(written[fmt])
+    logger.info("🗂️ Wrote %d partition(s) of %s by %s", len(partitions), name, ", ".join(columns))
+    return file_paths
+
+
+def save_data_formats(endpoint: dict, data, folder: str = "output", upload=None,
+                      keep_local: bool = True, timestamp: str = None) -> list:
+    """
+    Save formatted data to disk (and/or stream it to an upload) in multiple formats.
+
+    Args:
+        endpoint (dict): Contains 'name' and 'output_formats' ('formats' is
+            still accepted as the legacy spelling) keys, and optionally
+            'compression' ('gzip' or 'zstd') to compress text formats while
+            they are written (files get a .gz/.zst suffix), 'flatten'
+            to shape the rows of a variables payload (see
+            utils.tabular.flatten_records) and 'partition_by' to write
+            Hive-style partition directories (col=value/...) under the
+            folder, each holding files named like
+            {name}_{timestamp}-00000.{fmt} ('partition_options': workers,
+            max_bytes per file, max_partitions).
+        data (dict, list or iterator): Raw data to save. A dict/list payload
+            is normalized into a Table once and every format is encoded from
+            it concurrently (csv/json/txt of very large payloads across a
+            process pool when the endpoint has a 'parallel_encode' section;
+            see utils.parallel_encode). An iterator of rows (header first, e.g. from
+            fetch_api_rows) is consumed once and written to every format as
+            it streams, never materialized.
+        folder (str): Directory where files should be saved.
+        upload (callable): Optional factory mapping an output path to a
+            writable binary stream (e.g. a GCS upload). Every encoded byte
+            is written to it as it is produced; closing the output
+            finalizes it, a failed format abandons it.
+        keep_local (bool): Also write the local file. With False (requires
+            `upload`) nothing touches disk and only bounded buffers exist.
+        timestamp (str): Timestamp the file names carry (default: now, UTC),
+            e.g. to rewrite the same outputs when resuming a run.
+
+    Returns:
+        list: Output file paths (with keep_local=False these only name the
+        outputs, e.g. for the upload's object name).
+    """
+    formats = endpoint.get("output_formats") or endpoint.get("formats") or ["json"]
+    name = endpoint.get("name", "data")
+    compression = endpoint.get("compression")
+    timestamp = timestamp or datetime.utcnow().strftime("%Y%m%d%H%M%S")
+
+    if keep_local:
+        os.makedirs(folder, exist_ok=True)
+
+    if endpoint.get("partition_by"):
+        if upload is not None or not keep_local:
+            raise ValueError("Partitioned output is written locally; it cannot be streamed to an upload")
+        if isinstance(data, (dict, list)):
+            table = normalize_payload(data, endpoint.get("flatten"))
+            data = chain([table.columns], table.rows)
+        return _save_partitioned(data, endpoint, formats, name, timestamp, folder)
+
+    if not isinstance(data, (dict, list)):
+        return _save_streamed_rows(data, endpoint, formats, name, timestamp, folder, upload, keep_local)
+
+    # Parse once: normalize the payload a single time for all tabular formats
+    if any(fmt in TABULAR_FORMATS for fmt in formats):
+        table = normalize_payload(data, endpoint.get("flatten"))
+        record(rows=len(table))
+    else:
+        table = Table([], [], data)
+
+    # Very large payloads can be encoded across a process pool instead
+    parallel = parallel_settings(endpoint.get("parallel_encode"))
+
+    def _encode(fmt):
+        if fmt not in ENCODERS:
+            raise ValueError(f"Unsupported format: {fmt}")
+        file_path = _output_path(folder, name, timestamp, fmt, compression)
+        options = format_options(endpoint, fmt)
+        parallel_input = _parallel_input(fmt, table, options) if parallel else None
+        fh = _open_output(file_path, fmt, compression, upload, keep_local)
+        try:
+            if parallel_input is not None and len(parallel_input[1]) >= parallel[1]:
+                processes, _, chunk_rows = parallel
+                logger.info("⚙️ Encoding %s as %s across %d processes", name, fmt, processes)
+                encode_parallel(fmt, *parallel_input, fh, processes, chunk_rows,
+                                indent=options.get("indent", 2))
+            else:
+                ENCODERS[fmt](table, fh, **options)
+        except Exception:
+            discard_output_file(file_path, fh)
+            raise
+        _close_output(file_path, fh, keep_local)
+        return file_path
+
+    # Emit many: independent formats are encoded concurrently
+    outcomes = run_concurrently(
+        _encode, formats, max_workers=endpoint.get("format_workers", len(formats))
+    )
+
+    file_paths = []
+    for fmt, file_path, error in outcomes:
+        if error is not None:
+            logger.error("❌ Failed to save %s format: %s", fmt, error)
+        else:
+            file_paths.append(file_path)
+
+    return file_paths
@@ -0,0 +1,231 @@
+import gzip
+import hashlib
+import json
+import os
+
+from utils.logger import get_logger
+from utils.storage_handler import write_file_atomically
+
+logger = get_logger()
+
+# Column prepended to delta output: insert | update | delete.
+OP_COLUMN = "_op"
+
+# Version of the persisted index layout; an index of another version is
+# discarded, so the next run emits a full snapshot and rebuilds it.
+INDEX_VERSION = 2
+
+
+def row_hash(row) -> str:
+    """Compact (64-bit) content hash of a row."""
+    return hashlib.blake2b(repr(row).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def row_key(row, positions) -> str:
+    """Index key of a row: its key values as compact JSON (types preserved)."""
+    return json.dumps([row[i] for i in positions], separators=(",", ":"), default=str)
+
+
+class LocalIndexStore:
+    """Delta indexes as <state_dir>/<name>.delta.json.gz files."""
+
+    def __init__(self, state_dir):
+        self.dir = state_dir
+
+    def location(self, name) -> str:
+        return os.path.join(self.dir, f"{name}.delta.json.gz")
+
+    def read(self, name):
+        try:
+            with open(self.location(name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, name, data) -> bool:
+        os.makedirs(self.dir, exist_ok=True)
+        write_file_atomically(self.location(name), lambda f: f.write(data))
+        return True
+
+
+class GCSIndexStore:
+    """
+    Delta indexes as gs://<bucket>/<prefix>/_delta/<name>.delta.json.gz,
+    next to the run manifests, so they outlive the instance (e.g. a Cloud
+    Function's /tmp).
+
+    An index is only written over the generation it was read at, so of two
+    instances running the same endpoint at once only the first commits.
+    """
+
+    def __init__(self, bucket, prefix, create_bucket=False):
+        self.bucket = bucket
+        self.prefix = f"{prefix.strip('/')}/_delta"
+        self.create_bucket = create_bucket
+        self._generations = {}  # name -> generation last read/written
+
+    def location(self, name) -> str:
+        return f"gs://{self.bucket}/{self.prefix}/{name}.delta.json.gz"
+
+    def read(self, name):
+        # google-cloud-storage is only imported by runs that use it
+        from utils.gcs_handler import read_bytes_from_gcs
+        data, self._generations[name] = read_bytes_from_gcs(self.bucket, f"{self.prefix}/{name}.delta.json.gz")
+        return data
+
+    def write(self, name, data) -> bool:
+        """Store an index; False if another instance stored one since it was read."""
+        from google.api_core.exceptions import PreconditionFailed
+        from utils.gcs_handler import write_text_to_gcs
+
+        try:
+            self._generations[name] = write_text_to_gcs(
+                self.bucket, f"{self.prefix}/{name}.delta.json.gz", data,
+                create_bucket=self.create_bucket, content_type="application/gzip",
+                if_generation_match=self._generations.get(name, 0),
+            )
+        except PreconditionFailed:
+            return False
+        return True
+
+
+def index_store(defaults, state_dir):
+    """
+    Where delta indexes are kept: in GCS next to the run manifests when
+    defaults.manifest.store is 'gcs', else under the local state_dir.
+    """
+    if (defaults.get("manifest") or {}).get("store") == "gcs":
+        return GCSIndexStore(defaults["bucket"], defaults["gcs_path_prefix"],
+                             defaults.get("create_bucket_if_missing", False))
+    return LocalIndexStore(state_dir)
+
+
+class DeltaTracker:
+    """
+    Turns a full snapshot into inserted/updated/deleted rows for one endpoint.
+
+    A compact index of row key -> row hash is persisted per endpoint. Each
+    run compares the incoming rows against it and emits only the changes,
+    prefixed with an '_op' column. Deleted rows carry their key columns
+    only (with their original values) and follow the order of the stored
+    index, so the output is deterministic. Every `compact_every` runs (and whenever no index exists yet) the
+    full snapshot is emitted instead, so consumers can re-base.
+
+    The new index is only persisted by commit(), which callers invoke once
+    the output was saved (and uploaded) successfully.
+
+    Args:
+        name (str): Endpoint name (index file name).
+        key_columns (list): Columns identifying a row, e.g. ['state', 'county', 'YEAR'].
+        store (LocalIndexStore or GCSIndexStore): Where the index is kept
+            (see index_store).
+        compact_every (int): Emit a full snapshot every N runs (0 = never).
+    """
+
+    def __init__(self, name, key_columns, store, compact_every=24):
+        if not key_columns:
+            raise ValueError(f"delta.key_columns is required for endpoint '{name}'")
+        self.name = name
+        self.key_columns = list(key_columns)
+        self.compact_every = int(compact_every or 0)
+        self.store = store
+        self.full = False
+        self.counts = {"insert": 0, "update": 0, "delete": 0}
+        self._previous = self._load()
+        self._run_count = self._previous.get("run_count", 0) + 1
+        self._next_index = None
+
+    def _load(self) -> dict:
+        data = self.store.read(self.name)
+        if data is None:
+            return {}
+        try:
+            previous = json.loads(gzip.decompress(data))
+        except (OSError, EOFError, ValueError) as e:
+            logger.warning("⚠️ Ignoring unreadable delta index %s: %s", self.store.location(self.name), e)
+            return {}
+        if previous.get("version") != INDEX_VERSION:
+            logger.info("🧱 %s: delta index has an older layout; rebuilding it", self.name)
+            return {"run_count": previous.get("run_count", 0)}
+        return previous
+
+    @property
+    def changes(self) -> int:
+        """Number of changed rows emitted (meaningful after iteration)."""
+        return sum(self.counts.values())
+
+    def apply(self, rows):
+        """
+        Compare a header+rows stream against the stored index.
+
+        Args:
+            rows (iterable): Header row followed by data rows.
+
+        Yields:
+            list: Output header, then output rows. In delta mode the header
+            is ['_op', *columns]; in full mode rows pass through unchanged.
+        """
+        rows = iter(rows)
+        header = next(rows, None)
+        if header is None:
+            return
+        missing = [c for c in self.key_columns if c not in header]
+        if missing:
+            raise ValueError(f"Delta key columns not in response for '{self.name}': {missing}")
+        key_positions = [header.index(c) for c in self.key_columns]
+
+        previous_rows = self._previous.get("rows", {})
+        self.full = bool(
+            not previous_rows
+            or self._previous.get("columns") != list(header)
+            or (self.compact_every and self._run_count % self.compact_every == 0)
+        )
+
+        index = {}
+        if self.full:
+            logger.info("🧱 %s: emitting full snapshot (compaction)", self.name)
+            yield header
+            for row in rows:
+                index[row_key(row, key_positions)] = row_hash(row)
+                yield row
+        else:
+            yield [OP_COLUMN] + list(header)
+            for row in rows:
+                key = row_key(row, key_positions)
+                digest = row_hash(row)
+                index[key] = digest
+                old = previous_rows.get(key)
+                if old is None:
+                    self.counts["insert"] += 1
+                    yield ["insert"] + list(row)
+                elif old != digest:
+                    self.counts["update"] += 1
+                    yield ["update"] + list(row)
+            for key in previous_rows:
+                if key in index:
+                    continue
+                self.counts["delete"] += 1
+                deleted = [None] * len(header)
+                for position, value in zip(key_positions, json.loads(key)):
+                    deleted[position] = value
+                yield ["delete"] + deleted
+            logger.info("🔀 %s: delta %s", self.name, self.counts)
+
+        self._next_index = {"version": INDEX_VERSION, "columns": list(header),
+                            "run_count": self._run_count, "rows": index}
+
+    def commit(self):
+        """
+        Persist the index built by the last apply(). If another instance
+        committed an index since this one was loaded, theirs is kept: the
+        next run then compares against it, so no change goes unreported
+        (some may be reported twice).
+        """
+        if self._next_index is None:
+            return
+        data = gzip.compress(json.dumps(self._next_index, separators=(",", ":")).encode("utf-8"), mtime=0)
+        if self.store.write(self.name, data):
+            self._previous = self._next_index
+        else:
+            logger.warning("⚠️ %s: delta index was updated by another instance; keeping theirs", self.name)
+        self._next_index = None
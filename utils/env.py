@@ -0,0 +1,18 @@
+import os
+
+# Set by the Cloud Functions runtimes: K_SERVICE and FUNCTION_TARGET on 2nd
+# gen (Cloud Run based), FUNCTION_NAME on 1st gen.
+_GCF_VARIABLES = ("K_SERVICE", "FUNCTION_TARGET", "FUNCTION_NAME")
+
+
+def is_running_in_gcf() -> bool:
+    """
+    Detect if the code is running inside Google Cloud Functions.
+
+    Reads the environment only, so any module (including the logger) can
+    use it without import cycles.
+
+    Returns:
+        bool: True if running inside GCF, False otherwise.
+    """
+    return any(name in os.environ for name in _GCF_VARIABLES)
@@ -1,81 +1,434 @@
-from google.cloud import storage
-from google.cloud.exceptions import NotFound, GoogleCloudError
-from utils.logger import get_logger
-import os
-
-logger = get_logger()
-
-def get_or_create_bucket(client, bucket_name, create_if_missing=False):
-    """
-    Retrieves a GCS bucket. Creates it if it doesn't exist and create_if_missing is True.
-
-    Args:
-        client (google.cloud.storage.Client): GCS client instance.
-        bucket_name (str): Name of the bucket.
-        create_if_missing (bool): Whether to create the bucket if it doesn't exist.
-
-    Returns:
-        google.cloud.storage.Bucket: The bucket object.
-
-    Raises:
-        FileNotFoundError: If bucket doesn't exist and create_if_missing is False.
-        GoogleCloudError: If bucket creation fails.
-    """
-    try:
-        bucket = client.get_bucket(bucket_name)
-        logger.info(f"✅ Found bucket: {bucket_name}")
-    except NotFound:
-        if create_if_missing:
-            try:
-                bucket = client.create_bucket(bucket_name)
-                logger.info(f"🪣 Created bucket: {bucket_name}")
-            except GoogleCloudError as e:
-                logger.error(f"❌ Failed to create bucket '{bucket_name}': {e}")
-                raise
-        else:
-            raise FileNotFoundError(f"Bucket '{bucket_name}' does not exist.")
-    return bucket
-
-def upload_file_to_bucket(bucket, source_file, destination_blob):
-    """
-    Uploads a local file to a GCS bucket if it doesn't already exist.
-
-    Args:
-        bucket (google.cloud.storage.Bucket): Target GCS bucket.
-        source_file (str): Path to the local file.
-        destination_blob (str): Destination path in the bucket.
-
-    Returns:
-        None
-    """
-    blob = bucket.blob(destination_blob)
-    if blob.exists(bucket.client):  # Correct way to check existence
-        logger.info(f"⚠️ File already exists in GCS: {destination_blob}")
-    else:
-        try:
-            blob.upload_from_filename(source_file)
-            logger.info(f"☁️ Uploaded to GCS: gs://{bucket.name}/{destination_blob}")
-        except Exception as e:
-            logger.error(f"❌ Failed to upload file '{source_file}' to GCS: {e}")
-            raise
-
-def upload_to_gcs(bucket_name, source_file, destination_blob, create_bucket=False):
-    """
-    High-level function to upload a file to GCS, with optional bucket creation.
-
-    Args:
-        bucket_name (str): Name of the GCS bucket.
-        source_file (str): Path to the local file.
-        destination_blob (str): Destination path in the bucket.
-        create_bucket (bool): Whether to create the bucket if it doesn't exist.
-
-    Returns:
-        None
-    """
-    try:
-        client = storage.Client()
-        bucket = get_or_create_bucket(client, bucket_name, create_if_missing=create_bucket)
-        upload_file_to_bucket(bucket, source_file, destination_blob)
-    except Exception as e:
-        logger.error(f"🚨 Upload to GCS failed: {e}")
-        raise
\ No newline at end of file
+from google.api_core.exceptions import PreconditionFailed
+from google.cloud import storage
+from google.cloud.exceptions import NotFound, GoogleCloudError
+from utils.concurrency import run_concurrently
+from utils.logger import get_logger
+from utils.metrics import record
+from utils.storage_handler import content_headers, file_checksums, forget_checksums
+import io
+import os
+import threading
+
+logger = get_logger()
+
+_client = None
+_buckets = {}
+_cache_lock = threading.Lock()
+
+
+def set_client(client):
+    """
+    Replace the process-wide GCS client, e.g. with an in-process fake for
+    offline runs. Clears the bucket cache.
+
+    Args:
+        client: A google.cloud.storage.Client or compatible object.
+    """
+    global _client
+    with _cache_lock:
+        _client = client
+        _buckets.clear()
+
+
+def get_client():
+    """
+    Return the per-process GCS client, creating it on first use.
+
+    When STORAGE_EMULATOR_HOST is set (e.g. fake-gcs-server), an anonymous
+    client pointed at the emulator is created instead.
+
+    Returns:
+        google.cloud.storage.Client: Shared client.
+    """
+    global _client
+    with _cache_lock:
+        if _client is None:
+            if os.environ.get("STORAGE_EMULATOR_HOST"):
+                from google.auth.credentials import AnonymousCredentials
+
+                _client = storage.Client(
+                    project=os.environ.get("GOOGLE_CLOUD_PROJECT", "local"),
+                    credentials=AnonymousCredentials(),
+                )
+            else:
+                _client = storage.Client()
+        return _client
+
+
+def get_bucket(bucket_name, create_if_missing=False):
+    """
+    Return a cached bucket handle, looking it up (and optionally creating it)
+    only the first time it is requested in this process.
+
+    Args:
+        bucket_name (str): Name of the bucket.
+        create_if_missing (bool): Whether to create the bucket if it doesn't exist.
+
+    Returns:
+        google.cloud.storage.Bucket: The bucket object.
+    """
+    client = get_client()
+    with _cache_lock:
+        bucket = _buckets.get(bucket_name)
+    if bucket is None:
+        bucket = get_or_create_bucket(client, bucket_name, create_if_missing=create_if_missing)
+        with _cache_lock:
+            bucket = _buckets.setdefault(bucket_name, bucket)
+    return bucket
+
+
+def get_or_create_bucket(client, bucket_name, create_if_missing=False):
+    """
+    Retrieves a GCS bucket. Creates it if it doesn't exist and create_if_missing is True.
+
+    Args:
+        client (google.cloud.storage.Client): GCS client instance.
+        bucket_name (str): Name of the bucket.
+        create_if_missing (bool): Whether to create the bucket if it doesn't exist.
+
+    Returns:
+        google.cloud.storage.Bucket: The bucket object.
+
+    Raises:
+        FileNotFoundError: If bucket doesn't exist and create_if_missing is False.
+        GoogleCloudError: If bucket creation fails.
+    """
+    try:
+        bucket = client.get_bucket(bucket_name)
+        logger.info("✅ Found bucket: %s", bucket_name)
+    except NotFound:
+        if create_if_missing:
+            try:
+                bucket = client.create_bucket(bucket_name)
+                logger.info("🪣 Created bucket: %s", bucket_name)
+            except GoogleCloudError as e:
+                logger.error("❌ Failed to create bucket '%s': %s", bucket_name, e)
+                raise
+        else:
+            raise FileNotFoundError(f"Bucket '{bucket_name}' does not exist.")
+    return bucket
+
+def upload_file_to_bucket(bucket, source_file, destination_blob, chunk_size=None,
+                          composite_threshold=None, composite_workers=8):
+    """
+    Uploads a local file to a GCS bucket if it doesn't already exist.
+
+    Existence is enforced server-side with an if_generation_match=0
+    precondition instead of a separate blob.exists() round trip. Composite
+    uploads (XML multipart) take no preconditions, so for those the object
+    is looked up first; a concurrent writer can still slip in between.
+
+    Content-Type is derived from the file extension; compressed files
+    (.gz/.zst) keep their underlying type and get a matching
+    Content-Encoding, so gzip objects are transparently decompressed by GCS
+    for clients that do not accept gzip.
+
+    Args:
+        bucket (google.cloud.storage.Bucket): Target GCS bucket.
+        source_file (str): Path to the local file.
+        destination_blob (str): Destination path in the bucket.
+        chunk_size (int): Resumable upload chunk size in bytes (multiple of
+            256 KiB); None uploads in a single request where possible.
+        composite_threshold (int): Files at least this large are uploaded as
+            concurrent chunks (XML multipart upload); None disables it.
+        composite_workers (int): Threads used for a chunked composite upload.
+
+    Returns:
+        None
+    """
+    blob = bucket.blob(destination_blob, chunk_size=chunk_size)
+    try:
+        content_type, content_encoding = content_headers(source_file)
+        blob.content_encoding = content_encoding
+        if composite_threshold and os.path.getsize(source_file) >= composite_threshold:
+            from google.cloud.storage import transfer_manager
+
+            if blob.exists():
+                raise PreconditionFailed(f"{destination_blob} already exists")
+            blob.content_type = content_type
+            transfer_manager.upload_chunks_concurrently(
+                source_file,
+                blob,
+                content_type=content_type,
+                chunk_size=chunk_size or 32 * 1024 * 1024,
+                worker_type=transfer_manager.THREAD,
+                max_workers=composite_workers,
+            )
+        else:
+            blob.upload_from_filename(source_file, content_type=content_type, if_generation_match=0)
+        logger.info("☁️ Uploaded to GCS: gs://%s/%s", bucket.name, destination_blob)
+        record(stage="upload", bytes_out=os.path.getsize(source_file))
+    except PreconditionFailed:
+        logger.info("⚠️ File already exists in GCS: %s", destination_blob)
+        record(stage="upload", cache_hits=1)
+    except Exception as e:
+        logger.error("❌ Failed to upload file '%s' to GCS: %s", source_file, e)
+        raise
+    finally:
+        forget_checksums(source_file)
+
+
+def build_content_index(bucket, prefix) -> dict:
+    """
+    List the objects under a prefix once and index them by content hash.
+
+    Args:
+        bucket (google.cloud.storage.Bucket): Bucket to list.
+        prefix (str): Object name prefix, e.g. 'api-data/prod/live_data/'.
+
+    Returns:
+        dict: {'md5': {hash: name}, 'crc32c': {hash: name}}. Composite
+        objects only carry crc32c, so both are indexed.
+    """
+    index = {"md5": {}, "crc32c": {}}
+    for blob in bucket.client.list_blobs(bucket, prefix=prefix):
+        if blob.md5_hash:
+            index["md5"].setdefault(blob.md5_hash, blob.name)
+        if blob.crc32c:
+            index["crc32c"].setdefault(blob.crc32c, blob.name)
+    logger.info("🗂️ Indexed %d object(s) under gs://%s/%s", len(index["crc32c"] or index["md5"]), bucket.name, prefix)
+    return index
+
+
+def _find_duplicate(index, checksums):
+    """Name of an indexed object with the same content, if any."""
+    for kind in ("md5", "crc32c"):
+        if checksums.get(kind) and checksums[kind] in index[kind]:
+            return index[kind][checksums[kind]]
+    return None
+
+def upload_to_gcs(bucket_name, source_file, destination_blob, create_bucket=False):
+    """
+    High-level function to upload a file to GCS, with optional bucket creation.
+
+    Args:
+        bucket_name (str): Name of the GCS bucket.
+        source_file (str): Path to the local file.
+        destination_blob (str): Destination path in the bucket.
+        create_bucket (bool): Whether to create the bucket if it doesn't exist.
+
+    Returns:
+        None
+    """
+    try:
+        bucket = get_bucket(bucket_name, create_if_missing=create_bucket)
+        upload_file_to_bucket(bucket, source_file, destination_blob)
+    except Exception as e:
+        logger.error("🚨 Upload to GCS failed: %s", e)
+        raise
+
+
+def write_text_to_gcs(bucket_name, destination_blob, text, create_bucket=False,
+                      content_type="application/json", if_generation_match=None):
+    """
+    Write a small object (e.g. a run manifest) in a single request.
+
+    With if_generation_match the write only replaces that generation of
+    the object (0: only if it does not exist yet), which also makes the
+    client's retries of the request (e.g. on 429) safe.
+
+    Args:
+        bucket_name (str): Name of the GCS bucket.
+        destination_blob (str): Destination path in the bucket.
+        text (str or bytes): Object content.
+        create_bucket (bool): Whether to create the bucket if it doesn't exist.
+        content_type (str): Content-Type of the object.
+        if_generation_match (int): Generation the object must currently have.
+
+    Returns:
+        int: Generation of the written object.
+
+    Raises:
+        PreconditionFailed: If the object is not at if_generation_match.
+    """
+    bucket = get_bucket(bucket_name, create_if_missing=create_bucket)
+    blob = bucket.blob(destination_blob)
+    blob.upload_from_string(text, content_type=content_type, if_generation_match=if_generation_match)
+    return blob.generation
+
+
+def read_bytes_from_gcs(bucket_name, source_blob):
+    """
+    Read a small object and the generation it was read at.
+
+    Returns:
+        tuple: (content, generation), or (None, 0) if the object does not
+        exist (0 being the generation to write it with only if it still
+        does not).
+    """
+    try:
+        blob = get_bucket(bucket_name).get_blob(source_blob)
+        if blob is None:
+            return None, 0
+        return blob.download_as_bytes(if_generation_match=blob.generation), blob.generation
+    except NotFound:
+        return None, 0
+
+
+def read_text_from_gcs(bucket_name, source_blob):
+    """
+    Read a small UTF-8 text object and the generation it was read at.
+
+    Returns:
+        tuple: (content, generation), as read_bytes_from_gcs.
+    """
+    data, generation = read_bytes_from_gcs(bucket_name, source_blob)
+    return (data.decode("utf-8") if data is not None else None), generation
+
+
+class _UploadStream(io.RawIOBase):
+    """
+    Writable binary stream into a resumable GCS upload.
+
+    At most one chunk is buffered; each full chunk is sent as it fills up
+    and close() sends the remainder and finalizes the object. A stream that
+    is abandoned without close() leaves no object behind (the unfinished
+    resumable session simply expires).
+    """
+
+    def __init__(self, writer, bucket_name, destination_blob):
+        self._writer = writer
+        self._bucket_name = bucket_name
+        self._destination_blob = destination_blob
+        self._size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._writer.write(data)
+        self._size += len(data)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        try:
+            self._writer.close()
+            logger.info("☁️ Streamed to GCS: gs://%s/%s (%d bytes)",
+                        self._bucket_name, self._destination_blob, self._size)
+            record(stage="upload", bytes_out=self._size)
+        except PreconditionFailed:
+            logger.info("⚠️ File already exists in GCS: %s", self._destination_blob)
+            record(stage="upload", cache_hits=1)
+        except Exception as e:
+            logger.error("❌ Failed to stream '%s' to GCS: %s", self._destination_blob, e)
+            raise
+
+
+def open_upload_stream(bucket_name, destination_blob, create_bucket=False, chunk_size=None):
+    """
+    Open a streaming, chunked (resumable) upload to a GCS object.
+
+    Used to write encoder output straight to GCS without a local file; the
+    object is only created once the stream is closed.
+
+    Args:
+        bucket_name (str): Name of the GCS bucket.
+        destination_blob (str): Destination path in the bucket; its suffix
+            sets Content-Type/Content-Encoding (e.g. '.csv.gz').
+        create_bucket (bool): Whether to create the bucket if it doesn't exist.
+        chunk_size (int): Upload chunk size in bytes (multiple of 256 KiB);
+            this is the only buffer held in memory. None uses the client
+            default (40 MiB).
+
+    Returns:
+        io.RawIOBase: Writable binary stream; close() finalizes the upload.
+    """
+    bucket = get_bucket(bucket_name, create_if_missing=create_bucket)
+    blob = bucket.blob(destination_blob, chunk_size=chunk_size)
+    content_type, content_encoding = content_headers(destination_blob)
+    blob.content_encoding = content_encoding
+    writer = blob.open("wb", chunk_size=chunk_size, ignore_flush=True,
+                       content_type=content_type, if_generation_match=0)
+    return _UploadStream(writer, bucket.name, destination_blob)
+
+
+def upload_many_to_gcs(bucket_name, uploads, create_bucket=False, max_workers=8, chunk_size=None,
+                       composite_threshold=None, dedup=None, dedup_prefix=None) -> list:
+    """
+    Upload many files to one bucket concurrently over the shared client.
+
+    The bucket is resolved once (cached per process) and every file is
+    uploaded on a bounded thread pool. A failed upload does not stop the
+    others.
+
+    With `dedup`, objects under `dedup_prefix` are listed once into an
+    in-memory content-hash index, and a file whose checksum (computed while
+    it was written) is already present is not uploaded again:
+        - 'skip': log the existing object and upload nothing; the result
+          names the existing object as where the content is stored.
+        - 'alias': server-side copy the existing object to the new name
+          (no upload bytes).
+
+    Args:
+        bucket_name (str): Name of the GCS bucket.
+        uploads (list): (source_file, destination_blob) pairs.
+        create_bucket (bool): Whether to create the bucket if it doesn't exist.
+        max_workers (int): Concurrent uploads.
+        chunk_size (int): Resumable/composite chunk size in bytes.
+        composite_threshold (int): Size at which files use chunked composite uploads.
+        dedup (str): None, 'skip' or 'alias'.
+        dedup_prefix (str): Prefix to index for dedup (defaults to the
+            common directory of the destinations).
+
+    Returns:
+        list: (source_file, destination_blob, error, stored_as) tuples in
+        input order. error is None for successful uploads; stored_as is the
+        object that holds the content (destination_blob, or the existing
+        object a skipped duplicate was deduplicated to; None on error).
+    """
+    if dedup not in (None, False, "skip", "alias"):
+        raise ValueError(f"Unsupported dedup mode: {dedup}")
+
+    bucket = get_bucket(bucket_name, create_if_missing=create_bucket)
+
+    index = None
+    index_lock = threading.Lock()
+    if dedup and uploads:
+        if dedup_prefix is None:
+            dedup_prefix = os.path.commonpath([destination for _, destination in uploads])
+            dedup_prefix = f"{dedup_prefix}/" if dedup_prefix else ""
+        index = build_content_index(bucket, dedup_prefix)
+
+    def _upload(pair):
+        source_file, destination_blob = pair
+        if index is None:
+            upload_file_to_bucket(bucket, source_file, destination_blob, chunk_size=chunk_size,
+                                  composite_threshold=composite_threshold)
+            return destination_blob
+
+        checksums = file_checksums(source_file)
+        forget_checksums(source_file)
+        stored_as = destination_blob
+        with index_lock:
+            existing = _find_duplicate(index, checksums)
+        if existing == destination_blob:
+            logger.info("⚠️ File already exists in GCS: %s", destination_blob)
+            record(stage="upload", cache_hits=1)
+        elif existing and dedup == "skip":
+            logger.info("♻️ Unchanged content already in GCS as %s; skipped %s", existing, destination_blob)
+            record(stage="upload", cache_hits=1)
+            stored_as = existing
+        elif existing:
+            bucket.copy_blob(bucket.blob(existing), bucket, destination_blob)
+            logger.info("♻️ Aliased gs://%s/%s -> %s (no upload)", bucket.name, destination_blob, existing)
+            record(stage="upload", cache_hits=1)
+        else:
+            upload_file_to_bucket(bucket, source_file, destination_blob, chunk_size=chunk_size,
+                                  composite_threshold=composite_threshold)
+        with index_lock:
+            for kind in ("md5", "crc32c"):
+                if checksums.get(kind):
+                    index[kind].setdefault(checksums[kind], existing or destination_blob)
+        return stored_as
+
+    outcomes = run_concurrently(_upload, uploads, max_workers=max_workers)
+
+    results = []
+    for (source_file, destination_blob), stored_as, error in outcomes:
+        if error is not None:
+            logger.error("🚨 Upload to GCS failed for %s: %s", source_file, error)
+        results.append((source_file, destination_blob, error, stored_as))
+    return results
\ No newline at end of file
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from utils.logger import get_logger
+from utils.storage_handler import write_file_atomically
+
+logger = get_logger()
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def cache_key(method, url, params=None) -> str:
+    """
+    Stable cache key for a request: method + URL + sorted query params.
+
+    Returns:
+        str: Hex digest used as the on-disk entry name.
+    """
+    canonical = json.dumps([method.upper(), url, sorted((params or {}).items())], default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk HTTP response cache with validators and a byte budget.
+
+    Each entry is a body file plus a small JSON metadata file holding the
+    ETag/Last-Modified validators, the body digest and when it was last
+    validated. Reads bump the entry's mtime, and when the total size of
+    bodies exceeds `max_bytes` the least recently used entries are evicted.
+
+    Args:
+        directory (str): Cache directory (created on first write).
+        max_bytes (int): Byte budget for cached bodies.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+
+    def _paths(self, key):
+        return (os.path.join(self.directory, f"{key}.body"),
+                os.path.join(self.directory, f"{key}.meta.json"))
+
+    def get(self, key):
+        """
+        Look up an entry.
+
+        Returns:
+            tuple: (meta dict, body bytes), or None on a miss (including an
+            entry another process evicts while it is read).
+        """
+        body_path, meta_path = self._paths(key)
+        with self._lock:  # not evicted by this process halfway through
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                with open(body_path, "rb") as f:
+                    body = f.read()
+                now = time.time()
+                os.utime(meta_path, (now, now))  # LRU bookkeeping
+            except (OSError, ValueError):
+                return None
+        return meta, body
+
+    def put(self, key, body, etag=None, last_modified=None):
+        """Store a response body and its validators, then enforce the budget."""
+        os.makedirs(self.directory, exist_ok=True)
+        body_path, meta_path = self._paths(key)
+        meta = {
+            "etag": etag,
+            "last_modified": last_modified,
+            "digest": hashlib.sha256(body).hexdigest(),
+            "size": len(body),
+            "validated_at": time.time(),
+        }
+        with self._lock:
+            self._write_atomic(body_path, body)
+            self._write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+            self._evict()
+
+    def touch_validated(self, key):
+        """Mark an entry as freshly revalidated (e.g. after a 304)."""
+        _, meta_path = self._paths(key)
+        entry = self.get(key)
+        if entry is None:
+            return
+        meta = dict(entry[0], validated_at=time.time())
+        with self._lock:
+            self._write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+
+    @staticmethod
+    def _write_atomic(path, data):
+        write_file_atomically(path, lambda f: f.write(data))
+
+    @staticmethod
+    def _entry_size(meta_path):
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("size", 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _evict(self):
+        """Drop least recently used entries until bodies fit in the budget."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".meta.json"):
+                continue
+            meta_path = os.path.join(self.directory, name)
+            try:
+                size = self._entry_size(meta_path)
+                entries.append((os.path.getmtime(meta_path), size, name[: -len(".meta.json")]))
+            except OSError:
+                continue
+            total += size
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+            logger.info("🧹 Evicted cached response %.12s (%d bytes)", key, size)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(directory, max_bytes=DEFAULT_MAX_BYTES) -> ResponseCache:
+    """
+    Return the process-wide cache for a directory, creating it on first use.
+
+    Args:
+        directory (str): Cache directory.
+        max_bytes (int): Byte budget for cached bodies.
+
+    Returns:
+        ResponseCache: Shared cache instance.
+    """
+    with _caches_lock:
+        cache = _caches.get(directory)
+        if cache is None:
+            cache = _caches[directory] = ResponseCache(directory, max_bytes)
+        cache.max_bytes = int(max_bytes)
+        return cache
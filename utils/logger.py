@@ -1,25 +1,207 @@
-import logging
-import os
-from datetime import datetime
-
-def get_logger(name="api_logger"):
-    # Create logs folder once
-    os.makedirs("logs", exist_ok=True)
-
-    # Use a global variable to keep track of the log file for this run
-    # This avoids creating new files if called multiple times
-    if not hasattr(get_logger, "log_file"):
-        get_logger.log_file = f"logs/run_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log"
-
-    # Only configure logging once per Python session
-    if not logging.getLogger().hasHandlers():
-        logging.basicConfig(
-            level=logging.INFO,
-            format="%(asctime)s [%(levelname)s] %(message)s",
-            handlers=[
-                logging.FileHandler(get_logger.log_file, encoding="utf-8"),
-                logging.StreamHandler()
-            ]
-        )
-
-    return logging.getLogger(name)
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from utils.env import is_running_in_gcf
+
+# Logging is configured from the environment:
+#   LOG_LEVEL         DEBUG | INFO (default) | WARNING | ERROR
+#   LOG_FORMAT        text | json (default: json on Cloud Functions, else text)
+#   LOG_ASYNC         1 (default) hands records to a background thread; 0 = inline
+#   LOG_FILE          1 writes logs/run_<ts>.log (default: on locally, off on GCF)
+#   LOG_RATE_LIMIT    max records per message template per window (0 = unlimited)
+#   LOG_RATE_WINDOW   rate-limit window in seconds (default 60)
+DEFAULT_RATE_LIMIT = 100
+DEFAULT_RATE_WINDOW = 60.0
+
+# Cloud Logging severities for stdlib levels.
+_SEVERITY = {
+    logging.DEBUG: "DEBUG",
+    logging.INFO: "INFO",
+    logging.WARNING: "WARNING",
+    logging.ERROR: "ERROR",
+    logging.CRITICAL: "CRITICAL",
+}
+
+# Attributes every LogRecord has; anything else came in via `extra=`.
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_listener = None
+_queue = None
+
+
+def _env_flag(name, default):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() not in ("0", "false", "no", "off")
+
+
+class _LazyFileHandler(logging.FileHandler):
+    """FileHandler that creates its directory and file on the first record only."""
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line in the structured format Cloud Logging parses
+    from stdout: 'severity', 'message', 'time' and the source location,
+    plus any `extra=` fields (e.g. endpoint) as top-level keys.
+    """
+
+    def format(self, record):
+        entry = {
+            "severity": _SEVERITY.get(record.levelno, record.levelname),
+            "message": record.getMessage(),
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "logger": record.name,
+            "logging.googleapis.com/sourceLocation": {
+                "file": record.pathname,
+                "line": record.lineno,
+                "function": record.funcName,
+            },
+        }
+        if record.exc_info:
+            entry["stack_trace"] = self.formatException(record.exc_info)
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let at most `limit` records per message template through every `window`
+    seconds; the rest are dropped before they are formatted. The first
+    record of the next window reports how many were suppressed.
+
+    Records are keyed by their unformatted template, so hot-path calls should
+    use lazy %-style arguments (logger.error("... %s", e)) rather than
+    f-strings for repeats to be recognized.
+    """
+
+    def __init__(self, limit=DEFAULT_RATE_LIMIT, window=DEFAULT_RATE_WINDOW):
+        super().__init__()
+        self.limit = int(limit)
+        self.window = float(window)
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.limit <= 0 or record.levelno >= logging.CRITICAL:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            started, seen, suppressed = self._counts.get(key, (now, 0, 0))
+            if now - started >= self.window:
+                if suppressed:
+                    record.suppressed = suppressed
+                    record.msg = f"{record.msg} [+{suppressed} similar suppressed]"
+                started, seen, suppressed = now, 0, 0
+            seen += 1
+            if seen > self.limit:
+                self._counts[key] = (started, seen, suppressed + 1)
+                return False
+            self._counts[key] = (started, seen, suppressed)
+        return True
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that only interpolates the message before enqueueing.
+
+    Like the stdlib version, msg % args is resolved in the calling thread
+    (so arguments mutated after the log call are logged as they were), on
+    a copy of the record. Unlike it, exception formatting and the handlers'
+    formatters run on the listener thread.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _build_formatter(fmt):
+    if fmt == "json":
+        return JsonFormatter()
+    return logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+
+
+def _configure(log_file):
+    """Install handlers on the root logger according to the environment."""
+    global _listener, _queue
+
+    in_gcf = is_running_in_gcf()
+    level = os.environ.get("LOG_LEVEL", "INFO").upper()
+    formatter = _build_formatter(os.environ.get("LOG_FORMAT", "json" if in_gcf else "text").lower())
+
+    handlers = [logging.StreamHandler()]
+    # Only /tmp is writable on Cloud Functions, and stdout already goes to Cloud Logging
+    if _env_flag("LOG_FILE", not in_gcf):
+        handlers.append(_LazyFileHandler(log_file, encoding="utf-8", delay=True))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    rate_limit = RateLimitFilter(
+        int(os.environ.get("LOG_RATE_LIMIT", DEFAULT_RATE_LIMIT)),
+        float(os.environ.get("LOG_RATE_WINDOW", DEFAULT_RATE_WINDOW)),
+    )
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _env_flag("LOG_ASYNC", True):
+        _queue = queue.Queue(-1)
+        queue_handler = _DeferredQueueHandler(_queue)
+        queue_handler.addFilter(rate_limit)
+        root.addHandler(queue_handler)
+        _listener = logging.handlers.QueueListener(_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+    else:
+        for handler in handlers:
+            handler.addFilter(rate_limit)
+            root.addHandler(handler)
+
+
+def flush_logs(timeout=5.0):
+    """
+    Wait until queued records have been written (no-op in synchronous mode).
+
+    Call before returning from a Cloud Function, whose CPU may be throttled
+    as soon as the response is sent.
+
+    Args:
+        timeout (float): Maximum seconds to wait.
+    """
+    if _queue is None:
+        return
+    deadline = time.monotonic() + timeout
+    while _queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+def get_logger(name="api_logger"):
+    # Use a global variable to keep track of the log file for this run
+    # This avoids creating new files if called multiple times
+    if not hasattr(get_logger, "log_file"):
+        get_logger.log_file = f"logs/run_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log"
+
+    # Only configure logging once per Python session. The logs folder and
+    # file are created when the first record is written, not at import time.
+    if not logging.getLogger().hasHandlers():
+        _configure(get_logger.log_file)
+
+    return logging.getLogger(name)
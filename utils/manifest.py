@@ -0,0 +1,403 @@
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from utils.logger import get_logger
+from utils.storage_handler import write_file_atomically
+
+logger = get_logger()
+
+# Where manifests are kept: the local state directory or the GCS bucket.
+MANIFEST_STORES = ("local", "gcs")
+
+# Local manifests kept per state directory (oldest are removed first).
+DEFAULT_KEEP_RUNS = 100
+
+# Endpoint statuses that need no further work on resume.
+COMPLETED_STATUSES = frozenset({"success", "unchanged"})
+
+
+def new_run_id() -> str:
+    """Random identifier for a pipeline run (also names its manifest)."""
+    return uuid.uuid4().hex[:12]
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def shard_key(label) -> str:
+    """Stable file-name-safe key for a shard label such as {'state': '01'}."""
+    return "_".join(f"{name}-{value}" for name, value in sorted(label.items())) or "all"
+
+
+class LocalStore:
+    """Manifests as JSON files under <state_dir>/runs/."""
+
+    # Minimum seconds between writes of one manifest (see RunManifest.save)
+    min_interval = 0.0
+
+    def __init__(self, state_dir, keep_runs=DEFAULT_KEEP_RUNS):
+        self.dir = os.path.join(state_dir, "runs")
+        self.keep_runs = keep_runs
+
+    def location(self, run_id) -> str:
+        return os.path.join(self.dir, f"{run_id}.json")
+
+    def read(self, run_id):
+        try:
+            with open(self.location(run_id), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, run_id, text):
+        os.makedirs(self.dir, exist_ok=True)
+        write_file_atomically(self.location(run_id), lambda f: f.write(text.encode("utf-8")))
+
+    def prune(self):
+        """Remove all but the newest keep_runs manifests (and their spools)."""
+        try:
+            names = [name for name in os.listdir(self.dir) if name.endswith(".json")]
+        except FileNotFoundError:
+            return
+        paths = sorted((os.path.join(self.dir, name) for name in names), key=os.path.getmtime)
+        for path in paths[:max(0, len(paths) - self.keep_runs)]:
+            os.remove(path)
+            shutil.rmtree(path[:-len(".json")], ignore_errors=True)
+
+
+class GCSStore:
+    """
+    Manifests as JSON objects under gs://<bucket>/<prefix>/_runs/.
+
+    Every write is conditional on the generation this store last read or
+    wrote, so the client can safely retry it and a manifest another
+    process changed in between is not overwritten.
+    """
+
+    # GCS accepts about one update per second to the same object
+    min_interval = 1.0
+
+    def __init__(self, bucket, prefix, create_bucket=False):
+        self.bucket = bucket
+        self.prefix = f"{prefix.strip('/')}/_runs"
+        self.create_bucket = create_bucket
+        self._generations = {}  # run_id -> generation last read/written
+
+    def prune(self):
+        pass  # old manifests are left to the bucket's lifecycle rules
+
+    def location(self, run_id) -> str:
+        return f"gs://{self.bucket}/{self.prefix}/{run_id}.json"
+
+    def read(self, run_id):
+        # google-cloud-storage is only imported by runs that use it
+        from utils.gcs_handler import read_text_from_gcs
+        text, self._generations[run_id] = read_text_from_gcs(self.bucket, f"{self.prefix}/{run_id}.json")
+        return text
+
+    def write(self, run_id, text):
+        from google.api_core.exceptions import PreconditionFailed
+        from utils.gcs_handler import read_text_from_gcs, write_text_to_gcs
+
+        name = f"{self.prefix}/{run_id}.json"
+        try:
+            self._generations[run_id] = write_text_to_gcs(
+                self.bucket, name, text, create_bucket=self.create_bucket,
+                if_generation_match=self._generations.get(run_id, 0),
+            )
+        except PreconditionFailed:
+            # A retried request whose first attempt went through fails its
+            # precondition too; anything else is another writer's manifest
+            current, generation = read_text_from_gcs(self.bucket, name)
+            if current != text:
+                raise RuntimeError(f"Run manifest {self.location(run_id)} was changed by another process")
+            self._generations[run_id] = generation
+
+
+def manifest_store(defaults, state_dir):
+    """Build the store selected by defaults.manifest.store ('local' by default)."""
+    settings = defaults.get("manifest") or {}
+    if settings.get("store", "local") == "gcs":
+        return GCSStore(defaults["bucket"], defaults["gcs_path_prefix"],
+                        defaults.get("create_bucket_if_missing", False))
+    return LocalStore(state_dir, settings.get("keep_runs", DEFAULT_KEEP_RUNS))
+
+
+class ShardSpool:
+    """
+    Completed shards of one endpoint, kept on local disk until the endpoint
+    succeeds, so a resumed run only re-fetches the shards that failed.
+    """
+
+    def __init__(self, directory, on_save=None):
+        self.dir = directory
+        self.on_save = on_save
+
+    def _path(self, label):
+        return os.path.join(self.dir, f"{shard_key(label)}.json.gz")
+
+    def load(self, label):
+        """Rows of a completed shard, or None if it has to be fetched."""
+        try:
+            with gzip.open(self._path(label), "rt", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("⚠️ Ignoring unreadable spooled shard %s: %s", self._path(label), e)
+            return None
+
+    def save(self, label, data):
+        os.makedirs(self.dir, exist_ok=True)
+
+        def _write(f):
+            with gzip.open(f, "wt", encoding="utf-8", compresslevel=1) as gz:
+                json.dump(data, gz, separators=(",", ":"))
+
+        write_file_atomically(self._path(label), _write)
+        if self.on_save is not None:
+            self.on_save(label)
+
+    def clear(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class RunManifest:
+    """
+    Persistent record of what a run has completed, so a failed run can be
+    resumed without redoing the work that already succeeded.
+
+    Per endpoint it keeps the status and final result, the timestamp its
+    files are named with (a resumed run writes the same names), and which
+    formats were written, which objects uploaded and which shards fetched.
+    It is saved at every checkpoint (after each fetch, format and upload
+    step of an endpoint) to the local state directory or to GCS.
+
+    Args:
+        run_id (str): Run identifier.
+        env (str): Environment name.
+        store (LocalStore or GCSStore): Where the manifest is persisted.
+        spool_dir (str): Local directory for spooled shards.
+        data (dict): Previously saved manifest content, when resuming.
+    """
+
+    def __init__(self, run_id, env, store, spool_dir, data=None):
+        self.run_id = run_id
+        self.env = env
+        self.store = store
+        self.spool_dir = os.path.join(spool_dir, "runs", run_id)
+        self._lock = threading.Lock()
+        # Held from serializing to stored, so saves land in the order their
+        # content was taken and a stale snapshot never overwrites a newer one.
+        self._save_lock = threading.Lock()
+        self._dirty = False  # changed since the last snapshot was written
+        self._saved_at = float("-inf")
+        self.data = data or {
+            "run_id": run_id,
+            "environment": env,
+            "created_at": _now(),
+            "attempts": 0,
+            "status": "running",
+            "endpoints": {},
+        }
+
+    @classmethod
+    def load(cls, run_id, env, store, spool_dir):
+        """
+        Load a saved manifest to resume its run.
+
+        Raises:
+            FileNotFoundError: If no manifest exists for the run.
+            ValueError: If it belongs to another environment.
+        """
+        text = store.read(run_id)
+        if text is None:
+            raise FileNotFoundError(f"No run manifest for {run_id} at {store.location(run_id)}")
+        data = json.loads(text)
+        if data.get("environment") != env:
+            raise ValueError(f"Run {run_id} belongs to environment {data.get('environment')!r}, not {env!r}")
+        return cls(run_id, env, store, spool_dir, data)
+
+    def start(self, endpoints):
+        """Register this attempt and the endpoints it covers, then save."""
+        with self._lock:
+            self.data["attempts"] += 1
+            self.data["status"] = "running"
+            for name in endpoints:
+                self.data["endpoints"].setdefault(name, {"status": "pending"})
+        self.save(wait=True)
+
+    def completed(self, name) -> bool:
+        with self._lock:
+            return self.data["endpoints"].get(name, {}).get("status") in COMPLETED_STATUSES
+
+    def result(self, name) -> dict:
+        with self._lock:
+            return dict(self.data["endpoints"][name].get("result") or {})
+
+    def endpoint(self, name):
+        """Checkpoint handle for one endpoint of this run."""
+        return EndpointCheckpoint(self, name)
+
+    def finish(self, status):
+        """Record the run's final status and save."""
+        with self._lock:
+            self.data["status"] = status
+        self.save(wait=True)
+        if status == "success":
+            shutil.rmtree(self.spool_dir, ignore_errors=True)
+        self.store.prune()
+
+    def save(self, wait=False):
+        """
+        Persist the manifest, best-effort: a failed write is logged and the
+        run goes on (a resume may then redo some work).
+
+        Saves are coalesced: while one is being written, other threads
+        return at once and their changes go out with the next write. A
+        store with a min_interval (GCS) is written at most that often;
+        changes made in between are written by the next save after it, or
+        by the next save with wait=True (start and finish), which waits
+        for the interval and always writes.
+        """
+        with self._lock:
+            self._dirty = True
+        while True:
+            if not self._save_lock.acquire(blocking=wait):
+                return  # the save in progress picks this change up
+            try:
+                written = self._write(wait)
+            finally:
+                self._save_lock.release()
+            wait = False
+            with self._lock:
+                if not written or not self._dirty:
+                    return
+            # changes made during the write, unless a later save is due to take them
+            if time.monotonic() < self._saved_at + self.store.min_interval:
+                return
+
+    def _write(self, wait) -> bool:
+        """Write the current state under _save_lock; False if debounced or failed."""
+        delay = self._saved_at + self.store.min_interval - time.monotonic()
+        if delay > 0:
+            if not wait:
+                return False
+            time.sleep(delay)
+        with self._lock:
+            self._dirty = False
+            self.data["updated_at"] = _now()
+            text = json.dumps(self.data, indent=2, default=str)
+        self._saved_at = time.monotonic()
+        try:
+            self.store.write(self.run_id, text)
+        except Exception as e:
+            with self._lock:
+                self._dirty = True
+            logger.warning("⚠️ Could not save run manifest %s: %s", self.store.location(self.run_id), e)
+            return False
+        return True
+
+    def _update(self, name, func):
+        with self._lock:
+            func(self.data["endpoints"].setdefault(name, {"status": "pending"}))
+
+
+class EndpointCheckpoint:
+    """
+    One endpoint's slice of a RunManifest: what to skip on resume, and the
+    calls process_endpoint makes to record its progress.
+    """
+
+    def __init__(self, manifest, name):
+        self.manifest = manifest
+        self.name = name
+        self.spool = ShardSpool(os.path.join(manifest.spool_dir, "shards", name),
+                                on_save=lambda label: self.record_shards([label]))
+        with manifest._lock:
+            state = manifest.data["endpoints"].setdefault(name, {"status": "pending"})
+            state.setdefault("timestamp", datetime.utcnow().strftime("%Y%m%d%H%M%S"))
+            state.setdefault("formats", {})
+            state.setdefault("uploads", {})
+            state.setdefault("deduplicated", {})
+            state["attempts"] = state.get("attempts", 0) + 1
+            state["status"] = "running"
+            self.timestamp = state["timestamp"]
+
+    def _state(self):
+        return self.manifest.data["endpoints"][self.name]
+
+    def written_formats(self) -> dict:
+        """fmt -> output paths of formats already written by an earlier attempt."""
+        with self.manifest._lock:
+            return {fmt: list(entry["files"]) for fmt, entry in self._state()["formats"].items()
+                    if entry.get("status") == "written"}
+
+    def uploaded(self, destination) -> bool:
+        with self.manifest._lock:
+            return self._state()["uploads"].get(destination) == "done"
+
+    def record_formats(self, written, failed):
+        """Record formats written ({fmt: [paths]}) and failed (list) and save."""
+        def _apply(state):
+            for fmt, paths in written.items():
+                state["formats"][fmt] = {"status": "written", "files": list(paths)}
+            for fmt in failed:
+                state["formats"][fmt] = {"status": "failed"}
+        self.manifest._update(self.name, _apply)
+        self.manifest.save()
+
+    def deduplicated(self) -> dict:
+        """destination -> existing object its content was deduplicated to."""
+        with self.manifest._lock:
+            return dict(self._state()["deduplicated"])
+
+    def record_uploads(self, done, failed, deduplicated=None):
+        """
+        Record object destinations uploaded and failed, and those stored as
+        an existing object instead ({destination: object}), and save.
+        """
+        def _apply(state):
+            state["uploads"].update(dict.fromkeys(done, "done"))
+            state["uploads"].update(dict.fromkeys(failed, "failed"))
+            state["deduplicated"].update(deduplicated or {})
+        self.manifest._update(self.name, _apply)
+        self.manifest.save()
+
+    def record_shards(self, labels):
+        """Record the shards fetched so far (they are spooled on disk)."""
+        def _apply(state):
+            state["shards"] = sorted(set(state.get("shards", [])) | {shard_key(label) for label in labels})
+        self.manifest._update(self.name, _apply)
+
+    def reset_outputs(self):
+        """Forget written formats and uploads (e.g. their files are gone)."""
+        def _apply(state):
+            state["formats"] = {}
+            state["uploads"] = {}
+            state["deduplicated"] = {}
+        self.manifest._update(self.name, _apply)
+
+    def finish(self, result):
+        """Record the endpoint's final result, drop its spooled shards and save."""
+        def _apply(state):
+            state["status"] = result["status"]
+            state["result"] = result
+            state.pop("error", None)
+        self.manifest._update(self.name, _apply)
+        self.manifest.save()
+        self.spool.clear()
+
+    def fail(self, error):
+        def _apply(state):
+            state["status"] = "failed"
+            state["error"] = str(error)
+        self.manifest._update(self.name, _apply)
+        self.manifest.save()
@@ -0,0 +1,391 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Counters tracked per endpoint and stage.
+COUNTERS = ("bytes_in", "bytes_out", "rows", "retries", "cache_hits", "throttled", "errors")
+
+# Pipeline stages in execution order (used to order the summary).
+STAGES = ("fetch", "format", "upload")
+
+PROMETHEUS_PREFIX = "api_pipeline"
+
+# The active run and endpoint/stage are carried in context variables, so
+# code deep in the fetch/format/upload layers can record a counter without
+# being handed a collector. run_concurrently/imap_bounded copy the context
+# into their worker threads.
+_run = contextvars.ContextVar("metrics_run", default=None)
+_endpoint = contextvars.ContextVar("metrics_endpoint", default=None)
+_stage = contextvars.ContextVar("metrics_stage", default=None)
+
+
+class RunMetrics:
+    """
+    Thread-safe collector for one pipeline run.
+
+    Keeps wall time and the COUNTERS for every (endpoint, stage) pair, when
+    the stage first started and last ended (seconds since the run started,
+    e.g. to line stages up with resource samples), plus the total wall time
+    per endpoint.
+
+    Args:
+        environment (str): Environment the run belongs to.
+        run_id (str): Identifier for the run (random if omitted).
+    """
+
+    def __init__(self, environment=None, run_id=None):
+        self.environment = environment
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._endpoint_seconds = {}
+
+    def _entry(self, endpoint, stage):
+        key = (endpoint, stage)
+        if key not in self._stages:
+            self._stages[key] = dict.fromkeys(("wall_seconds",) + COUNTERS, 0)
+            self._stages[key].update(started_s=None, ended_s=None)
+        return self._stages[key]
+
+    def add(self, endpoint, stage, **values):
+        """Add counter values (and/or wall_seconds) to an endpoint's stage."""
+        with self._lock:
+            entry = self._entry(endpoint, stage)
+            for name, value in values.items():
+                entry[name] = entry.get(name, 0) + value
+
+    def mark(self, endpoint, stage, started, ended):
+        """Widen the stage's time span with a perf_counter() interval."""
+        started, ended = started - self._started, ended - self._started
+        with self._lock:
+            entry = self._entry(endpoint, stage)
+            if entry["started_s"] is None or started < entry["started_s"]:
+                entry["started_s"] = started
+            if entry["ended_s"] is None or ended > entry["ended_s"]:
+                entry["ended_s"] = ended
+
+    def add_endpoint_time(self, endpoint, seconds):
+        with self._lock:
+            self._endpoint_seconds[endpoint] = self._endpoint_seconds.get(endpoint, 0) + seconds
+
+    def summary(self, results) -> dict:
+        """
+        Build the run summary.
+
+        Args:
+            results (dict): Per-endpoint outcome keyed by endpoint name, each
+                with 'status' and 'files' or 'error'.
+
+        Returns:
+            dict: JSON-serializable summary with run-level fields, per-endpoint
+            results with their stage metrics, and totals.
+        """
+        with self._lock:
+            stages = {key: dict(entry) for key, entry in self._stages.items()}
+            endpoint_seconds = dict(self._endpoint_seconds)
+
+        endpoints = {}
+        totals = dict.fromkeys(COUNTERS, 0)
+        for name, result in results.items():
+            per_stage = {}
+            for (endpoint, stage), entry in sorted(
+                stages.items(), key=lambda item: _stage_order(item[0][1])
+            ):
+                if endpoint != name:
+                    continue
+                per_stage[stage] = {
+                    key: round(value, 6) if isinstance(value, float) else value
+                    for key, value in entry.items()
+                }
+                for counter in COUNTERS:
+                    totals[counter] += entry.get(counter, 0)
+            endpoints[name] = dict(
+                result,
+                wall_seconds=round(endpoint_seconds.get(name, 0.0), 6),
+                stages=per_stage,
+            )
+
+        statuses = [result["status"] for result in results.values()]
+        # a 'partial' endpoint is missing formats, so it counts as failed
+        failed = sum(status not in ("success", "unchanged") for status in statuses)
+        if not failed:
+            status = "success"
+        elif statuses.count("failed") == len(statuses):
+            status = "failed"
+        else:
+            status = "partial"
+
+        return {
+            "run_id": self.run_id,
+            "environment": self.environment,
+            "status": status,
+            "started_at": self.started_at.isoformat(),
+            "wall_seconds": round(time.perf_counter() - self._started, 6),
+            "endpoints": endpoints,
+            "totals": dict(totals, endpoints=len(statuses), failed=failed),
+        }
+
+
+def _stage_order(stage):
+    return STAGES.index(stage) if stage in STAGES else len(STAGES)
+
+
+@contextmanager
+def collect(environment=None, run_id=None):
+    """
+    Collect metrics for everything recorded inside the block.
+
+    Yields:
+        RunMetrics: The run's collector.
+    """
+    run = RunMetrics(environment, run_id)
+    token = _run.set(run)
+    try:
+        yield run
+    finally:
+        _run.reset(token)
+
+
+@contextmanager
+def endpoint_scope(name):
+    """Attribute metrics recorded inside the block to endpoint `name`."""
+    token = _endpoint.set(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        run = _run.get()
+        if run is not None:
+            run.add_endpoint_time(name, time.perf_counter() - started)
+        _endpoint.reset(token)
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a stage of the current endpoint and make it the default stage for
+    record() calls inside the block. An exception escaping the block counts
+    as an error of the stage.
+    """
+    token = _stage.set(name)
+    started = time.perf_counter()
+    errors = 0
+    try:
+        yield
+    except Exception:
+        errors = 1
+        raise
+    finally:
+        _stage.reset(token)
+        run = _run.get()
+        if run is not None:
+            ended = time.perf_counter()
+            run.add(_endpoint.get(), name, wall_seconds=ended - started, errors=errors)
+            run.mark(_endpoint.get(), name, started, ended)
+
+
+def record(stage=None, **values):
+    """
+    Add counters (see COUNTERS) to the current endpoint.
+
+    No-op outside collect(), so library code can record unconditionally.
+
+    Args:
+        stage (str): Stage to attribute to; defaults to the enclosing stage().
+            Layers whose work can run lazily inside another stage (e.g. a
+            streamed body read while formatting) pass it explicitly.
+        **values: Counter increments, e.g. bytes_in=1024, retries=1.
+    """
+    run = _run.get()
+    if run is None:
+        return
+    run.add(_endpoint.get(), stage or _stage.get(), **values)
+
+
+# Rate limiter gauges: (summary key, metric name, help text).
+_RATE_LIMIT_GAUGES = (
+    ("rate", "rate_limit_requests_per_second", "Current request rate allowed per API host (absent = unlimited)."),
+    ("concurrency", "rate_limit_concurrency", "Current concurrent request window per API host."),
+    ("peak_queued", "rate_limit_queue_depth", "Peak number of requests waiting for the host during the run."),
+    ("throttled", "rate_limit_throttled", "Overload responses (429/5xx/timeouts) seen from the host since start."),
+)
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def to_prometheus(summary) -> str:
+    """
+    Render a run summary in the Prometheus text exposition format.
+
+    Values describe a single run, so everything is exported as a gauge
+    (suited to the node_exporter textfile collector or a Pushgateway).
+
+    Args:
+        summary (dict): Output of RunMetrics.summary().
+
+    Returns:
+        str: Exposition text.
+    """
+    env = _label_value(summary.get("environment"))
+    samples = {"stage_wall_seconds": []}
+    samples.update({f"stage_{counter}": [] for counter in COUNTERS})
+    endpoint_seconds = []
+    endpoint_up = []
+    for name, result in summary["endpoints"].items():
+        labels = f'env="{env}",endpoint="{_label_value(name)}"'
+        endpoint_seconds.append(f"{{{labels}}} {result['wall_seconds']}")
+        endpoint_up.append(f"{{{labels}}} {1 if result['status'] in ('success', 'unchanged') else 0}")
+        for stage_name, entry in result["stages"].items():
+            stage_labels = f'{labels},stage="{_label_value(stage_name)}"'
+            samples["stage_wall_seconds"].append(f"{{{stage_labels}}} {entry['wall_seconds']}")
+            for counter in COUNTERS:
+                samples[f"stage_{counter}"].append(f"{{{stage_labels}}} {entry[counter]}")
+
+    lines = []
+
+    def _metric(name, help_text, values):
+        lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} gauge")
+        lines.extend(f"{PROMETHEUS_PREFIX}_{name}{value}" for value in values)
+
+    _metric("run_wall_seconds", "Wall time of the last pipeline run.",
+            [f'{{env="{env}"}} {summary["wall_seconds"]}'])
+    _metric("run_timestamp_seconds", "Start time of the last pipeline run.",
+            [f'{{env="{env}"}} {datetime.fromisoformat(summary["started_at"]).timestamp()}'])
+    _metric("endpoint_wall_seconds", "Wall time per endpoint.", endpoint_seconds)
+    _metric("endpoint_success", "1 if the endpoint succeeded (or was unchanged), else 0.", endpoint_up)
+    for name, values in samples.items():
+        _metric(name, f"Per-stage {name[len('stage_'):].replace('_', ' ')} of the last run.", values)
+
+    limits = summary.get("rate_limits") or {}
+    for key, name, help_text in _RATE_LIMIT_GAUGES:
+        _metric(name, help_text, [
+            f'{{env="{env}",host="{_label_value(host)}"}} {stats[key]}'
+            for host, stats in limits.items() if stats[key] is not None
+        ])
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(summary, path):
+    """Write the Prometheus exposition atomically (textfile collector friendly)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(to_prometheus(summary))
+    os.replace(tmp_path, path)
+
+
+def to_otlp(summary) -> dict:
+    """
+    Render a run summary as an OTLP/JSON metrics payload (the body of a
+    POST to an OpenTelemetry collector's /v1/metrics).
+
+    Args:
+        summary (dict): Output of RunMetrics.summary().
+
+    Returns:
+        dict: ExportMetricsServiceRequest in its JSON encoding.
+    """
+    now = str(time.time_ns())
+
+    def _attributes(**attributes):
+        return [{"key": key, "value": {"stringValue": str(value)}} for key, value in attributes.items()]
+
+    def _gauge(name, unit, points):
+        return {
+            "name": f"{PROMETHEUS_PREFIX}.{name}",
+            "unit": unit,
+            "gauge": {"dataPoints": [
+                {"attributes": attributes, "timeUnixNano": now, "asDouble": float(value)}
+                for attributes, value in points
+            ]},
+        }
+
+    stage_points = {"wall_seconds": []}
+    stage_points.update({counter: [] for counter in COUNTERS})
+    endpoint_points = []
+    for name, result in summary["endpoints"].items():
+        endpoint_points.append((_attributes(endpoint=name, status=result["status"]), result["wall_seconds"]))
+        for stage_name, entry in result["stages"].items():
+            attributes = _attributes(endpoint=name, stage=stage_name)
+            for key in stage_points:
+                stage_points[key].append((attributes, entry[key]))
+
+    units = {"wall_seconds": "s", "bytes_in": "By", "bytes_out": "By"}
+    metrics = [
+        _gauge("run.duration", "s", [([], summary["wall_seconds"])]),
+        _gauge("endpoint.duration", "s", endpoint_points),
+    ]
+    metrics += [_gauge(f"stage.{key}", units.get(key, "1"), points) for key, points in stage_points.items()]
+    limits = summary.get("rate_limits") or {}
+    for key, name, _ in _RATE_LIMIT_GAUGES:
+        metrics.append(_gauge(f"rate_limit.{name[len('rate_limit_'):]}", "1", [
+            (_attributes(host=host), stats[key]) for host, stats in limits.items() if stats[key] is not None
+        ]))
+
+    return {"resourceMetrics": [{
+        "resource": {"attributes": _attributes(
+            **{"service.name": "api-pipeline", "deployment.environment": summary.get("environment"),
+               "run.id": summary["run_id"]}
+        )},
+        "scopeMetrics": [{"scope": {"name": "utils.metrics"}, "metrics": metrics}],
+    }]}
+
+
+def export_otlp(summary, endpoint, timeout=10):
+    """
+    POST the summary to an OTLP/HTTP collector.
+
+    Args:
+        summary (dict): Output of RunMetrics.summary().
+        endpoint (str): Collector base URL, e.g. http://localhost:4318.
+        timeout (int): Request timeout in seconds.
+    """
+    from utils.api_client import get_session
+
+    url = endpoint.rstrip("/")
+    if not url.endswith("/v1/metrics"):
+        url = f"{url}/v1/metrics"
+    resp = get_session().post(url, data=json.dumps(to_otlp(summary)),
+                              headers={"Content-Type": "application/json"}, timeout=timeout)
+    resp.raise_for_status()
+
+
+def export_summary(summary, settings=None):
+    """
+    Export a run summary to the sinks configured in defaults.metrics:
+    'prometheus_file' (textfile) and/or 'otlp_endpoint' (falls back to
+    OTEL_EXPORTER_OTLP_ENDPOINT). Export failures are logged, never raised.
+
+    Args:
+        summary (dict): Output of RunMetrics.summary().
+        settings (Mapping): The defaults.metrics config section.
+    """
+    settings = settings or {}
+    prometheus_file = settings.get("prometheus_file")
+    otlp_endpoint = settings.get("otlp_endpoint") or os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT")
+    if prometheus_file:
+        try:
+            write_prometheus(summary, prometheus_file)
+            logger.info("📈 Wrote Prometheus metrics to %s", prometheus_file)
+        except Exception as e:
+            logger.error("❌ Failed to write Prometheus metrics: %s", e)
+    if otlp_endpoint:
+        try:
+            export_otlp(summary, otlp_endpoint)
+            logger.info("📈 Exported OTLP metrics to %s", otlp_endpoint)
+        except Exception as e:
+            logger.error("❌ Failed to export OTLP metrics: %s", e)
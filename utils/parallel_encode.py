@@ -0,0 +1,243 @@
+import atexit
+import csv
+import io
+import json
+import os
+import threading
+from array import array
+from collections import deque
+from itertools import chain, islice
+
+# Kept free of utils imports: every worker process imports this module.
+
+# Below this many rows the pool's start-up and transfer costs outweigh the gain.
+DEFAULT_MIN_ROWS = 200000
+
+# Rows per chunk handed to a worker.
+DEFAULT_CHUNK_ROWS = 50000
+
+# Formats whose output is a plain concatenation of per-row encodings.
+PARALLEL_FORMATS = {"csv", "json", "txt"}
+
+# Separates cells in a packed chunk; chunks containing it are pickled instead.
+_CELL_SEPARATOR = "\x1f"
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pack_rows(rows):
+    """
+    Pack a chunk of rows into a compact, cheap-to-transfer form.
+
+    Rows of strings/nulls (the Census shape) become one separator-joined
+    string plus two integer arrays (row widths and null positions), which
+    pickle as a few flat buffers instead of millions of small objects.
+    Anything else (other cell types, non-list rows, cells containing the
+    separator) is passed through as-is and pickled normally.
+
+    Args:
+        rows (list): Rows of the chunk.
+
+    Returns:
+        tuple: Packed chunk, accepted by unpack_rows.
+    """
+    if set(map(type, rows)) != {list}:
+        return ("rows", rows)
+    widths = array("I", map(len, rows))
+    nulls = array("I")
+    try:
+        # Packing is serial work in the parent, so the common all-strings
+        # case is a single C-level join
+        text = _CELL_SEPARATOR.join(chain.from_iterable(rows))
+    except TypeError:
+        cells = list(chain.from_iterable(rows))
+        if not set(map(type, cells)) <= {str, type(None)}:
+            return ("rows", rows)
+        try:
+            while True:
+                nulls.append(cells.index(None, nulls[-1] + 1 if nulls else 0))
+        except ValueError:
+            pass
+        for i in nulls:
+            cells[i] = ""
+        text = _CELL_SEPARATOR.join(cells)
+    cell_count = sum(widths)
+    if cell_count and text.count(_CELL_SEPARATOR) != cell_count - 1:
+        return ("rows", rows)
+    return ("packed", text, widths, nulls)
+
+
+def unpack_rows(chunk):
+    """Rebuild the rows of a chunk produced by pack_rows."""
+    if chunk[0] == "rows":
+        return chunk[1]
+    _, text, widths, nulls = chunk
+    cells = text.split(_CELL_SEPARATOR) if sum(widths) else []
+    for i in nulls:
+        cells[i] = None
+    cells = iter(cells)
+    return [list(islice(cells, width)) for width in widths]
+
+
+def _encode_csv_chunk(rows, width, indent=None):
+    buffer = io.StringIO()
+    if rows and min(map(len, rows)) < width:
+        rows = [row if len(row) >= width else row + [None] * (width - len(row)) for row in rows]
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue()
+
+
+def _encode_json_chunk(rows, width, indent=2):
+    # The elements of json.dumps(rows, indent=indent), already indented one
+    # level, or of the compact encoding for indent=None
+    if indent is None:
+        return json.dumps(rows, separators=(",", ":"))[1:-1]
+    return json.dumps(rows, indent=indent)[2:-2]
+
+
+def _encode_txt_chunk(rows, width, indent=None):
+    return "\n".join(map(str, rows))
+
+
+_CHUNK_ENCODERS = {
+    "csv": _encode_csv_chunk,
+    "json": _encode_json_chunk,
+    "txt": _encode_txt_chunk,
+}
+
+# Text written around the chunk outputs: (opening, separator, closing).
+_FRAMING = {
+    "csv": ("", "", ""),
+    "json": ("[\n", ",\n", "\n]"),
+    "txt": ("", "\n", ""),
+}
+
+# JSON framing of compact (indent=None) output.
+_COMPACT_JSON_FRAMING = ("[", ",", "]")
+
+
+def encode_chunk(fmt, chunk, width=0, indent=2):
+    """Worker entry point: encode one packed chunk of rows as text."""
+    return _CHUNK_ENCODERS[fmt](unpack_rows(chunk), width, indent)
+
+
+def _get_pool(processes):
+    """Return the process pool of the given size, started on first use."""
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    with _pools_lock:
+        pool = _pools.get(processes)
+        if pool is None:
+            # forkserver: workers are not forked from this (threaded) process
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context(method))
+            _pools[processes] = pool
+        return pool
+
+
+def _discard_pool(processes):
+    with _pools_lock:
+        pool = _pools.pop(processes, None)
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def shutdown_pools():
+    """Stop every worker process (also run at interpreter exit)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def parallel_settings(settings) -> tuple:
+    """
+    Resolve an endpoint's parallel_encode section, e.g.:
+
+        parallel_encode:
+          processes: 4        # default: CPU count
+          min_rows: 200000    # smaller payloads are encoded serially
+          chunk_rows: 50000
+
+    Workers are started with forkserver (spawn elsewhere), so the entry
+    script needs the usual `if __name__ == "__main__":` guard.
+
+    Returns:
+        tuple: (processes, min_rows, chunk_rows), or None when disabled.
+    """
+    if settings is None:
+        return None
+    processes = settings.get("processes") or os.cpu_count() or 1
+    if processes < 2:
+        return None
+    return (processes, settings.get("min_rows", DEFAULT_MIN_ROWS),
+            settings.get("chunk_rows", DEFAULT_CHUNK_ROWS))
+
+
+def encode_parallel(fmt, header, rows, fh, processes, chunk_rows=DEFAULT_CHUNK_ROWS, indent=2) -> None:
+    """
+    Encode rows as csv/json/txt across a process pool, writing in order.
+
+    The rows are cut into chunks that are packed (see pack_rows), encoded
+    by the workers and written to `fh` in their original order, so the
+    output is byte-identical to the serial encoder's. At most two chunks
+    per process are in flight, bounding the extra memory.
+
+    Args:
+        fmt (str): 'csv' (header + rows), 'json' or 'txt' (a list payload).
+        header (list): CSV header row (None for json/txt).
+        rows (list): Rows to encode; for json/txt, the payload's elements.
+        fh (file): Writable text handle.
+        processes (int): Pool size.
+        chunk_rows (int): Rows per chunk.
+        indent (int): JSON indentation (None = compact), as write_json.
+
+    Raises:
+        ValueError: If the format cannot be encoded in parallel.
+        concurrent.futures.process.BrokenProcessPool: If a worker died.
+    """
+    if fmt not in _CHUNK_ENCODERS:
+        raise ValueError(f"Unsupported parallel format: {fmt}")
+    if fmt == "csv":
+        fh.write(_encode_csv_chunk([header], len(header)))
+    opening, separator, closing = (
+        _COMPACT_JSON_FRAMING if fmt == "json" and indent is None else _FRAMING[fmt]
+    )
+    if not rows:
+        fh.write("[]" if fmt == "json" else "")
+        return
+
+    from concurrent.futures.process import BrokenProcessPool
+
+    pool = _get_pool(processes)
+    width = len(header) if header is not None else 0
+    starts = iter(range(0, len(rows), chunk_rows))
+    pending = deque()
+
+    def _submit():
+        start = next(starts, None)
+        if start is not None:
+            chunk = pack_rows(rows[start:start + chunk_rows])
+            pending.append(pool.submit(encode_chunk, fmt, chunk, width, indent))
+
+    try:
+        for _ in range(2 * processes):
+            _submit()
+        fh.write(opening)
+        first = True
+        while pending:
+            text = pending.popleft().result()
+            _submit()
+            fh.write(text if first else separator + text)
+            first = False
+        fh.write(closing)
+    except BrokenProcessPool:
+        _discard_pool(processes)
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
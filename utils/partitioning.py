@@ -0,0 +1,71 @@
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Directory value Hive uses for null/empty partition values.
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+# More distinct partitions than this is almost always a wrong partition_by
+# (e.g. a per-row id); like Hive's max dynamic partitions, it is an error.
+DEFAULT_MAX_PARTITIONS = 1000
+
+# Characters Hive percent-escapes in partition values.
+_ESCAPED = set('"#%\'*/:=?\\\x7f{[]^') | {chr(code) for code in range(1, 32)}
+
+
+def partition_columns(partition_by) -> list:
+    """Normalize a partition_by setting (a column name or a list of them) to a list."""
+    if not partition_by:
+        return []
+    return [partition_by] if isinstance(partition_by, str) else list(partition_by)
+
+
+def escape_partition_value(value) -> str:
+    """Render a value as a Hive partition directory value (percent-escaped)."""
+    if value is None or value == "":
+        return NULL_PARTITION
+    return "".join(f"%{ord(char):02X}" if char in _ESCAPED else char for char in str(value))
+
+
+def partition_path(columns, values) -> str:
+    """Relative directory of a partition, e.g. 'state=01/YEAR=2020'."""
+    return "/".join(f"{column}={escape_partition_value(value)}" for column, value in zip(columns, values))
+
+
+def route_rows(header, rows, columns, max_partitions=DEFAULT_MAX_PARTITIONS) -> dict:
+    """
+    Route rows into partitions in a single pass.
+
+    Every row is held until the partitions are written, so partitioning is
+    only for payloads that are fetched whole anyway (the config rejects
+    partition_by on streamed and sharded endpoints).
+
+    Args:
+        header (list): Column names of the rows.
+        rows (iterable): Data rows.
+        columns (list): Partition columns, in directory nesting order.
+        max_partitions (int): Most distinct partitions allowed.
+
+    Returns:
+        dict: Tuple of partition values -> rows, in order of first
+        appearance (rows keep their input order within a partition).
+
+    Raises:
+        ValueError: If a partition column is missing from the header or
+            there are more than max_partitions partitions.
+    """
+    missing = [column for column in columns if column not in header]
+    if missing:
+        raise ValueError(f"partition_by column(s) not in the data: {', '.join(missing)}")
+    indexes = [header.index(column) for column in columns]
+    partitions = {}
+    for row in rows:
+        key = tuple(row[i] if i < len(row) else None for i in indexes)
+        bucket = partitions.get(key)
+        if bucket is None:
+            if len(partitions) >= max_partitions:
+                raise ValueError(f"More than {max_partitions} partitions for partition_by "
+                                 f"{', '.join(columns)} (raise partition_options.max_partitions?)")
+            bucket = partitions[key] = []
+        bucket.append(row)
+    return partitions
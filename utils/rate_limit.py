@@ -0,0 +1,338 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, urlsplit
+
+from utils.concurrency import host_of
+from utils.logger import get_logger
+from utils.metrics import record
+
+logger = get_logger()
+
+# Responses that mean the upstream is overloaded.
+OVERLOAD_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Limiter settings (overridable under defaults.rate_limit):
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "max_rate": None,          # requests/s ceiling per host (None = found adaptively)
+    "burst": None,             # token bucket size (default: initial_concurrency)
+    "initial_concurrency": 4,  # concurrent requests per host to start with
+    "min_concurrency": 1,
+    "max_concurrency": 32,
+    "backoff": 0.5,            # multiplicative decrease on overload
+    "latency_factor": 3.0,     # slower than this x the usual latency = congestion
+}
+
+# Window over which the achieved request rate is measured.
+_RATE_WINDOW = 5.0
+
+# Latency samples needed before spikes are judged against the baseline.
+_MIN_LATENCY_SAMPLES = 5
+
+# Lowest rate the bucket is ever throttled down to (requests/s).
+_MIN_RATE = 0.1
+
+
+class TokenBucket:
+    """
+    Token bucket handing out reservations, so waiters sleep instead of polling.
+
+    A rate of None means unlimited.
+
+    Args:
+        rate (float): Tokens added per second.
+        burst (int): Bucket capacity.
+    """
+
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+
+    def _refill(self, now):
+        if self.rate is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def saturated(self) -> bool:
+        """Whether the bucket is empty, i.e. the rate is what limits requests."""
+        with self._lock:
+            if self.rate is None:
+                return False
+            self._refill(time.monotonic())
+            return self._tokens < 1
+
+    def reserve(self) -> float:
+        """Take a token, returning how long to wait before it may be used."""
+        with self._lock:
+            if self.rate is None:
+                return 0.0
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class Outcome:
+    """What the caller learned from a request, reported back to the limiter."""
+
+    __slots__ = ("status", "retry_after", "timed_out")
+
+    def __init__(self):
+        self.status = None
+        self.retry_after = None
+        self.timed_out = False
+
+
+class HostLimiter:
+    """
+    Adaptive limiter for one API host: a token bucket for the request rate
+    and an AIMD window for concurrent requests.
+
+    Every overload signal (a 429/5xx response, a timeout, or a response
+    much slower than the usual latency) halves the window and the rate, at
+    most once per round trip; a Retry-After additionally pauses the host.
+    Every success widens the window by about one slot per round trip and
+    raises the rate by about one request/s per second, up to max_rate.
+    Without a max_rate, the rate is unlimited until the first overload and
+    then starts from what was actually achieved.
+
+    Args:
+        host (str): Host the limiter guards (for logs and metrics).
+        **settings: See DEFAULT_SETTINGS.
+    """
+
+    def __init__(self, host, **settings):
+        self.host = host
+        self._cond = threading.Condition()
+        self.configure(**settings)
+        self.limit = float(self.initial_concurrency)
+        self.rate = self.max_rate
+        self.bucket = TokenBucket(self.rate, self.burst or self.initial_concurrency)
+        self.in_flight = 0
+        self.queued = 0
+        self.peak_queued = 0
+        self.throttled = 0
+        self._latency = {}  # latency key (see latency_key) -> (typical latency, samples)
+        self._last_decrease = 0.0
+        self._paused_until = 0.0
+        self._completed = deque()  # completion times of recent successes
+
+    def configure(self, **settings):
+        settings = {**DEFAULT_SETTINGS, **settings}
+        with self._cond:
+            self.max_rate = settings["max_rate"]
+            self.burst = settings["burst"]
+            self.initial_concurrency = settings["initial_concurrency"]
+            self.min_concurrency = settings["min_concurrency"]
+            self.max_concurrency = max(settings["max_concurrency"], self.min_concurrency)
+            self.backoff = settings["backoff"]
+            self.latency_factor = settings["latency_factor"]
+            if hasattr(self, "limit"):
+                self.limit = min(max(self.limit, self.min_concurrency), self.max_concurrency)
+                if self.max_rate is not None and (self.rate is None or self.rate > self.max_rate):
+                    self._set_rate(self.max_rate)
+            self._cond.notify_all()
+
+    def _set_rate(self, rate):
+        self.rate = rate
+        self.bucket.set_rate(rate)
+
+    @contextmanager
+    def slot(self, key=""):
+        """
+        Wait for a concurrency slot and a token, then hold the slot for the
+        block. The block reports the response through the yielded Outcome.
+
+        Args:
+            key (str): Kind of request (see latency_key); latency spikes
+                are judged against the usual latency of the same kind.
+        """
+        # The token is taken first, so requests waiting on the rate don't
+        # occupy (and seem to saturate) the concurrency window
+        wait = self.bucket.reserve()
+        with self._cond:
+            self.queued += 1
+            if wait:
+                self.peak_queued = max(self.peak_queued, self.queued)
+        try:
+            if wait:
+                time.sleep(wait)
+            with self._cond:
+                while True:
+                    pause = self._paused_until - time.monotonic()
+                    if pause <= 0 and self.in_flight < int(self.limit):
+                        break
+                    self.peak_queued = max(self.peak_queued, self.queued)
+                    self._cond.wait(pause if pause > 0 else None)
+                self.in_flight += 1
+        finally:
+            with self._cond:
+                self.queued -= 1
+        outcome = Outcome()
+        started = time.monotonic()
+        try:
+            yield outcome
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._observe(outcome, key, started, time.monotonic())
+                self._cond.notify_all()
+
+    def _achieved_rate(self, now):
+        """Successful requests per second over the last _RATE_WINDOW seconds."""
+        while self._completed and self._completed[0] < now - _RATE_WINDOW:
+            self._completed.popleft()
+        if not self._completed:
+            return None
+        return len(self._completed) / max(now - self._completed[0], 1.0)
+
+    def _observe(self, outcome, key, started, now):
+        """Apply one request's outcome to the window and the rate (lock held)."""
+        latency = now - started
+        usual, samples = self._latency.get(key, (latency, 0))
+
+        if outcome.timed_out or outcome.status in OVERLOAD_STATUSES:
+            self.throttled += 1
+            record(stage="fetch", throttled=1)
+            if outcome.retry_after:
+                self._paused_until = max(self._paused_until, now + outcome.retry_after)
+            self._decrease(now, usual, f"HTTP {outcome.status}" if outcome.status else "timeout")
+            return
+        if outcome.status is None:
+            return  # e.g. a connection error: says nothing about load
+
+        # Spikes still feed the average, so a lasting shift becomes the new usual
+        self._latency[key] = (0.9 * usual + 0.1 * latency, samples + 1)
+        self._completed.append(now)
+        if samples >= _MIN_LATENCY_SAMPLES and latency > self.latency_factor * usual:
+            self._decrease(now, usual, f"latency {latency:.2f}s vs usual {usual:.2f}s")
+            return
+        # Only grow a limit that is actually holding requests back
+        if self.in_flight + 1 >= int(self.limit):
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+        if self.rate is not None and self.bucket.saturated():
+            rate = self.rate + 1 / max(self.rate, 1.0)
+            self._set_rate(min(rate, self.max_rate) if self.max_rate is not None else rate)
+
+    def _decrease(self, now, round_trip, reason):
+        # One decrease per round trip: concurrent failures are one signal
+        if now - self._last_decrease < max(1.0, round_trip):
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit * self.backoff)
+        # Back off from the rate actually achieved, not from a ceiling that
+        # may not have been reached (e.g. when concurrency was the limit)
+        achieved = self._achieved_rate(now)
+        rate = min(filter(None, (achieved, self.rate))) if (achieved or self.rate) else None
+        if rate is not None:
+            self._set_rate(max(_MIN_RATE, rate * self.backoff))
+        logger.warning("🐢 Backing off %s (%s): %d concurrent, %s req/s",
+                       self.host, reason, int(self.limit),
+                       "unlimited" if self.rate is None else f"{self.rate:.1f}")
+
+    def stats(self, reset_peaks=False) -> dict:
+        """Current rate, window and queue depth (peak since the last reset)."""
+        with self._cond:
+            stats = {
+                "rate": round(self.rate, 3) if self.rate is not None else None,
+                "concurrency": int(self.limit),
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "peak_queued": self.peak_queued,
+                "throttled": self.throttled,
+            }
+            if reset_peaks:
+                self.peak_queued = self.queued
+        return stats
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_settings = dict(DEFAULT_SETTINGS)
+
+
+def configure_rate_limits(settings=None) -> None:
+    """
+    Configure the process-wide per-host limiters (applies to existing ones too).
+
+    Args:
+        settings (Mapping): defaults.rate_limit from the plan (see DEFAULT_SETTINGS).
+    """
+    with _limiters_lock:
+        _settings.clear()
+        _settings.update(DEFAULT_SETTINGS, **(settings or {}))
+        limiters = list(_limiters.values())
+    options = {key: value for key, value in _settings.items() if key != "enabled"}
+    for limiter in limiters:
+        limiter.configure(**options)
+
+
+def get_limiter(url):
+    """
+    Return the shared limiter for a URL's host, or None when rate limiting
+    is disabled.
+    """
+    host = host_of(url)
+    with _limiters_lock:
+        if not _settings["enabled"]:
+            return None
+        limiter = _limiters.get(host)
+        if limiter is None:
+            options = {key: value for key, value in _settings.items() if key != "enabled"}
+            limiter = _limiters[host] = HostLimiter(host, **options)
+        return limiter
+
+
+def latency_key(url) -> str:
+    """
+    Kind of request a latency baseline is kept for: the path plus the names
+    (not values) of its query parameters. Queries of different shapes on
+    one path (e.g. a whole dataset vs one with an extra filter) can take
+    very different times to answer, while shards of one query, which only
+    differ in parameter values, share a baseline.
+    """
+    parts = urlsplit(url)
+    names = sorted({name for name, _ in parse_qsl(parts.query, keep_blank_values=True)})
+    return f"{parts.path}?{'&'.join(names)}" if names else parts.path
+
+
+@contextmanager
+def request_slot(url):
+    """
+    Hold a rate-limited request slot for the URL's host for the block.
+
+    Yields:
+        Outcome: Set `status`, `retry_after` and/or `timed_out` on it so
+        the limiter can adapt (a no-op when rate limiting is disabled).
+    """
+    limiter = get_limiter(url)
+    if limiter is None:
+        yield Outcome()
+        return
+    with limiter.slot(latency_key(url)) as outcome:
+        yield outcome
+
+
+def rate_limit_stats(reset_peaks=False) -> dict:
+    """
+    Per-host limiter state, e.g. for the run summary.
+
+    Args:
+        reset_peaks (bool): Start a new peak queue depth measurement.
+
+    Returns:
+        dict: host -> {'rate', 'concurrency', 'in_flight', 'queued',
+        'peak_queued', 'throttled'}.
+    """
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {host: limiter.stats(reset_peaks) for host, limiter in sorted(limiters.items())}
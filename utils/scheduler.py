@@ -0,0 +1,166 @@
+import json
+import math
+import os
+import re
+import time
+import zlib
+
+from utils.logger import get_logger
+from utils.storage_handler import write_file_atomically
+
+logger = get_logger()
+
+# Scheduler defaults (overridable under defaults.scheduler):
+DEFAULT_TICK = 60.0          # longest sleep between checks for due endpoints
+DEFAULT_JITTER = 300.0       # max per-endpoint start offset, in seconds
+DEFAULT_RETRY_AFTER = 300.0  # failed endpoints are retried this much later
+
+_INTERVAL_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+_INTERVAL_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*$")
+
+
+def parse_interval(value) -> float:
+    """
+    Parse a refresh interval: seconds as a number, or a string with a unit
+    suffix (s, m, h, d, w), e.g. '90s', '15m', '1h', '365d'.
+
+    Args:
+        value (int, float or str): Interval.
+
+    Returns:
+        float: Interval in seconds.
+
+    Raises:
+        ValueError: If the value is not a positive interval.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"invalid interval {value!r}")
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        match = _INTERVAL_PATTERN.match(str(value))
+        if not match:
+            raise ValueError(f"invalid interval {value!r} (expected e.g. 900, '15m', '1h', '7d')")
+        seconds = float(match.group(1)) * _INTERVAL_UNITS[match.group(2) or "s"]
+    if seconds <= 0:
+        raise ValueError(f"interval must be positive, got {value!r}")
+    return seconds
+
+
+def start_offset(name, interval, jitter=DEFAULT_JITTER) -> float:
+    """
+    Stable per-endpoint phase within min(jitter, interval) seconds.
+
+    Derived from the endpoint name, so endpoints sharing an interval start
+    at different times and keep the same phase across restarts.
+    """
+    return zlib.crc32(name.encode("utf-8")) / 2 ** 32 * min(jitter, interval)
+
+
+def next_due(name, interval, last_run, last_status=None, jitter=DEFAULT_JITTER,
+             retry_after=DEFAULT_RETRY_AFTER) -> float:
+    """
+    When an endpoint is next due, as a Unix timestamp.
+
+    Runs fall on a fixed grid (multiples of `interval` since the epoch,
+    shifted by the endpoint's start offset), so an hourly endpoint keeps
+    firing at the same minute however long each run takes. Runs missed
+    while nothing was running collapse into a single catch-up run. Endpoints
+    that never ran are due immediately; failed ones are retried after
+    `retry_after` (or their interval, if shorter). Endpoints without an
+    interval are not scheduled, so they are never due.
+
+    Args:
+        name (str): Endpoint name.
+        interval (float): Refresh interval in seconds (None = not scheduled).
+        last_run (float): Start time of the last run (None = never ran).
+        last_status (str): Status of the last run.
+        jitter (float): Max start offset in seconds.
+        retry_after (float): Delay before retrying a failed run.
+
+    Returns:
+        float: Unix timestamp (math.inf if not scheduled).
+    """
+    if interval is None:
+        return math.inf
+    if last_run is None:
+        return 0.0
+    if last_status in ("failed", "partial"):
+        return last_run + min(retry_after, interval)
+    offset = start_offset(name, interval, jitter)
+    return (math.floor((last_run - offset) / interval) + 1) * interval + offset
+
+
+class Schedule:
+    """
+    Persisted last-run state of an environment's endpoints and the
+    due-time calculation built on it.
+
+    State is one small JSON file per environment in the pipeline's state
+    directory, mapping endpoint name -> {'last_run', 'status'}. Only
+    endpoints with a refresh_interval are scheduled; the others only run
+    in full (unscheduled) pipeline runs.
+
+    Args:
+        env (str): Environment name.
+        plan (Mapping): Execution plan (see utils.config_loader.load_plan).
+        state_dir (str): Directory holding the state file.
+    """
+
+    def __init__(self, env, plan, state_dir):
+        self.plan = plan
+        settings = plan["defaults"].get("scheduler") or {}
+        self.tick = settings.get("tick", DEFAULT_TICK)
+        self.jitter = settings.get("jitter", DEFAULT_JITTER)
+        self.retry_after = settings.get("retry_after", DEFAULT_RETRY_AFTER)
+        self.path = os.path.join(state_dir, f"schedule_{env.lower()}.json")
+        self.state = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning("⚠️ Ignoring unreadable schedule state %s: %s", self.path, e)
+            return {}
+
+    def due_at(self, endpoint) -> float:
+        """Unix timestamp at which an endpoint is next due."""
+        last = self.state.get(endpoint["name"]) or {}
+        return next_due(endpoint["name"], endpoint["refresh_seconds"], last.get("last_run"),
+                        last.get("status"), self.jitter, self.retry_after)
+
+    def due(self, now=None) -> list:
+        """
+        Names of the endpoints due at `now`, highest priority first (ties
+        keep config order), which is the order they are started in.
+        """
+        now = time.time() if now is None else now
+        due = [endpoint for endpoint in self.plan["endpoints"] if self.due_at(endpoint) <= now]
+        return [endpoint["name"] for endpoint in sorted(due, key=lambda endpoint: -endpoint["priority"])]
+
+    def unscheduled(self) -> list:
+        """Names of the endpoints without a refresh_interval (never due)."""
+        return [endpoint["name"] for endpoint in self.plan["endpoints"] if endpoint["refresh_seconds"] is None]
+
+    def seconds_until_due(self, now=None) -> float:
+        """Seconds until the next endpoint is due, capped at the tick."""
+        now = time.time() if now is None else now
+        soonest = min(map(self.due_at, self.plan["endpoints"]), default=math.inf)
+        return max(0.0, min(soonest - now, self.tick))
+
+    def record(self, summary, started) -> None:
+        """
+        Record a run's outcome per endpoint and persist it (atomic replace).
+
+        Args:
+            summary (dict): Run summary returned by run_pipeline.
+            started (float): Unix timestamp the run started at.
+        """
+        for name, result in summary["endpoints"].items():
+            self.state[name] = {"last_run": started, "status": result["status"]}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        text = json.dumps(self.state, indent=2)
+        write_file_atomically(self.path, lambda f: f.write(text.encode("utf-8")))
@@ -0,0 +1,153 @@
+import time
+from itertools import product
+
+from utils.concurrency import imap_bounded
+from utils.logger import get_logger
+from utils.metrics import record
+
+logger = get_logger()
+
+# FIPS codes for the 50 states, DC and Puerto Rico ('all' in a shard spec).
+STATE_FIPS = [
+    "01", "02", "04", "05", "06", "08", "09", "10", "11", "12", "13", "15", "16",
+    "17", "18", "19", "20", "21", "22", "23", "24", "25", "26", "27", "28", "29",
+    "30", "31", "32", "33", "34", "35", "36", "37", "38", "39", "40", "41", "42",
+    "44", "45", "46", "47", "48", "49", "50", "51", "53", "54", "55", "56", "72",
+]
+
+
+def expand_shard_values(name, value) -> list:
+    """
+    Expand one shard parameter into its list of values.
+
+    Args:
+        name (str): Placeholder name, e.g. 'state' or 'YEAR'.
+        value: 'all' (states only), an inclusive 'start-end' range such as
+            '2019-2023' (zero padding of `start` is kept), a list, or a scalar.
+
+    Returns:
+        list: String values for the placeholder.
+
+    Raises:
+        ValueError: If the value cannot be expanded.
+    """
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value]
+    value = str(value)
+    if value == "all":
+        if name.lower() != "state":
+            raise ValueError(f"'all' is only supported for the state shard, not '{name}'")
+        return list(STATE_FIPS)
+    if "-" in value:
+        start, end = value.split("-", 1)
+        if not (start.isdigit() and end.isdigit()) or int(end) < int(start):
+            raise ValueError(f"Invalid shard range for '{name}': {value}")
+        return [str(n).zfill(len(start)) for n in range(int(start), int(end) + 1)]
+    return [value]
+
+
+def build_shards(url, params) -> list:
+    """
+    Generate one sub-request per combination of shard parameter values.
+
+    Each '{name}' placeholder in the URL is replaced by the values of the
+    matching shard parameter, e.g. 'in=state:{state}' with state: all.
+
+    Args:
+        url (str): URL template.
+        params (dict): Shard parameters, name -> spec (see expand_shard_values).
+
+    Returns:
+        list: (label, url) tuples; label is a dict of the substituted values.
+
+    Raises:
+        ValueError: If a parameter has no placeholder in the URL.
+    """
+    names = list(params)
+    for name in names:
+        if f"{{{name}}}" not in url:
+            raise ValueError(f"Shard parameter '{name}' has no {{{name}}} placeholder in {url}")
+    value_lists = [expand_shard_values(name, params[name]) for name in names]
+
+    shards = []
+    for values in product(*value_lists):
+        shard_url = url
+        for name, value in zip(names, values):
+            shard_url = shard_url.replace(f"{{{name}}}", value)
+        shards.append((dict(zip(names, values)), shard_url))
+    return shards
+
+
+def _fetch_shard(fetch, label, url, retries, backoff):
+    """Fetch one shard, retrying it on its own before giving up."""
+    for attempt in range(retries + 1):
+        try:
+            return fetch(url)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff * (2 ** attempt)
+            logger.warning("🔁 Shard %s failed (%s); retrying in %.1fs", label, e, delay)
+            record(stage="fetch", retries=1)
+            time.sleep(delay)
+
+
+def _load_or_fetch_shard(fetch, label, url, retries, backoff, spool):
+    """Rows of a shard spooled by an earlier attempt, else fetch (and spool) it."""
+    if spool is not None:
+        data = spool.load(label)
+        if data is not None:
+            logger.info("📦 Reusing shard %s from an earlier attempt", label)
+            return data
+    data = _fetch_shard(fetch, label, url, retries, backoff)
+    if spool is not None:
+        spool.save(label, data)
+    return data
+
+
+def fetch_sharded_rows(shards, fetch, max_workers=4, retries=2, backoff=1.0, spool=None):
+    """
+    Fetch shards in parallel and stream-merge them into one header+rows stream.
+
+    Shards run on a bounded pool and are merged in shard order; each
+    shard's rows are released once yielded. Failed shards are retried
+    individually (`retries` extra attempts each) without refetching the
+    others. The header is emitted once and every shard must return the
+    same header.
+
+    Args:
+        shards (list): (label, url) tuples from build_shards.
+        fetch (callable): Function fetching one URL, returning list-of-lists.
+        max_workers (int): Shards fetched concurrently.
+        retries (int): Extra attempts per failed shard.
+        backoff (float): Base delay between shard retries in seconds.
+        spool (ShardSpool): Optional store of completed shards (see
+            utils.manifest); shards found in it are not fetched again and
+            fetched ones are saved to it, so a resumed run only refetches
+            the shards that failed.
+
+    Yields:
+        list: The header row, then data rows of all shards.
+
+    Raises:
+        RuntimeError: If a shard still fails after its retries.
+        ValueError: If shards disagree on the header.
+    """
+    header = None
+    outcomes = imap_bounded(
+        lambda shard: _load_or_fetch_shard(fetch, shard[0], shard[1], retries, backoff, spool),
+        shards,
+        max_workers=max_workers,
+    )
+    for (label, url), data, error in outcomes:
+        if error is not None:
+            raise RuntimeError(f"Shard {label} failed after {retries + 1} attempt(s): {error}") from error
+        if not data:
+            continue
+        if header is None:
+            header = data[0]
+            yield header
+        elif data[0] != header:
+            raise ValueError(f"Shard {label} returned a different header: {data[0]} != {header}")
+        yield from data[1:]
+        logger.info("🧩 Merged shard %s (%d rows)", label, len(data) - 1)
@@ -1,106 +1,427 @@
-# import os
-# from datetime import datetime
-# from utils.logger import get_logger
-
-# logger = get_logger()
-
-# def save_local(data, fmt, endpoint_name, base_path="output"):
-#     folder = os.path.join(base_path, fmt, endpoint_name)
-#     os.makedirs(folder, exist_ok=True)
-#     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-#     file_path = os.path.join(folder, f"{endpoint_name}_{timestamp}.{fmt}")
-
-#     with open(file_path, "w", encoding="utf-8") as f:
-#         f.write(data)
-
-#     logger.info(f"💾 Saved locally: {file_path}")
-#     return file_path
-##############################################################################TESTEDCODE##############################
-# import os
-# from datetime import datetime
-# from utils.logger import get_logger
-
-# logger = get_logger()
-
-# def save_local_file(content: str, file_extension: str = "txt", file_name: str = None, folder: str = "output") -> str:
-#     """
-#     Save content to a local file with a timestamped name.
-
-#     Args:
-#         content (str): The data to write to the file.
-#         file_extension (str): File format/extension (e.g., 'json', 'csv', 'txt').
-#         file_name (str): Optional base name for the file. Defaults to 'data'.
-#         folder (str): Directory to save the file in.
-
-#     Returns:
-#         str: Full path to the saved file.
-#     """
-#     os.makedirs(folder, exist_ok=True)
-#     timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-#     base_name = file_name or "data"
-#     full_name = f"{base_name}_{timestamp}.{file_extension}"
-#     file_path = os.path.join(folder, full_name)
-
-#     with open(file_path, "w", encoding="utf-8") as f:
-#         f.write(content)
-
-#     logger.info(f"💾 Saved file: {file_path}")
-
-#     return file_path
-    ########################################### END##########################################
-
-import os
-from datetime import datetime
-from utils.logger import get_logger
-
-logger = get_logger()
-
-
-def is_running_in_gcf() -> bool:
-    """
-    Detect if the code is running inside Google Cloud Functions.
-
-    Returns:
-        bool: True if running inside GCF, False otherwise.
-    """
-    return "K_SERVICE" in os.environ or "FUNCTION_NAME" in os.environ
-
-
-def save_local_file(
-    content: str,
-    file_extension: str = "txt",
-    file_name: str = None,
-    folder: str = "output"
-) -> str:
-    """
-    Save content to a local file with a timestamped name.
-    Works in both local and Google Cloud Function environments.
-
-    Args:
-        content (str): The data to write to the file.
-        file_extension (str): File format/extension (e.g., 'json', 'csv', 'txt').
-        file_name (str): Optional base name for the file. Defaults to 'data'.
-        folder (str): Directory to save the file in (ignored in GCF).
-
-    Returns:
-        str: Full path to the saved file.
-    """
-    # If running in GCF, always use /tmp
-    if is_running_in_gcf():
-        folder = "/tmp"
-
-    # Ensure folder exists
-    os.makedirs(folder, exist_ok=True)
-
-    # Create timestamped filename
-    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    base_name = file_name or "data"
-    full_name = f"{base_name}_{timestamp}.{file_extension}"
-    file_path = os.path.join(folder, full_name)
-
-    # Write file
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(content)
-
-    logger.info(f"💾 Saved file: {file_path}")
-    return file_path
+# import os
+# from datetime import datetime
+# from utils.logger import get_logger
+
+# logger = get_logger()
+
+# def save_local(data, fmt, endpoint_name, base_path="output"):
+#     folder = os.path.join(base_path, fmt, endpoint_name)
+#     os.makedirs(folder, exist_ok=True)
+#     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+#     file_path = os.path.join(folder, f"{endpoint_name}_{timestamp}.{fmt}")
+
+#     with open(file_path, "w", encoding="utf-8") as f:
+#         f.write(data)
+
+#     logger.info(f"💾 Saved locally: {file_path}")
+#     return file_path
+##############################################################################TESTEDCODE##############################
+# import os
+# from datetime import datetime
+# from utils.logger import get_logger
+
+# logger = get_logger()
+
+# def save_local_file(content: str, file_extension: str = "txt", file_name: str = None, folder: str = "output") -> str:
+#     """
+#     Save content to a local file with a timestamped name.
+
+#     Args:
+#         content (str): The data to write to the file.
+#         file_extension (str): File format/extension (e.g., 'json', 'csv', 'txt').
+#         file_name (str): Optional base name for the file. Defaults to 'data'.
+#         folder (str): Directory to save the file in.
+
+#     Returns:
+#         str: Full path to the saved file.
+#     """
+#     os.makedirs(folder, exist_ok=True)
+#     timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+#     base_name = file_name or "data"
+#     full_name = f"{base_name}_{timestamp}.{file_extension}"
+#     file_path = os.path.join(folder, full_name)
+
+#     with open(file_path, "w", encoding="utf-8") as f:
+#         f.write(content)
+
+#     logger.info(f"💾 Saved file: {file_path}")
+
+#     return file_path
+    ########################################### END##########################################
+
+import base64
+import gzip
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from datetime import datetime
+from utils.env import is_running_in_gcf  # also imported from here by older callers
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# File suffix appended for each supported compression codec.
+COMPRESSION_EXTENSIONS = {"gzip": "gz", "zstd": "zst"}
+
+# Content-Type by (uncompressed) file extension, used for uploads.
+CONTENT_TYPES = {
+    "csv": "text/csv",
+    "json": "application/json",
+    "txt": "text/plain",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file",
+}
+
+
+# Checksums of files written through open_output_file, keyed by path, until
+# the upload that needs them has run (see forget_checksums).
+_checksums = {}
+_checksums_lock = threading.Lock()
+
+# Output files still being written, keyed by path (see discard_output_file).
+_open_outputs = {}
+
+
+def _new_crc32c():
+    """crc32c hasher if google-crc32c is installed (it ships with google-cloud-storage)."""
+    try:
+        import google_crc32c
+    except ImportError:
+        return None
+    return google_crc32c.Checksum()
+
+
+def _encode_checksums(md5, crc32c) -> dict:
+    """Encode digests the way GCS reports them (base64 of the raw digest)."""
+    return {
+        "md5": base64.b64encode(md5.digest()).decode("ascii"),
+        "crc32c": base64.b64encode(crc32c.digest()).decode("ascii") if crc32c is not None else None,
+    }
+
+
+class _HashingFile(io.RawIOBase):
+    """
+    Binary sink that hashes every byte on its way to disk and/or to a tee
+    stream (e.g. a GCS upload). Closing it finalizes the tee; a discarded
+    file never finalizes its tee.
+    """
+
+    def __init__(self, file_path, tee=None, local=True):
+        self._fh = open(file_path, "wb") if local else None
+        self._tee = tee
+        self._path = file_path
+        self._md5 = hashlib.md5()
+        self._crc32c = _new_crc32c()
+        self._size = 0
+        self.discarded = False
+        with _checksums_lock:
+            _open_outputs[file_path] = self
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        view = memoryview(data).cast("B")
+        if self._fh is not None:
+            self._fh.write(view)
+        if self._tee is not None:
+            self._tee.write(view)
+        self._md5.update(view)
+        if self._crc32c is not None:
+            self._crc32c.update(bytes(view))
+        self._size += len(view)
+        return len(view)
+
+    def tell(self):
+        return self._size
+
+    def flush(self):
+        if self._fh is not None and not self._fh.closed:
+            self._fh.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        try:
+            if self._fh is not None:
+                self._fh.close()
+        finally:
+            with _checksums_lock:
+                _open_outputs.pop(self._path, None)
+        if self.discarded:
+            return
+        if self._tee is not None:
+            self._tee.close()
+        if self._fh is not None:
+            with _checksums_lock:
+                _checksums[self._path] = _encode_checksums(self._md5, self._crc32c)
+
+
+class _GzipFile(gzip.GzipFile):
+    """GzipFile that also closes the file object it writes into."""
+
+    def close(self):
+        fileobj = self.fileobj
+        try:
+            super().close()
+        finally:
+            if fileobj is not None:
+                fileobj.close()
+
+
+def file_checksums(file_path: str) -> dict:
+    """
+    Content checksums of a local file, as GCS reports them.
+
+    Files written through open_output_file were hashed while being written;
+    anything else is hashed by reading it once.
+
+    Args:
+        file_path (str): Local file.
+
+    Returns:
+        dict: {'md5': base64, 'crc32c': base64 or None}.
+    """
+    with _checksums_lock:
+        cached = _checksums.get(file_path)
+    if cached is not None:
+        return cached
+    md5, crc32c = hashlib.md5(), _new_crc32c()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(chunk)
+            if crc32c is not None:
+                crc32c.update(chunk)
+    return _encode_checksums(md5, crc32c)
+
+
+def forget_checksums(file_path: str) -> None:
+    """
+    Drop the checksums recorded for a file written through open_output_file.
+
+    Called once the file has been uploaded (or will not be), so a long-lived
+    process does not keep an entry for every file it ever wrote.
+
+    Args:
+        file_path (str): Local file.
+    """
+    with _checksums_lock:
+        _checksums.pop(file_path, None)
+
+
+def compressed_path(file_path: str, compression: str = None) -> str:
+    """
+    Append the codec suffix for `compression` to a file path.
+
+    Args:
+        file_path (str): Uncompressed path, e.g. 'output/data.csv'.
+        compression (str): None, 'gzip' or 'zstd'.
+
+    Returns:
+        str: e.g. 'output/data.csv.gz'.
+
+    Raises:
+        ValueError: If the codec is unsupported.
+    """
+    if not compression:
+        return file_path
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError(f"Unsupported compression: {compression}")
+    return f"{file_path}.{COMPRESSION_EXTENSIONS[compression]}"
+
+
+def open_output_file(file_path: str, binary: bool = False, compression: str = None, level: int = None,
+                     tee=None, local: bool = True):
+    """
+    Open a file for writing, compressing on the fly if requested.
+
+    Data is compressed as it is written, so no uncompressed copy ever
+    touches disk and no second compression pass is needed. The bytes that
+    reach disk are hashed on the way (see file_checksums). Compressed
+    output is deterministic (no gzip name/mtime), so identical content
+    always hashes the same.
+
+    The final bytes can also be copied into a `tee` stream as they are
+    produced (e.g. a GCS upload from gcs_handler.open_upload_stream), with
+    or without the local file; closing the handle closes the tee.
+
+    Args:
+        file_path (str): Destination path (already including any codec suffix).
+        binary (bool): Return a binary handle instead of a UTF-8 text handle.
+        compression (str): None, 'gzip' or 'zstd'.
+        level (int): Optional codec compression level.
+        tee (io.RawIOBase): Optional binary stream receiving the same bytes.
+        local (bool): Write the local file (False: tee only; file_path
+            then only names the output).
+
+    Returns:
+        file: Writable handle; closing it finalizes the compressed stream
+        and the tee.
+
+    Raises:
+        ValueError: If the codec is unsupported.
+    """
+    if compression not in (None, "", "gzip", "zstd"):
+        raise ValueError(f"Unsupported compression: {compression}")
+
+    if not local and tee is None:
+        raise ValueError("open_output_file needs a local file or a tee")
+
+    hashing = _HashingFile(file_path, tee=tee, local=local)
+    if not compression:
+        raw = io.BufferedWriter(hashing)
+    elif compression == "gzip":
+        raw = _GzipFile(filename="", mode="wb", fileobj=hashing,
+                        compresslevel=6 if level is None else level, mtime=0)
+    else:
+        try:
+            import zstandard
+        except ImportError as e:
+            hashing.close()
+            raise ImportError("zstandard is required for zstd compression (pip install zstandard)") from e
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+        raw = compressor.stream_writer(hashing, closefd=True)
+
+    if binary:
+        return raw
+    return io.TextIOWrapper(raw, encoding="utf-8", newline="")
+
+
+def output_size(file_path: str, fh) -> int:
+    """
+    Bytes an output opened with open_output_file has produced so far, as
+    they reach the local file and/or the tee (i.e. after compression).
+
+    The handle is flushed first, so only what an encoder still holds back
+    (e.g. rows a columnar writer has not yet written as a row group) is
+    not counted yet.
+
+    Args:
+        file_path (str): Path the output was opened with.
+        fh (file): The handle returned by open_output_file.
+
+    Returns:
+        int: Bytes written so far (0 once the output is closed).
+    """
+    fh.flush()
+    with _checksums_lock:
+        hashing = _open_outputs.get(file_path)
+    return hashing.tell() if hashing is not None else 0
+
+
+def discard_output_file(file_path: str, fh) -> None:
+    """
+    Abandon an output opened with open_output_file after a failure: the
+    handle is closed without finalizing its tee (a partial upload never
+    becomes an object) and the local file, if any, is removed.
+
+    Args:
+        file_path (str): Path the output was opened with.
+        fh (file): The handle returned by open_output_file.
+    """
+    with _checksums_lock:
+        hashing = _open_outputs.get(file_path)
+    if hashing is not None:
+        hashing.discarded = True
+    try:
+        fh.close()
+    except Exception:
+        pass  # the stream is being thrown away anyway
+    if hashing is not None and not hashing.closed:
+        hashing.close()  # a wrapper failed before closing its sink
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def write_file_atomically(file_path: str, write) -> None:
+    """
+    Write a (state) file through a uniquely named temp file in its
+    directory, then rename it into place, so concurrent writers never share
+    a temp file and readers never see a partial one.
+
+    Args:
+        file_path (str): Destination file; its directory must exist.
+        write (callable): Writes the content to the binary file object it is given.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or ".", suffix=".tmp")
+    try:
+        with open(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def content_headers(file_path: str) -> tuple:
+    """
+    Derive upload headers from a file name.
+
+    Args:
+        file_path (str): e.g. 'data.csv.gz'.
+
+    Returns:
+        tuple: (content_type, content_encoding); content_encoding is None
+        for uncompressed files. A gzip file is served as its underlying
+        type with Content-Encoding: gzip so GCS can transcode it for
+        readers that do not accept gzip.
+    """
+    name = os.path.basename(file_path)
+    content_encoding = None
+    for codec, suffix in COMPRESSION_EXTENSIONS.items():
+        if name.endswith(f".{suffix}"):
+            content_encoding = codec
+            name = name[: -len(suffix) - 1]
+            break
+    extension = name.rsplit(".", 1)[-1] if "." in name else ""
+    return CONTENT_TYPES.get(extension, "application/octet-stream"), content_encoding
+
+
+def save_local_file(
+    content: str,
+    file_extension: str = "txt",
+    file_name: str = None,
+    folder: str = "output",
+    compression: str = None
+) -> str:
+    """
+    Save content to a local file with a timestamped name.
+    Works in both local and Google Cloud Function environments.
+
+    Args:
+        content (str): The data to write to the file.
+        file_extension (str): File format/extension (e.g., 'json', 'csv', 'txt').
+        file_name (str): Optional base name for the file. Defaults to 'data'.
+        folder (str): Directory to save the file in (ignored in GCF).
+        compression (str): Optional codec ('gzip' or 'zstd') applied while writing.
+
+    Returns:
+        str: Full path to the saved file.
+    """
+    # If running in GCF, always use /tmp
+    if is_running_in_gcf():
+        folder = "/tmp"
+
+    # Ensure folder exists
+    os.makedirs(folder, exist_ok=True)
+
+    # Create timestamped filename
+    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    base_name = file_name or "data"
+    full_name = f"{base_name}_{timestamp}.{file_extension}"
+    file_path = compressed_path(os.path.join(folder, full_name), compression)
+
+    # Write file (compressed on the fly if requested)
+    with open_output_file(file_path, compression=compression) as f:
+        f.write(content)
+
+    logger.info("💾 Saved file: %s", file_path)
+    return file_path
@@ -0,0 +1,194 @@
+import json
+from itertools import chain
+
+# Cell types the pandas-free paths render exactly like DataFrame.to_csv.
+_PLAIN_CELL_TYPES = {str, type(None)}
+
+# How flatten_records renders nested (dict/list) field values:
+#   keep    - as the dict/list itself (what the pandas reshaping produced)
+#   json    - as compact JSON text
+#   columns - as dotted columns (e.g. values.item), down to max_depth levels,
+#             deeper values as JSON text
+NESTED_MODES = ("keep", "json", "columns")
+
+# Levels of nesting expanded into columns by the 'columns' mode.
+DEFAULT_MAX_DEPTH = 1
+
+
+class Table:
+    """
+    Compact tabular form of an API payload: column names plus row arrays.
+
+    Payloads are normalized into a Table once, and every tabular encoder
+    (csv, ...) reads from it instead of re-shaping the raw payload. The raw
+    payload is kept as `source` for formats that serialize it verbatim.
+
+    Attributes:
+        columns (list): Column names.
+        rows (list): Rows as lists aligned with `columns` (nulls as None).
+        source (dict or list): The original payload.
+    """
+
+    __slots__ = ("columns", "rows", "source")
+
+    def __init__(self, columns, rows, source=None):
+        self.columns = list(columns)
+        self.rows = rows
+        self.source = source
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def _table_from_frame(df, source) -> Table:
+    """Convert a DataFrame to a Table, mapping NaN to None."""
+    values = df.astype(object).where(df.notna(), None).values.tolist()
+    return Table(list(df.columns), values, source)
+
+
+def _to_json(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _flatten_fields(record, prefix, separator, depth, out):
+    """Add a record's fields to `out` as dotted keys, `depth` levels deep."""
+    for key, value in record.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and depth > 0:
+            _flatten_fields(value, f"{name}{separator}", separator, depth - 1, out)
+        elif isinstance(value, (dict, list)):
+            out[name] = _to_json(value)
+        else:
+            out[name] = value
+    return out
+
+
+def flatten_records(records, index_name="index", nested="keep", max_depth=DEFAULT_MAX_DEPTH,
+                    separator=".") -> Table:
+    """
+    Flatten a dict-of-dicts payload (e.g. the ACS variables.json
+    'variables' object) into one row per record.
+
+    Columns are the record-key column followed by the union of all field
+    names in order of first appearance, computed in a single pass; each
+    row is then read straight out of its record in that order, with None
+    for missing fields, without building (and transposing) a frame with
+    one column per record.
+
+    With nested='keep' the CSV matches the
+    pd.DataFrame(records).T.reset_index() reshaping it replaces, except
+    for records whose fields are all numbers and that also hold a float or
+    lack one of the columns: pandas stored such a record as a float column
+    before transposing, so its integers were written as floats (0 as 0.0,
+    and inexactly beyond 2**53). Here values are written as given.
+
+    Args:
+        records (dict): Record key -> dict of fields.
+        index_name (str): Name of the record-key column.
+        nested (str): Rendering of dict/list field values (see NESTED_MODES).
+        max_depth (int): Dict levels expanded by nested='columns'.
+        separator (str): Joins the names of expanded fields.
+
+    Returns:
+        Table: Flattened rows (its source is `records`).
+
+    Raises:
+        ValueError: If `nested` is not one of NESTED_MODES.
+    """
+    if nested not in NESTED_MODES:
+        raise ValueError(f"Unsupported nested mode: {nested} (expected one of {', '.join(NESTED_MODES)})")
+    source = records
+    if nested == "columns":
+        records = {key: _flatten_fields(record, "", separator, max_depth, {})
+                   for key, record in records.items()}
+    columns = list(dict.fromkeys(chain.from_iterable(records.values())))
+    rows = [[key, *map(record.get, columns)] for key, record in records.items()]
+    if nested == "json":
+        for row in rows:
+            for i, value in enumerate(row):
+                if isinstance(value, (dict, list)):
+                    row[i] = _to_json(value)
+    return Table([index_name, *columns], rows, source)
+
+
+def is_header_rows(data) -> bool:
+    """
+    Check whether data has the Census list-of-lists shape that can be used
+    as-is: a header row of column names followed by rows of strings/nulls.
+
+    pandas only applies the header when the widest data row is exactly as
+    wide as it (shorter rows are padded with nulls); otherwise
+    pd.DataFrame(data[1:], columns=data[0]) raises and the payload falls
+    back to a positional frame, so those shapes are left to pandas.
+
+    Args:
+        data: Raw payload.
+
+    Returns:
+        bool: True if no pandas reshaping is needed.
+    """
+    if not isinstance(data, list) or not data or not isinstance(data[0], list):
+        return False
+    if not all(isinstance(row, list) for row in data):
+        return False
+    if len(data) > 1 and max(map(len, data[1:])) != len(data[0]):
+        return False  # pandas falls back to a positional frame here
+    return set(map(type, chain.from_iterable(data))) <= _PLAIN_CELL_TYPES
+
+
+def normalize_payload(data, flatten=None) -> Table:
+    """
+    Normalize a raw API payload into a Table, exactly once.
+
+    The reshaping mirrors what format_data has always done for CSV, so
+    encoders produce the same output as before:
+        - Census list-of-lists: header row becomes the columns (no copy of
+          the cells, no pandas).
+        - {"variables": {...}} dict-of-dicts: one row per variable with an
+          'index' column holding the variable name (see flatten_records;
+          no pandas).
+        - dict of lists: one row per key.
+        - any other dict: a single row.
+        - any other list: pandas' positional frame.
+
+    Args:
+        data (dict or list): Raw payload.
+        flatten (Mapping): Options for flattening the variables payload
+            (the endpoint's 'flatten' section): 'nested', 'max_depth' and
+            'separator' as in flatten_records.
+
+    Returns:
+        Table: Normalized table referencing `data` as its source.
+
+    Raises:
+        TypeError: If data is neither a dict nor a list.
+    """
+    if not isinstance(data, (dict, list)):
+        raise TypeError("Data must be a dict or list.")
+
+    if is_header_rows(data):
+        return Table(data[0], data[1:], data)
+
+    variables = data.get("variables") if isinstance(data, dict) else None
+    if isinstance(variables, dict) and all(isinstance(v, dict) for v in variables.values()):
+        table = flatten_records(variables, **(flatten or {}))
+        table.source = data
+        return table
+
+    # pandas is only imported for the shapes that need reshaping
+    import pandas as pd
+
+    if isinstance(data, dict):
+        if "variables" in data and isinstance(data["variables"], dict):
+            df = pd.DataFrame(data["variables"]).T.reset_index()
+        elif all(isinstance(v, (list, tuple)) for v in data.values()):
+            df = pd.DataFrame.from_dict(data, orient='index').reset_index()
+        else:
+            df = pd.DataFrame([data])
+    else:
+        try:
+            df = pd.DataFrame(data[1:], columns=data[0])
+        except Exception:
+            df = pd.DataFrame(data)
+
+    return _table_from_frame(df, data)